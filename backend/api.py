@@ -17,19 +17,30 @@ from routes import (
     incidents_router,
     analytics_router,
     alerts_router,
-    chat_router
+    chat_router,
+    metrics_router
 )
 
 from contextlib import asynccontextmanager
 from workers.alert_worker import alert_worker
+from workers.analysis_jobs import analysis_job_manager
+from services.llm_client import start_llm_client, close_llm_client
+from services.incident_writer import close_incident_writer
+from services.credential_manager import flush_last_used
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Start the alert worker
+    # Startup: Shared LLM connection pool, then the background workers
+    await start_llm_client()
     await alert_worker.start()
+    await analysis_job_manager.start()
     yield
-    # Shutdown: Stop the alert worker
+    # Shutdown: Stop the workers, flush queued incident and last_used writes, then drain the LLM pool
+    await analysis_job_manager.stop()
     await alert_worker.stop()
+    await close_incident_writer()
+    await flush_last_used()
+    await close_llm_client()
 
 app = FastAPI(
     title="Cloud RCA - Self-Healing Dashboard",
@@ -64,6 +75,7 @@ app.include_router(incidents_router)
 app.include_router(analytics_router)
 app.include_router(alerts_router)
 app.include_router(chat_router)
+app.include_router(metrics_router)
 
 # Legacy endpoint for backwards compatibility
 from pydantic import BaseModel
@@ -75,7 +87,7 @@ class AnalyzeRequest(BaseModel):
 
 @app.post("/api/analyze")
 async def legacy_analyze_endpoint(request: AnalyzeRequest):
-    """Legacy endpoint - redirects to /analyze/start"""
+    """Legacy endpoint - runs the analysis inside the request (/analyze/start now queues a job)"""
     try:
         from core.agent import run_analysis_for_api
         result = await run_analysis_for_api(
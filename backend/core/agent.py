@@ -3,7 +3,8 @@ from typing import Optional
 import sys
 import json
 import asyncio
-# import httpx - Moved inside function
+import heapq
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 import firebase_admin
@@ -16,6 +17,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # --- 1. LIVE INTEGRATION ---
 try:
     from services.log_collector import authenticate, fetch_logs
+    from services.log_sources import create_log_source, log_source_type
+    from services.template_miner import get_template_miner
+    from services.analysis_cache import STALE, evidence_signature, get_analysis_cache
+    from services import llm_client
+    from services.single_flight import SingleFlight
+    from services.json_stream import JsonArrayStreamParser
+    from services.evidence_compactor import (
+        GROUP_TOKEN_BUDGET, KEY_LEGEND, PACK_TOKEN_BUDGET, TOKEN_BUCKETS, compact_group, estimate_tokens,
+    )
+    from services import metrics
+    from services.incident_writer import get_incident_writer
+    from services.incident_snapshot import get_incident_snapshot
+    from services.incident_index import get_incident_index
     print("📡 Live Log Collector module loaded successfully.")
 except ImportError as e:
     print(f"❌ CRITICAL ERROR: log_collector.py not found ({e}). Live fetching is impossible.")
@@ -64,37 +78,211 @@ db = init_firebase()
 
 # --- 6. LIVE WRAPPER (ASYNC) ---
 # Global Cache & Rate Limit
-ANALYSIS_CACHE = {
-    "hash": None,
-    "response": None,
-    "timestamp": 0
-}
+# Per-group analyses live in the persistent analysis cache; this only keeps
+# each tenant's last response as a fallback when the hourly limit is hit
+ANALYSIS_CACHE = {}  # user_id -> {"response", "timestamp"}
+ANALYSIS_MODEL = "google/gemini-2.0-flash-001"
+ANALYSIS_PROMPT_VERSION = "4" # Bump when the analysis prompt changes
+ANALYSIS_CACHE_VERSION = f"{ANALYSIS_MODEL}:{ANALYSIS_PROMPT_VERSION}"
+HOURLY_CALL_LIMIT = 6
 HOURLY_CALL_COUNT = 0
 HOURLY_RESET_TIME = 0
+FETCH_TIMEOUT_SECONDS = 120
+VALID_SEVERITIES = ('WARNING', 'ERROR', 'CRITICAL', 'ALERT', 'EMERGENCY')
+SEVERITY_WEIGHTS = {'WARNING': 1, 'ERROR': 3, 'CRITICAL': 5, 'ALERT': 8, 'EMERGENCY': 10}
 
-async def analyze_evidence_pack_async(evidence):
+# LLM fan-out: top-K ranked groups, packed into token-budgeted batches,
+# analyzed concurrently
+MAX_ANALYZED_GROUPS = 40
+BATCH_TOKEN_BUDGET = PACK_TOKEN_BUDGET # Estimated evidence tokens per call (EVIDENCE_TOKEN_BUDGET)
+SAMPLE_LOGS_PER_GROUP = 4 # Raw samples kept for compaction to choose from
+SAMPLE_LOG_MAX_CHARS = 4000
+LLM_CONCURRENCY = 4
+
+
+def group_error_traces(trace_items, miner=None):
     """
-    Sends the Evidence Pack to Gemini via OpenRouter (OpenAI-Compatible API).
+    Deterministic grouping & filtering (Non-LLM) of (trace_id, logs) pairs.
+    Traces are grouped by the mined template of their first WARN+ message,
+    so messages differing only in ids, numbers or addresses share a group.
+    Consumes traces one at a time, so it can sit at the end of a stream.
     """
-    print("🛡️ AI Brain: Analyzing Evidence Pack (OpenRouter/Gemini)...")
+    miner = miner or get_template_miner()
+    error_groups = {} # Key: template fingerprint
     
-    if not OPENROUTER_API_KEY:
-        print("❌ Error: OPENROUTER_API_KEY not found in .env")
-        return []
+    for trace_id, logs in trace_items:
+        # Filter for WARN/ERROR (LogRecords carry the text-extracted severity)
+        filtered_logs = [l for l in logs if l.severity in VALID_SEVERITIES]
+        
+        if not filtered_logs: continue
+        
+        # Template fingerprint of the first failure in the trace
+        first_err = filtered_logs[0]
+        cluster = miner.add_message(first_err.message or first_err.root_cause or "")
+        group_key = cluster.cluster_id
+        
+        if group_key not in error_groups:
+            error_groups[group_key] = {
+                "group_id": group_key, 
+                "category": "UNKNOWN", 
+                "services": set(),
+                "occurrences": 0,
+                "severity": "WARNING",
+                "sample_logs": [],
+                "trace_ids": []
+            }
+        
+        group = error_groups[group_key]
+        group["occurrences"] += len(filtered_logs)
+        for l in filtered_logs:
+            if SEVERITY_WEIGHTS.get(l.severity, 0) > SEVERITY_WEIGHTS[group["severity"]]:
+                group["severity"] = l.severity
+        group["services"].update(l.service or 'unknown' for l in logs)
+        group["trace_ids"].append(trace_id)
+        if len(group["sample_logs"]) < SAMPLE_LOGS_PER_GROUP:
+            # Bounded raw sample; compact_group trims stack traces and ids later
+            txt = f"{first_err.severity}: {first_err.message or ''}"[:SAMPLE_LOG_MAX_CHARS]
+            group["sample_logs"].append(txt)
+    
+    # Templates may have generalized while grouping; report the final form
+    for group_key, group in error_groups.items():
+        group["template"] = miner.get(group_key).template
+    
+    miner.save()
+    return error_groups
+
+
+def group_score(group):
+    """Ranking score: occurrences x severity weight x service breadth"""
+    return group["occurrences"] * SEVERITY_WEIGHTS.get(group["severity"], 1) * max(len(group["services"]), 1)
+
+
+def rank_groups(error_groups, k=MAX_ANALYZED_GROUPS):
+    """Top-K (group_id, group) pairs by group_score, best first (heap select)"""
+    return heapq.nlargest(k, error_groups.items(), key=lambda item: group_score(item[1]))
+
+
+def pack_evidence_batches(evidence_list, token_budget=BATCH_TOKEN_BUDGET):
+    """
+    Compact ranked evidence groups (see services/evidence_compactor.py) and
+    pack them into batches of at most `token_budget` estimated tokens,
+    keeping rank order (a group larger than the budget gets a batch of its own).
+    """
+    batches, current, used = [], [], 0
+    raw_tokens = compact_tokens = 0
+    for raw_group in evidence_list:
+        raw_tokens += len(json.dumps(raw_group)) // 4 + 1 # Uncompacted size, for comparison
+        group = compact_group(raw_group, min(GROUP_TOKEN_BUDGET, token_budget))
+        tokens = estimate_tokens(group)
+        compact_tokens += tokens
+        if current and used + tokens > token_budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(group)
+        used += tokens
+    if current:
+        batches.append(current)
+    if batches:
+        metrics.observe("analysis.evidence_tokens_raw", raw_tokens, TOKEN_BUCKETS)
+        metrics.observe("analysis.evidence_tokens_compact", compact_tokens, TOKEN_BUCKETS)
+    return batches
+
+
+async def iter_batch_analyses(batches, time_window, concurrency=LLM_CONCURRENCY):
+    """
+    Analyze evidence batches in parallel (at most `concurrency` calls in
+    flight), yielding each group's result as soon as any batch produces it.
+    Closing the generator early cancels the calls still running.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    
+    async def analyze(batch):
+        try:
+            async with semaphore:
+                async for item in analyze_evidence_pack_stream({
+                    "time_window": time_window,
+                    "total_groups": len(batch),
+                    "groups": batch
+                }):
+                    await queue.put(item)
+        finally:
+            await queue.put(None) # Batch finished
+    
+    tasks = [asyncio.create_task(analyze(batch)) for batch in batches]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is None:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def analyze_batches_async(batches, time_window, concurrency=LLM_CONCURRENCY):
+    """
+    Analyze evidence batches in parallel and merge the per-group results,
+    in arrival order.
+    """
+    return [item async for item in iter_batch_analyses(batches, time_window, concurrency)]
+
+
+_REVALIDATING = set() # (tenant, fingerprint) pairs with a background re-analysis in flight
+_BACKGROUND_TASKS = set()
+
+
+async def _cache_analyses(cache, results, signatures, tenant):
+    """Store LLM results for groups of this run in the tenant's analysis cache"""
+    entries = [
+        (item["group_id"], signatures[item["group_id"]], item)
+        for item in results if item.get("group_id") in signatures
+    ]
+    await asyncio.get_running_loop().run_in_executor(None, cache.put_many, entries, tenant)
 
+
+def _revalidate_in_background(groups, time_window, cache, signatures, tenant):
+    """Stale-while-revalidate: refresh stale analyses without blocking the response"""
+    groups = [g for g in groups if (tenant, g["group_id"]) not in _REVALIDATING]
+    if not groups:
+        return
+    fingerprints = {(tenant, g["group_id"]) for g in groups}
+    _REVALIDATING.update(fingerprints)
+    
+    async def revalidate():
+        try:
+            results = await analyze_batches_async(pack_evidence_batches(groups), time_window)
+            await _cache_analyses(cache, results, signatures, tenant)
+            print(f"♻️ Revalidated {len(results)} stale analyses")
+        except Exception as e:
+            print(f"⚠️ Analysis revalidation failed: {e}")
+        finally:
+            _REVALIDATING.difference_update(fingerprints)
+    
+    task = asyncio.create_task(revalidate())
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+def _build_analysis_request(evidence):
+    """OpenRouter payload and headers for one Evidence Pack"""
     prompt = (
         "You are an expert Google Cloud SRE. Strictly follow the Output Format.\n\n"
         "TASK:\n"
-        "1. Analyze the provided Error Object Groups.\n"
+        "1. Analyze the provided Error Object Groups. Group keys: " + KEY_LEGEND + ".\n"
         "2. For EACH group, identify the root cause, explain the chain, suggest remediation, and assign confidence.\n"
-        "3. Return ONLY a JSON list of objects. Use DOUBLE QUOTES for all keys and strings.\n"
-        "4. Required keys: \"group_id\", \"root_cause\", \"explanation\", \"remediation\", \"confidence\" (0-100), \"priority\" (P1-P4), \"category\".\n\n"
-        f"EVIDENCE PACK:\n{json.dumps(evidence)}\n"
+        "3. Return ONLY a JSON object {\"groups\": [...]} with one object per group in that list. Use DOUBLE QUOTES for all keys and strings.\n"
+        "4. Required keys: \"group_id\" (the group's \"id\"), \"root_cause\", \"explanation\", \"remediation\", \"confidence\" (0-100), \"priority\" (P1-P4), \"category\".\n\n"
+        f"EVIDENCE PACK:\n{json.dumps(evidence, separators=(',', ':'))}\n"
     )
+    metrics.observe("analysis.prompt_tokens", estimate_tokens(prompt), TOKEN_BUCKETS)
     
     # OpenRouter / OpenAI Standard Payload
     payload = {
-        "model": "google/gemini-2.0-flash-001",
+        "model": ANALYSIS_MODEL,
         "messages": [
             {"role": "user", "content": prompt}
         ],
@@ -108,208 +296,432 @@ async def analyze_evidence_pack_async(evidence):
         "HTTP-Referer": "http://localhost:5173", # Optional: For OpenRouter ranking
         "X-Title": "Cloud RCA Assistant"         # Optional: For OpenRouter ranking
     }
+    return payload, headers
+
+
+async def analyze_evidence_pack_stream(evidence):
+    """
+    Sends the Evidence Pack to Gemini via OpenRouter with "stream": true and
+    yields each group's analysis as soon as its JSON object is complete,
+    instead of waiting for the whole reply (see services/json_stream.py).
+    Errors are logged and end the stream early.
+    """
+    print("🛡️ AI Brain: Analyzing Evidence Pack (OpenRouter/Gemini)...")
+    
+    if not OPENROUTER_API_KEY:
+        print("❌ Error: OPENROUTER_API_KEY not found in .env")
+        return
+
+    payload, headers = _build_analysis_request(evidence)
+    payload["stream"] = True
+    parser = JsonArrayStreamParser()
+    started = time.perf_counter()
+    yielded = 0
     
     try:
-        import httpx
-        async with httpx.AsyncClient() as client:
-            response = await client.post(API_URL, json=payload, headers=headers, timeout=60.0)
-            if response.status_code == 200:
-                res_json = response.json()
+        # Shared keep-alive (HTTP/2) client; see services/llm_client.py
+        async with llm_client.stream(API_URL, json=payload, headers=headers, timeout=60.0) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                print(f"❌ Gemini API Error: {response.status_code} - {body[:500]}")
+                return
+            async for line in response.aiter_lines():
+                # SSE: "data: {...}" per chunk, ": comment" keep-alives, "data: [DONE]" at the end
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
                 try:
-                    # Parse OpenAI-format response
-                    choices = res_json.get('choices', [])
-                    if not choices: return []
-                    content = choices[0].get('message', {}).get('content', '')
-                    
-                    content = content.replace('```json', '').replace('```', '').strip()
-                    return json.loads(content)
-                except json.JSONDecodeError as e:
-                     print(f"❌ Gemini Parsing Error: {e}")
-                     return []
-                except (KeyError, IndexError) as e:
-                    print(f"❌ Gemini Response Structure Error: {e}")
-                    return []
-            else:
-                 print(f"❌ Gemini API Error: {response.status_code} - {response.text}")
-                 return []
+                    choices = json.loads(data).get('choices') or []
+                except json.JSONDecodeError:
+                    continue
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    for item in parser.feed(delta):
+                        if isinstance(item, dict):
+                            if not yielded:
+                                metrics.observe("analysis.llm_first_group_seconds", time.perf_counter() - started)
+                            yielded += 1
+                            yield item
+        for item in parser.close():
+            yield item
     except Exception as e:
         print(f"❌ Gemini Network Error: {e}")
-        return []
+    metrics.observe("analysis.llm_seconds", time.perf_counter() - started)
+    if parser.errors:
+        print(f"❌ Gemini Parsing Error: skipped {parser.errors} malformed group objects")
+
 
-async def run_analysis_for_api(time_range_minutes=60, max_traces: Optional[int] = 100, user_id="default_user"):
-    global ANALYSIS_CACHE, HOURLY_CALL_COUNT, HOURLY_RESET_TIME
-    import time
-    import hashlib
+async def analyze_evidence_pack_async(evidence):
+    """
+    Sends the Evidence Pack to Gemini and returns all group analyses at once.
+    """
+    return [item async for item in analyze_evidence_pack_stream(evidence)]
+
+# Concurrent identical analysis requests share one run
+ANALYSIS_FLIGHTS = SingleFlight("analysis_single_flight")
+
+
+class AnalysisFeed:
+    """
+    Results and stage progress of one analysis run as they are produced.
+    Any number of followers can read it; late followers first replay what
+    was published. `followers` counts the callers still waiting on the run.
+    """
+    
+    def __init__(self):
+        self.results = []
+        self.final = None
+        self.stage = "starting"
+        self.progress = 0
+        self.detail = {}
+        self.followers = 0
+        self._changed = asyncio.Event()
+    
+    def set_stage(self, stage, progress, **detail):
+        """Record the pipeline stage (fetch / group / llm / persist) and a 0-100 estimate"""
+        self.stage = stage
+        self.progress = int(progress)
+        self.detail = detail
+    
+    def publish(self, result):
+        self.results.append(result)
+        self._notify()
+    
+    def finish(self, final):
+        # Early exits (e.g. rate-limit fallback) return results never published
+        if not self.results and final.get("results"):
+            self.results.extend(final["results"])
+        self.final = final
+        self._notify()
+    
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+    
+    async def follow(self):
+        """Yield ("result", res_obj) per result, then ("done", final response)"""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.results):
+                yield "result", self.results[sent]
+                sent += 1
+            if self.final is not None:
+                yield "done", self.final
+                return
+            await changed.wait()
+
+
+def start_analysis(time_range_minutes=60, max_traces: Optional[int] = 100, user_id="default_user",
+                   log_source=None):
+    """
+    Start (or join) the analysis run for these arguments
+
+    Returns:
+        (task, feed): the shared run task and its AnalysisFeed
+    """
+    key = (user_id, time_range_minutes, json.dumps(log_source, sort_keys=True))
+    feed = AnalysisFeed()
+    
+    async def run():
+        final = {"results": [], "error": "Analysis cancelled"}
+        try:
+            final = await _run_analysis(time_range_minutes, max_traces, user_id, log_source, feed)
+            return final
+        finally:
+            feed.finish(final)
+    
+    # The feed travels with the flight's task: a caller joining it (even one
+    # landing after the run ended but before the key is released) gets the
+    # run's own feed, never a registry entry that may already be gone
+    task = ANALYSIS_FLIGHTS.start(key, run)
+    if not hasattr(task, "feed"):
+        task.feed = feed  # We started the run (no await since start)
+    return task, task.feed
+
+
+async def run_analysis_for_api(time_range_minutes=60, max_traces: Optional[int] = 100, user_id="default_user",
+                               log_source=None):
+    """
+    Fetch, group and analyze recent logs for a tenant.
+    The log source comes from `log_source` if given, else the tenant's
+    user_credentials `log_source` field, else the LOG_SOURCE default (cloud).
+    Concurrent calls for the same (user, window, source) await one run.
+    """
+    task, feed = start_analysis(time_range_minutes, max_traces, user_id, log_source)
+    feed.followers += 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        feed.followers -= 1
+
+
+async def stream_analysis(time_range_minutes=60, max_traces: Optional[int] = 100, user_id="default_user",
+                          log_source=None):
+    """
+    Same run as run_analysis_for_api, yielding ("result", res_obj) as each
+    group's analysis is ready (cached ones first), then ("done", response).
+    Stopping early does not cancel the run: it still persists its incidents.
+    """
+    _, feed = start_analysis(time_range_minutes, max_traces, user_id, log_source)
+    feed.followers += 1
+    try:
+        async for event in feed.follow():
+            yield event
+    finally:
+        feed.followers -= 1
+
+
+async def wait_for_persistence(ticket_id, timeout=None):
+    """Wait until a run's incident writes are durable (or failed); returns the final status"""
+    if db is None:
+        return None
+    ticket = get_incident_writer(db).ticket(ticket_id)
+    if ticket is None:
+        return None
+    await asyncio.wait_for(ticket.wait(), timeout=timeout)
+    return ticket.to_dict()
+
+
+def get_persistence_status(ticket_id, user_id):
+    """Durability of a user's analysis run's incident writes (None if unknown, expired or not theirs)"""
+    if db is None:
+        return None
+    ticket = get_incident_writer(db).ticket(ticket_id)
+    if ticket is None or ticket.owner != user_id:
+        return None
+    return ticket.to_dict()
+
+
+def _stage(feed, stage, progress, **detail):
+    if feed is not None:
+        feed.set_stage(stage, progress, **detail)
+
+
+def _result_object(item, group_data):
+    """Construct result object matching frontend expectations"""
+    return {
+        "trace_id": group_data["trace_ids"][0],
+        "category": item.get("category"),
+        "priority": item.get("priority"),
+        "log_count": group_data["occurrences"],
+        "root_cause": item.get("root_cause"),
+        "redacted_text": item.get("explanation"), 
+        "action": item.get("remediation"),
+        "correlation": "Grouped Analysis",
+        "security_alert": False,
+        "confidence": item.get("confidence")
+    }
+
+
+def _incident_doc(res_obj, group_data):
+    return {
+        "trace_id": res_obj["trace_id"],
+        "service_name": list(group_data["services"])[0],
+        "timestamp": datetime.now().isoformat(),
+        "category": res_obj["category"],
+        "priority": res_obj["priority"],
+        "analysis": {"confidence": res_obj["confidence"], "cause": res_obj["root_cause"],
+                     "remediation": res_obj["action"]},
+        "status": "OPEN",
+        "occurrence_count": group_data["occurrences"]
+    }
+
+
+async def _run_analysis(time_range_minutes, max_traces, user_id, log_source, feed=None):
+    global HOURLY_CALL_COUNT, HOURLY_RESET_TIME
     
     current_time = time.time()
     
-    # Rate Limit: Max 6 calls per hour
+    # Rate Limit: Max 6 LLM-calling runs per hour (fully cached runs are free)
     if current_time - HOURLY_RESET_TIME > 3600:
         HOURLY_CALL_COUNT = 0
         HOURLY_RESET_TIME = current_time
-    
-    if HOURLY_CALL_COUNT >= 6:
-        print("⏳ Hourly Rate Limit Reached (6 calls/hr). Returning cached/empty.")
-        if ANALYSIS_CACHE["response"]:
-             return {"results": ANALYSIS_CACHE["response"], "note": "Hourly limit reached. Showing cached data."}
-        return {"results": [], "error": "Hourly analysis limit reached."}
 
+    ticket = None
     try:
-        from services.credential_manager import get_credentials
+        from services.credential_manager import get_credentials, get_user_credentials
         if db is None: return {"results": [], "error": "Firebase not initialized"}
         
-        # 1. Get Credentials
-        creds = await get_credentials(db, user_id)
-        if not creds: return {"results": [], "error": "No credentials found"}
+        # 1. Tenant settings (project, log source), cached with the credentials
+        tenant = await get_user_credentials(db, user_id)
+        pid = tenant.project_id
+        source_config = log_source if log_source is not None else tenant.log_source
         
-        # 2. Fetch Logs
-        project_id = await db.collection('user_credentials').document(user_id).get()
-        pid = project_id.to_dict().get('project_id') if project_id.exists else None
+        # 2. Get Credentials (only live Cloud Logging needs them; served from the same cache entry)
+        creds = None
+        if log_source_type(source_config) == "cloud":
+            creds = await get_credentials(db, user_id)
+            if not creds: return {"results": [], "error": "No credentials found"}
         
-        raw_traces = fetch_logs(creds, time_range_minutes=60, project_id=pid) # Hardcoded 60 mins
-        if not raw_traces: 
-            return {"results": []}
-
-        # 3. Deterministic Grouping & Filtering (Non-LLM)
-        error_groups = {} # Key: (category, root_cause_hint)
-        valid_severity = ['WARNING', 'ERROR', 'CRITICAL', 'ALERT', 'EMERGENCY']
+        # Cloud reads stream with bounded memory; a tenant can opt into the
+        # in-memory incremental window with {"type": "cloud", "incremental": true}
+        source = create_log_source(source_config, credentials=creds, project_id=pid, save_to_file=True)
         
-        for trace_id, logs in raw_traces.items():
-            # Filter for WARN/ERROR with Normalization
-            filtered_logs = []
-            for l in logs:
-                sev = l.get('severity') or l.get('level')
-                if sev in valid_severity:
-                    filtered_logs.append(l)
-            
-            if not filtered_logs: continue
-            
-            # Simple heuristic for grouping
-            first_err = filtered_logs[0]
-            service = first_err.get('service', 'unknown')
-            msg_sig = first_err.get('textPayload', '')[:50]
-            
-            group_key = f"{service}::{msg_sig}"
-            
-            if group_key not in error_groups:
-                if len(error_groups) >= 10: continue # Max 10 groups cap
-                
-                error_groups[group_key] = {
-                    "group_id": group_key, 
-                    "category": "UNKNOWN", 
-                    "services": set(),
-                    "occurrences": 0,
-                    "sample_logs": [],
-                    "trace_ids": []
-                }
-            
-            group = error_groups[group_key]
-            group["occurrences"] += len(filtered_logs)
-            group["services"].update(l.get('service', 'unknown') for l in logs)
-            group["trace_ids"].append(trace_id)
-            if len(group["sample_logs"]) < 2:
-                # Safe truncate
-                txt = first_err.get('textPayload', '')[:200]
-                group["sample_logs"].append(txt)
+        # 3. Stream, filter and group (Non-LLM) on the fetch pool
+        _stage(feed, "fetch", 5)
+        error_groups = await source.consume_async(
+            group_error_traces,
+            time_range_minutes=60, # Hardcoded 60 mins
+            timeout=FETCH_TIMEOUT_SECONDS,
+            # Total unknown up front: approach 40% as entries come in
+            on_progress=lambda stats: _stage(feed, "fetch", 5 + 35 * stats["entries_read"] / (stats["entries_read"] + 50000),
+                                             entries_read=stats["entries_read"]),
+            severities=VALID_SEVERITIES,
+        )
+        _stage(feed, "group", 45, groups=len(error_groups))
         
         if not error_groups:
              return {"results": [], "note": "No WARN/ERROR logs found."}
 
-        # 4. Create Evidence Pack
+        # 4. Create Evidence Pack (top-K groups, best first)
         evidence_list = []
-        for k, v in error_groups.items():
+        for k, v in rank_groups(error_groups):
             evidence_list.append({
                 "group_id": k,
+                "template": v["template"],
                 "occurrences": v["occurrences"],
-                "services": list(v["services"]),
+                "severity": v["severity"],
+                "services": sorted(v["services"]),
                 "sample_logs": v["sample_logs"]
             })
             
         evidence_pack = {
             "time_window": "last 60 minutes",
-            "total_groups": len(evidence_list),
+            "total_groups": len(error_groups),
             "groups": evidence_list
         }
         
-        # 5. Check Cache (Hash of Evidence Pack)
-        pack_str = json.dumps(evidence_pack, sort_keys=True)
-        pack_hash = hashlib.md5(pack_str.encode()).hexdigest()
+        # 5. Per-group cache (per tenant): only new or materially changed groups go to Gemini
+        loop = asyncio.get_running_loop()
+        cache = get_analysis_cache(ANALYSIS_CACHE_VERSION)
+        signatures = {g["group_id"]: evidence_signature(g) for g in evidence_list}
+        cached = await loop.run_in_executor(None, cache.get_many, list(signatures.items()), user_id)
+        pending = [g for g in evidence_list if g["group_id"] not in cached]
+        stale = [g for g in evidence_list if g["group_id"] in cached and cached[g["group_id"]][1] == STALE]
+        print(f"📦 Analysis cache: {len(cached)} cached ({len(stale)} stale), {len(pending)} to analyze")
         
-        if ANALYSIS_CACHE["hash"] == pack_hash and (current_time - ANALYSIS_CACHE["timestamp"] < 300):
-            print("📦 Using Cached Analysis Results (Evidence unchanged)")
-            return {"results": ANALYSIS_CACHE["response"]}
-
-        # 6. Single Gemini Call
-        HOURLY_CALL_COUNT += 1
-        llm_results = await analyze_evidence_pack_async(evidence_pack)
+        # Cached analyses are ready now; streaming followers get them first
+        results_by_group = {}
+        for group in evidence_list:
+            gid = group["group_id"]
+            if gid in cached:
+                res_obj = _result_object(cached[gid][0], error_groups[gid])
+                results_by_group[gid] = res_obj
+                if feed:
+                    feed.publish(res_obj)
+        
+        _stage(feed, "llm", 50, cached=len(cached), pending=len(pending))
+        
+        # Incidents go through the batched writer; the response does not wait for them
+        # (the run's ticket is created with its first write, so cached runs add none)
+        writer = get_incident_writer(db)
         
-        # 7. Post-Processing & Persistence
-        final_results = []
+        llm_results = []
+        note = None
+        if pending or stale:
+            if HOURLY_CALL_COUNT >= HOURLY_CALL_LIMIT:
+                print("⏳ Hourly Rate Limit Reached (6 calls/hr). Serving cached analyses only.")
+                if not cached:
+                    last = ANALYSIS_CACHE.get(user_id)
+                    if last and last["response"]:
+                        return {"results": last["response"], "note": "Hourly limit reached. Showing cached data."}
+                    return {"results": [], "error": "Hourly analysis limit reached."}
+                note = "Hourly limit reached. Showing cached data."
+            else:
+                # 6. Batched, concurrent, streamed Gemini calls (one rate-limit unit per run)
+                HOURLY_CALL_COUNT += 1
+                if stale:
+                    _revalidate_in_background(stale, evidence_pack["time_window"], cache, signatures, user_id)
+                if pending:
+                    batches = pack_evidence_batches(pending)
+                    print(f"🧮 Analyzing {len(pending)}/{len(error_groups)} groups in {len(batches)} batches")
+                    # 7. Each group is published and persisted as soon as its JSON completes
+                    async for item in iter_batch_analyses(batches, evidence_pack["time_window"]):
+                        gid = item.get("group_id")
+                        if gid not in signatures or gid in results_by_group:
+                            continue
+                        llm_results.append(item)
+                        _stage(feed, "llm", 50 + 40 * len(llm_results) / len(pending),
+                               cached=len(cached), pending=len(pending), analyzed=len(llm_results))
+                        group_data = error_groups[gid]
+                        res_obj = _result_object(item, group_data)
+                        results_by_group[gid] = res_obj
+                        if feed:
+                            feed.publish(res_obj)
+                        incident_doc = _incident_doc(res_obj, group_data)
+                        if ticket is None:
+                            ticket = writer.new_ticket(owner=user_id)
+                        doc_id = writer.add(incident_doc, ticket)
+                        # Chat sees it right away
+                        get_incident_snapshot(db).apply(doc_id, incident_doc)
+                        get_incident_index(db).add(doc_id, incident_doc)
+                    await _cache_analyses(cache, llm_results, signatures, user_id)
         
-        for item in llm_results:
-            gid = item.get("group_id")
-            if gid in error_groups:
-                group_data = error_groups[gid]
-                representative_trace = group_data["trace_ids"][0] 
-                
-                # Construct result object matching frontend expectations
-                res_obj = {
-                    "trace_id": representative_trace,
-                    "category": item.get("category"),
-                    "priority": item.get("priority"),
-                    "log_count": group_data["occurrences"],
-                    "root_cause": item.get("root_cause"),
-                    "redacted_text": item.get("explanation"), 
-                    "action": item.get("remediation"),
-                    "correlation": "Grouped Analysis",
-                    "security_alert": False,
-                    "confidence": item.get("confidence")
-                }
-                final_results.append(res_obj)
-                
-                if db:
-                    incident_doc = {
-                        "trace_id": representative_trace,
-                        "service_name": list(group_data["services"])[0],
-                        "timestamp": datetime.now().isoformat(),
-                        "category": res_obj["category"],
-                        "priority": res_obj["priority"],
-                        "analysis": {"confidence": res_obj["confidence"], "cause": res_obj["root_cause"]},
-                        "status": "OPEN",
-                        "occurrence_count": group_data["occurrences"]
-                    }
-                    await db.collection("incidents").add(incident_doc)
-
-        ANALYSIS_CACHE = {
-            "hash": pack_hash,
+        # Final response keeps the ranking order
+        final_results = [results_by_group[g["group_id"]] for g in evidence_list if g["group_id"] in results_by_group]
+
+        ANALYSIS_CACHE[user_id] = {
             "response": final_results,
             "timestamp": current_time
         }
         
-        return {"results": final_results}
+        if ticket is not None:
+            ticket.seal()
+        _stage(feed, "persist", 90, queued=ticket.submitted if ticket is not None else 0)
+        response = {"results": final_results}
+        if note:
+            response["note"] = note
+        if ticket is not None:
+            response["persistence"] = ticket.to_dict()
+        else:
+            response["persistence"] = {"status": "durable", "writes": 0}
+        return response
 
+    except asyncio.TimeoutError:
+        print(f"❌ run_analysis_for_api Error: log fetch exceeded {FETCH_TIMEOUT_SECONDS}s")
+        return {"results": [], "error": "Log fetch timed out"}
     except Exception as e:
         print(f"❌ run_analysis_for_api Error: {e}")
         return {"results": [], "error": str(e)}
+    finally:
+        # Early returns and errors too: wait_for_persistence must not hang on the ticket
+        if ticket is not None:
+            ticket.seal()
 
 # --- 7. CHATBOT LOGIC (ASYNC) ---
-async def chat_with_ai_async(message, user_id="default_user"):
+CHAT_TIMEOUT_SECONDS = 20.0
+CHAT_ERROR_REPLY = "An error occurred while processing your request."
+CHAT_UNAVAILABLE_REPLY = "I'm having trouble connecting to my brain. Please try again."
+CHAT_RELEVANT_INCIDENTS = 8 # Top BM25 matches for the question
+CHAT_LATEST_INCIDENTS = 5 # Plus the newest ones, for "what's happening now" questions
+
+
+async def _build_chat_request(message, user_id):
     """
-    Chat with Gemini using broad incident context.
+    Build the OpenRouter payload and headers for a chat message, with
+    broad incident context. Shared by the plain and streaming chat.
     """
     print(f"💬 Chat request from {user_id}: {message[:50]}...")
     
     context_data = []
     if db:
         try:
-            # Fetch last 50 incidents for broad context
-            docs = await db.collection("incidents").order_by("timestamp", direction="DESCENDING").limit(50).get()
-            for doc in docs:
-                d = doc.to_dict()
+            # Incidents relevant to the question (local BM25 index), then the latest ones
+            index = get_incident_index(db)
+            await index.ensure_built()
+            selected = {doc_id: d for _, doc_id, d in index.search(message, k=CHAT_RELEVANT_INCIDENTS)}
+            metrics.observe("chat.relevant_incidents", len(selected), (0, 1, 2, 4, 8, 16))
+            for d in await get_incident_snapshot(db).get(limit=CHAT_LATEST_INCIDENTS):
+                selected.setdefault(d["id"], d)
+            for doc_id, d in selected.items():
                 context_data.append({
-                    "id": d.get("trace_id", doc.id)[:8],
+                    "id": d.get("trace_id", doc_id)[:8],
                     "service": d.get("service_name"),
                     "cause": d.get("analysis", {}).get("cause"),
+                    "remediation": d.get("analysis", {}).get("remediation"),
                     "confidence": d.get("analysis", {}).get("confidence"),
                     "priority": d.get("priority"),
                     "time": d.get("timestamp")
@@ -317,18 +729,15 @@ async def chat_with_ai_async(message, user_id="default_user"):
         except Exception as e:
             print(f"⚠️ Failed to fetch chat context: {e}")
 
-    if not OPENROUTER_API_KEY:
-        print("❌ Chat Error: OPENROUTER_API_KEY not found in .env")
-        return {"reply": "Configuration Error: API Key missing."}
-
     prompt = (
         "You are 'Reliability Chatbot', a high-performance SRE assistant. "
         "Your goal is to help users understand system health and incidents. "
         "Return a concise, expert reply. Do NOT mention you can take autonomous actions. "
         "If the user asks for suggestions, provide concrete remediation steps. "
-        f"\n\nIncident Context (Latest 50):\n{json.dumps(context_data)}"
+        f"\n\nIncident Context (most relevant to the message, then latest):\n{json.dumps(context_data)}"
         f"\n\nUser Message: {message}"
     )
+    metrics.observe("chat.prompt_tokens", estimate_tokens(prompt), TOKEN_BUCKETS)
     
     # OpenRouter / OpenAI Standard Payload
     payload = {
@@ -345,24 +754,79 @@ async def chat_with_ai_async(message, user_id="default_user"):
         "HTTP-Referer": "http://localhost:5173",
         "X-Title": "Cloud RCA Assistant"
     }
+    return payload, headers
+
+
+async def chat_with_ai_async(message, user_id="default_user"):
+    """
+    Chat with Gemini using broad incident context.
+    """
+    if not OPENROUTER_API_KEY:
+        print("❌ Chat Error: OPENROUTER_API_KEY not found in .env")
+        return {"reply": "Configuration Error: API Key missing."}
+
+    payload, headers = await _build_chat_request(message, user_id)
     
     try:
-        import httpx
-        async with httpx.AsyncClient() as client:
-            response = await client.post(API_URL, json=payload, headers=headers, timeout=20.0)
-            if response.status_code == 200:
-                res_json = response.json()
-                choices = res_json.get('choices', [])
-                if choices:
-                    content = choices[0].get('message', {}).get('content', '')
-                    if content:
-                        return {"reply": content}
-            else:
-                 print(f"❌ Chat OpenRouter API Error: Status {response.status_code} - {response.text}")
-        return {"reply": "I'm having trouble connecting to my brain. Please try again."}
+        response = await llm_client.post(API_URL, json=payload, headers=headers, timeout=CHAT_TIMEOUT_SECONDS)
+        if response.status_code == 200:
+            res_json = response.json()
+            choices = res_json.get('choices', [])
+            if choices:
+                content = choices[0].get('message', {}).get('content', '')
+                if content:
+                    return {"reply": content}
+        else:
+             print(f"❌ Chat OpenRouter API Error: Status {response.status_code} - {response.text}")
+        return {"reply": CHAT_UNAVAILABLE_REPLY}
     except Exception as e:
         print(f"❌ Chat Network Error: {e}")
-        return {"reply": "An error occurred while processing your request."}
+        return {"reply": CHAT_ERROR_REPLY}
+
+
+async def chat_with_ai_stream(message, user_id="default_user"):
+    """
+    Streaming variant of chat_with_ai_async: yields reply text chunks as
+    OpenRouter produces them (OpenAI-style SSE with "stream": true).
+    Closing the generator (e.g. on client disconnect) closes the upstream
+    request. Errors are reported as a final reply chunk, like the plain chat.
+    """
+    if not OPENROUTER_API_KEY:
+        print("❌ Chat Error: OPENROUTER_API_KEY not found in .env")
+        yield "Configuration Error: API Key missing."
+        return
+
+    payload, headers = await _build_chat_request(message, user_id)
+    payload["stream"] = True
+    
+    sent_any = False
+    try:
+        async with llm_client.stream(API_URL, json=payload, headers=headers, timeout=CHAT_TIMEOUT_SECONDS) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                print(f"❌ Chat OpenRouter API Error: Status {response.status_code} - {body[:500]}")
+                yield CHAT_UNAVAILABLE_REPLY
+                return
+            async for line in response.aiter_lines():
+                # SSE: "data: {...}" per chunk, ": comment" keep-alives, "data: [DONE]" at the end
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    choices = json.loads(data).get('choices') or []
+                except json.JSONDecodeError:
+                    continue
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    sent_any = True
+                    yield delta
+        if not sent_any:
+            yield CHAT_UNAVAILABLE_REPLY
+    except Exception as e:
+        print(f"❌ Chat Stream Error: {e}")
+        yield CHAT_ERROR_REPLY
 
 if __name__ == "__main__":
     run_analysis_for_api(time_range_minutes=120, max_traces=5)
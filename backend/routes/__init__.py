@@ -9,6 +9,7 @@ from .incidents import router as incidents_router
 from .analytics import router as analytics_router
 from .alerts import router as alerts_router
 from .chat import router as chat_router
+from .metrics import router as metrics_router
 
 # Export all routers
 __all__ = [
@@ -18,5 +19,6 @@ __all__ = [
     "incidents_router",
     "analytics_router",
     "alerts_router",
-    "chat_router"
+    "chat_router",
+    "metrics_router"
 ]
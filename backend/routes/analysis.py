@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import sys
@@ -10,9 +11,16 @@ import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
-    from core.agent import run_analysis_for_api
+    from core.agent import stream_analysis, get_persistence_status
 except ImportError:
-    run_analysis_for_api = None
+    stream_analysis = None
+    get_persistence_status = None
+
+try:
+    from workers.analysis_jobs import analysis_job_manager, QueueFullError
+except ImportError:
+    analysis_job_manager = None
+    QueueFullError = None
 
 router = APIRouter(prefix="/analyze", tags=["Analysis"])
 
@@ -20,38 +28,118 @@ class AnalyzeRequest(BaseModel):
     time_range_minutes: int = 60
     max_traces: Optional[int] = 10
     cluster_id: Optional[str] = None
+    priority: str = "normal" # high / normal / low (job queue order)
 
-@router.post("/start")
-async def analyze_start(request: AnalyzeRequest, authorization: str = Header(None)):
-    """Triggers the full Gemini-3 AI analysis pipeline."""
-    print(f"📥 Received API Request: Lookback {request.time_range_minutes}m")
-    
-    # Extract user_id from authorization header
+def _user_id_from_header(authorization):
+    """Extract user_id from the authorization header"""
     user_id = "default_user"  # fallback
     if authorization and authorization.startswith('Bearer '):
         try:
             token = authorization.replace('Bearer ', '')
             user_data = json.loads(base64.b64decode(token))
             user_id = user_data.get('user_id', 'default_user')
-            print(f"👤 Analysis requested by user: {user_id}")
         except Exception as e:
             print(f"⚠️ Failed to decode user token: {e}")
+    return user_id
+
+def _tenant_job(task_id, user_id):
+    """The job if it exists and belongs to the caller, else 404"""
+    if analysis_job_manager is None:
+        raise HTTPException(status_code=503, detail="Analysis service not available")
+    job = analysis_job_manager.get(task_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Unknown analysis task")
+    return job
+
+@router.post("/start")
+async def analyze_start(request: AnalyzeRequest, authorization: str = Header(None)):
+    """
+    Queues the full Gemini-3 AI analysis pipeline as a background job and
+    returns its task_id at once; poll /analyze/status/{task_id} for progress.
+    """
+    print(f"📥 Received API Request: Lookback {request.time_range_minutes}m")
+    if analysis_job_manager is None:
+        raise HTTPException(status_code=503, detail="Analysis service not available")
     
+    user_id = _user_id_from_header(authorization)
+    print(f"👤 Analysis requested by user: {user_id}")
     try:
-        if run_analysis_for_api is None:
-            raise HTTPException(status_code=503, detail="Analysis service not available")
-            
-        result = await run_analysis_for_api(
+        job = analysis_job_manager.submit(
+            user_id,
+            {"time_range_minutes": request.time_range_minutes, "max_traces": request.max_traces},
+            priority=request.priority,
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"task_id": job.task_id, "status": job.status, "position": analysis_job_manager.position(job)}
+
+@router.post("/stream")
+async def analyze_stream(request: AnalyzeRequest, http_request: Request, authorization: str = Header(None)):
+    """
+    Runs the same pipeline as /analyze/start, streaming results as Server-Sent
+    Events: `event: result` per analyzed group as soon as it is ready, then
+    `event: done` with the note/error of the final response.
+    A client disconnect stops the stream, not the analysis run.
+    """
+    if stream_analysis is None:
+        raise HTTPException(status_code=503, detail="Analysis service not available")
+    
+    user_id = _user_id_from_header(authorization)
+    print(f"📥 Received streaming analysis request: Lookback {request.time_range_minutes}m ({user_id})")
+    
+    async def event_stream():
+        events = stream_analysis(
             time_range_minutes=request.time_range_minutes,
             max_traces=request.max_traces,
-            user_id=user_id  # Pass actual user_id
+            user_id=user_id
         )
-        return result
-    except Exception as e:
-        print(f"❌ API Endpoint Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        try:
+            async for kind, data in events:
+                if await http_request.is_disconnected():
+                    print(f"🔌 Analysis stream client disconnected ({user_id})")
+                    return
+                if kind == "done":
+                    data = {k: v for k, v in data.items() if k != "results"}
+                yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/persistence/{ticket_id}")
+async def analyze_persistence(ticket_id: str, authorization: str = Header(None)):
+    """Whether the incidents of an analysis run (its `persistence.ticket_id`) are written yet"""
+    if get_persistence_status is None:
+        raise HTTPException(status_code=503, detail="Analysis service not available")
+    # Another tenant's ticket is reported as unknown, like /status and /cancel do
+    status = get_persistence_status(ticket_id, _user_id_from_header(authorization))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown persistence ticket")
+    return status
 
 @router.get("/status/{task_id}")
-async def analyze_status(task_id: str):
-    """Get status of an analysis task"""
-    return {"status": "completed", "progress": 100}
+async def analyze_status(task_id: str, authorization: str = Header(None)):
+    """
+    Get status of an analysis task: status (queued / running / completed /
+    failed / cancelled), stage (fetch / group / llm / persist), progress
+    0-100, the results so far and, once finished, the full response.
+    """
+    job = _tenant_job(task_id, _user_id_from_header(authorization))
+    status = job.to_dict()
+    if job.status == "queued":
+        status["position"] = analysis_job_manager.position(job)
+    return status
+
+@router.post("/cancel/{task_id}")
+async def analyze_cancel(task_id: str, authorization: str = Header(None)):
+    """Cancel a queued or running analysis task"""
+    job = _tenant_job(task_id, _user_id_from_header(authorization))
+    if not analysis_job_manager.cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Task already {job.status}")
+    return {"task_id": task_id, "status": "cancelling" if job.status == "running" else job.status}
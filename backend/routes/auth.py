@@ -17,6 +17,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 try:
     from core.agent import db
     from services.credential_manager import store_credentials
+    from services.google_auth import auth_request, http_get, run_auth
 except ImportError as e:
     print(f"Import error: {e}")
     db = None
@@ -175,14 +176,12 @@ async def google_callback(
             state=state
         )
         
-        # Exchange authorization code for tokens
-        flow.fetch_token(code=code)
+        # Exchange authorization code for tokens (blocking HTTP: auth thread pool)
+        await run_auth("fetch_token", flow.fetch_token, code=code)
         credentials = flow.credentials
         
         # Extract user info from ID token or userinfo endpoint
-        import google.auth.transport.requests
         from google.oauth2 import id_token
-        import requests as http_requests
         
         user_email = "unknown@example.com"
         user_name = "Unknown User"
@@ -191,10 +190,12 @@ async def google_callback(
         try:
             # Try to get info from ID token first
             if credentials.id_token:
-                request = google.auth.transport.requests.Request()
-                id_info = id_token.verify_oauth2_token(
+                # Signing certs come from the shared HTTP cache
+                id_info = await run_auth(
+                    "verify_id_token",
+                    id_token.verify_oauth2_token,
                     credentials.id_token,
-                    request,
+                    auth_request(),
                     credentials.client_id
                 )
                 user_email = id_info.get('email', 'unknown@example.com')
@@ -206,7 +207,7 @@ async def google_callback(
                 print(f"⚠️ No ID token, using userinfo endpoint")
                 userinfo_url = 'https://www.googleapis.com/oauth2/v2/userinfo'
                 headers = {'Authorization': f'Bearer {credentials.token}'}
-                response = http_requests.get(userinfo_url, headers=headers)
+                response = await run_auth("userinfo", http_get, userinfo_url, headers=headers)
                 
                 if response.status_code == 200:
                     userinfo = response.json()
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import sys
 import os
@@ -9,21 +10,17 @@ import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
-    from core.agent import chat_with_ai_async
+    from core.agent import chat_with_ai_async, chat_with_ai_stream
 except ImportError:
     chat_with_ai_async = None
+    chat_with_ai_stream = None
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
 class ChatRequest(BaseModel):
     message: str
 
-@router.post("")
-async def chat_endpoint(request: ChatRequest, authorization: str = Header(None)):
-    """Chat with the Reliability Chatbot"""
-    if chat_with_ai_async is None:
-        raise HTTPException(status_code=503, detail="Chat service not available")
-        
+def _user_id_from_header(authorization):
     user_id = "default_user"
     if authorization and authorization.startswith('Bearer '):
         try:
@@ -32,6 +29,20 @@ async def chat_endpoint(request: ChatRequest, authorization: str = Header(None))
             user_id = user_data.get('user_id', 'default_user')
         except:
             pass
+    return user_id
+
+def _sse(data, event=None):
+    """Format one Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.post("")
+async def chat_endpoint(request: ChatRequest, authorization: str = Header(None)):
+    """Chat with the Reliability Chatbot"""
+    if chat_with_ai_async is None:
+        raise HTTPException(status_code=503, detail="Chat service not available")
+        
+    user_id = _user_id_from_header(authorization)
             
     try:
         result = await chat_with_ai_async(request.message, user_id=user_id)
@@ -39,3 +50,33 @@ async def chat_endpoint(request: ChatRequest, authorization: str = Header(None))
     except Exception as e:
         print(f"❌ Chat Router Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request, authorization: str = Header(None)):
+    """
+    Chat with the Reliability Chatbot, streaming the reply as Server-Sent Events:
+    `data: {"delta": "..."}` per chunk, then `event: done`.
+    A client disconnect stops the stream and the upstream LLM request.
+    """
+    if chat_with_ai_stream is None:
+        raise HTTPException(status_code=503, detail="Chat service not available")
+    
+    user_id = _user_id_from_header(authorization)
+    
+    async def event_stream():
+        chunks = chat_with_ai_stream(request.message, user_id=user_id)
+        try:
+            async for delta in chunks:
+                if await http_request.is_disconnected():
+                    print(f"🔌 Chat stream client disconnected ({user_id})")
+                    return
+                yield _sse({"delta": delta})
+            yield _sse({}, event="done")
+        finally:
+            await chunks.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from typing import Optional
 from google.cloud.firestore_v1.base_query import FieldFilter
+import asyncio
 import sys
 import os
 
@@ -12,6 +13,11 @@ try:
 except ImportError:
     db = None
 
+try:
+    from services.log_store import find_trace
+except ImportError:
+    find_trace = None
+
 router = APIRouter(prefix="/incidents", tags=["Incidents"])
 
 def get_db():
@@ -75,13 +81,17 @@ async def get_incident_detail(id: str):
             raise HTTPException(status_code=404, detail="Incident not found")
         
         data = doc.to_dict()
+        logs = data.get("logs", [])
+        if not logs and find_trace and data.get("trace_id"):
+            # Fall back to the local log archive (indexed, single-trace read)
+            logs = await asyncio.get_running_loop().run_in_executor(None, find_trace, data["trace_id"])
         return {
             "id": doc.id,
             "trace_id": data.get("trace_id"),
             "service_name": data.get("service_name"),
             "timestamp": data.get("timestamp"),
             "analysis": data.get("analysis", {}),
-            "logs": data.get("logs", []),
+            "logs": logs,
             "priority": data.get("priority"),
             "status": "OPEN"
         }
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import metrics
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@router.get("")
+async def get_metrics():
+    """In-process performance counters, histograms and gauges"""
+    return metrics.snapshot()
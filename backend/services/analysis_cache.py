@@ -0,0 +1,199 @@
+"""
+Persistent Per-Group LLM Analysis Cache
+
+Stores the LLM analysis of each error group in SQLite, keyed by the tenant,
+the group's template fingerprint and the model/prompt version, so results
+survive restarts and one changed group no longer invalidates all the others.
+Template fingerprints are process-wide, so the tenant is part of the key:
+one tenant's analysis is never served to another hitting the same template.
+
+Each entry carries a signature of the evidence it was computed from
+(template, severity, services, occurrence order of magnitude). A lookup
+whose signature differs is a miss: the group changed materially and must be
+re-analyzed. Entries are:
+
+- fresh for TTL_SECONDS,
+- then stale for STALE_SECONDS more: still served, but the caller should
+  revalidate them in the background (stale-while-revalidate),
+- then expired and removed.
+
+The table is also capped at MAX_ENTRIES, evicting least recently used rows.
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from services import metrics
+
+CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", os.path.join("data", "analysis_cache.sqlite3"))
+TTL_SECONDS = 6 * 60 * 60
+STALE_SECONDS = 24 * 60 * 60
+MAX_ENTRIES = 5000
+
+FRESH = "fresh"
+STALE = "stale"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    version TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysis_cache_last_access ON analysis_cache (last_access);
+"""
+
+
+def evidence_signature(group):
+    """
+    Hash of the parts of an evidence group that should trigger re-analysis
+
+    Occurrences only count by order of magnitude, so a group growing from
+    40 to 55 hits keeps its analysis while one jumping to 500 does not.
+    """
+    material = {
+        "template": group.get("template"),
+        "severity": group.get("severity"),
+        "services": sorted(group.get("services") or ()),
+        "magnitude": int(math.log10(max(group.get("occurrences", 0), 1))),
+    }
+    return hashlib.sha1(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """SQLite-backed LRU + TTL cache of per-fingerprint analysis results"""
+
+    def __init__(self, path=CACHE_PATH, version="", ttl_seconds=TTL_SECONDS, stale_seconds=STALE_SECONDS,
+                 max_entries=MAX_ENTRIES):
+        self.path = path
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _prefix(self, tenant):
+        return f"{self.version}:{tenant}:"
+
+    def _key(self, tenant, fingerprint):
+        return self._prefix(tenant) + fingerprint
+
+    def get_many(self, groups, tenant):
+        """
+        Look up evidence groups
+
+        Args:
+            groups: Iterable of (fingerprint, signature) pairs
+            tenant: Tenant (user id) the analyses belong to
+
+        Returns:
+            {fingerprint: (result, FRESH | STALE)} for the groups with a usable entry
+        """
+        now = time.time()
+        found, expired = {}, []
+        with self._lock:
+            for fingerprint, signature in groups:
+                row = self._conn.execute(
+                    "SELECT signature, result, created_at FROM analysis_cache WHERE key = ?",
+                    (self._key(tenant, fingerprint),),
+                ).fetchone()
+                if row is None or row[0] != signature:
+                    metrics.incr("analysis_cache.misses")
+                    continue
+                age = now - row[2]
+                if age >= self.ttl_seconds + self.stale_seconds:
+                    expired.append(self._key(tenant, fingerprint))
+                    metrics.incr("analysis_cache.expired")
+                    continue
+                state = FRESH if age < self.ttl_seconds else STALE
+                metrics.incr("analysis_cache.hits" if state == FRESH else "analysis_cache.stale_hits")
+                found[fingerprint] = (json.loads(row[1]), state)
+
+            with self._conn:
+                if found:
+                    self._conn.executemany(
+                        "UPDATE analysis_cache SET last_access = ? WHERE key = ?",
+                        [(now, self._key(tenant, fingerprint)) for fingerprint in found],
+                    )
+                if expired:
+                    self._conn.executemany("DELETE FROM analysis_cache WHERE key = ?", [(k,) for k in expired])
+        return found
+
+    def put_many(self, entries, tenant):
+        """
+        Store analysis results
+
+        Args:
+            entries: Iterable of (fingerprint, signature, result) triples
+            tenant: Tenant (user id) the analyses belong to
+        """
+        now = time.time()
+        rows = [
+            (self._key(tenant, fingerprint), fingerprint, self.version, signature, json.dumps(result), now, now)
+            for fingerprint, signature, result in entries
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._evict(now)
+
+    def _evict(self, now):
+        """Drop expired rows, then least recently used ones beyond max_entries"""
+        cursor = self._conn.execute(
+            "DELETE FROM analysis_cache WHERE created_at < ?",
+            (now - self.ttl_seconds - self.stale_seconds,),
+        )
+        evicted = cursor.rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN "
+                "(SELECT key FROM analysis_cache ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            evicted += cursor.rowcount
+        if evicted:
+            metrics.incr("analysis_cache.evictions", evicted)
+
+    def invalidate(self, tenant, fingerprint=None):
+        """Remove one fingerprint's entry of a tenant, or all of the tenant's entries when None"""
+        with self._lock, self._conn:
+            if fingerprint is None:
+                prefix = self._prefix(tenant)
+                self._conn.execute(
+                    "DELETE FROM analysis_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix),
+                )
+            else:
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (self._key(tenant, fingerprint),))
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_analysis_cache(version):
+    """Return the process-wide cache for a model/prompt version"""
+    with _CACHES_LOCK:
+        cache = _CACHES.get(version)
+        if cache is None:
+            cache = _CACHES[version] = AnalysisCache(version=version)
+            metrics.register_gauge("analysis_cache.size", cache.size)
+        return cache
@@ -3,16 +3,33 @@ Credential Manager for OAuth Token Storage and Retrieval
 
 Handles encryption, storage, and retrieval of Google OAuth credentials
 in Firestore with automatic token refresh.
+
+Decrypted credentials are cached in-process per user together with the
+tenant settings of the same document (project_id, log_source), so a warm
+analysis makes no Firestore call at all:
+
+- entries are re-read after CACHE_TTL_SECONDS and dropped immediately by
+  store_credentials / delete_credentials,
+- tokens are refreshed ahead, in the background, once they are within
+  REFRESH_AHEAD_SECONDS of expiry (an expired token is refreshed inline);
+  loads and refreshes are single-flighted per user,
+- `last_used` updates are debounced and written in one batch every
+  LAST_USED_FLUSH_SECONDS.
 """
 import os
 import json
-from datetime import datetime
+import time
+import asyncio
+from datetime import datetime, timedelta
 from typing import Optional
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 from cryptography.fernet import Fernet
 from firebase_admin import firestore
 
+from services import metrics
+from services.google_auth import auth_request, run_auth
+from services.single_flight import SingleFlight
+
 # Load encryption key from environment
 ENCRYPTION_KEY = os.getenv('CREDENTIAL_ENCRYPTION_KEY')
 
@@ -23,6 +40,81 @@ if ENCRYPTION_KEY:
 else:
     print("⚠️ WARNING: CREDENTIAL_ENCRYPTION_KEY not set. Credentials will not be encrypted!")
 
+CACHE_TTL_SECONDS = 300
+REFRESH_AHEAD_SECONDS = 300
+LAST_USED_FLUSH_SECONDS = 30
+
+
+class CredentialEntry:
+    """Cached view of one user_credentials document"""
+
+    def __init__(self, data):
+        self.exists = data is not None
+        data = data or {}
+        self.project_id = data.get('project_id')
+        self.log_source = data.get('log_source')
+        self.credentials = None
+        self.error = None
+        self.loaded_at = time.monotonic()
+        if self.exists:
+            try:
+                self.credentials = _decode_credentials(data)
+            except Exception as e:
+                # Only fatal for callers that need the credentials themselves
+                self.error = str(e)
+
+    def age(self):
+        return time.monotonic() - self.loaded_at
+
+
+_CACHE = {}  # user_id -> CredentialEntry
+_GENERATIONS = {}  # user_id -> bumped on invalidation, so in-flight loads are not cached
+_FLIGHTS = SingleFlight("credential_cache")
+_BACKGROUND_TASKS = set()
+_LAST_USED_PENDING = {}  # user_id -> db
+_LAST_USED_FLUSHER = None
+
+metrics.register_gauge("credential_cache.size", lambda: len(_CACHE))
+
+
+def invalidate_credentials(user_id: str) -> None:
+    """Drop a user's cached credentials and settings"""
+    _CACHE.pop(user_id, None)
+    _GENERATIONS[user_id] = _GENERATIONS.get(user_id, 0) + 1
+
+
+def _decode_credentials(data) -> Credentials:
+    """Decrypt a user_credentials document into a Credentials object"""
+    # Decrypt or retrieve credentials
+    if data.get('encrypted', False):
+        if not cipher:
+            raise ValueError("Cannot decrypt credentials: CREDENTIAL_ENCRYPTION_KEY not set")
+        
+        encrypted_data = data['encrypted_credentials']
+        decrypted = cipher.decrypt(encrypted_data.encode())
+        creds_dict = json.loads(decrypted)
+    else:
+        creds_dict = data['credentials']
+    
+    # Reconstruct expiry datetime
+    expiry = None
+    if creds_dict.get('expiry'):
+        try:
+            expiry = datetime.fromisoformat(creds_dict['expiry'])
+        except Exception:
+            expiry = None
+
+    # Reconstruct Credentials object
+    return Credentials(
+        token=creds_dict['token'],
+        refresh_token=creds_dict['refresh_token'],
+        token_uri=creds_dict['token_uri'],
+        client_id=creds_dict['client_id'],
+        client_secret=creds_dict['client_secret'],
+        scopes=creds_dict['scopes'],
+        expiry=expiry
+    )
+
 
 async def store_credentials(db, user_id: str, credentials: Credentials, project_id: Optional[str] = None) -> None:
     """
@@ -34,6 +126,23 @@ async def store_credentials(db, user_id: str, credentials: Credentials, project_
         credentials: Google OAuth credentials object
         project_id: GCP Project ID (optional)
     """
+    data_to_store = _encode_credentials(credentials)
+    
+    # Add metadata
+    data_to_store.update({
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'last_used': firestore.SERVER_TIMESTAMP,
+        'user_id': user_id,
+        'project_id': project_id  # Store project ID
+    })
+    
+    await db.collection('user_credentials').document(user_id).set(data_to_store, merge=True)
+    invalidate_credentials(user_id)
+    print(f"✅ Stored credentials for user: {user_id}")
+
+
+def _encode_credentials(credentials: Credentials) -> dict:
+    """The (encrypted if possible) credential fields of a user_credentials document"""
     creds_dict = {
         'token': credentials.token,
         'refresh_token': credentials.refresh_token,
@@ -57,22 +166,44 @@ async def store_credentials(db, user_id: str, credentials: Credentials, project_
             'credentials': creds_dict,
             'encrypted': False
         }
-    
-    # Add metadata
-    data_to_store.update({
-        'created_at': firestore.SERVER_TIMESTAMP,
-        'last_used': firestore.SERVER_TIMESTAMP,
-        'user_id': user_id,
-        'project_id': project_id  # Store project ID
-    })
-    
-    await db.collection('user_credentials').document(user_id).set(data_to_store, merge=True)
-    print(f"✅ Stored credentials for user: {user_id}")
+    return data_to_store
+
+
+async def get_user_credentials(db, user_id: str) -> CredentialEntry:
+    """
+    Cached user_credentials document: credentials plus project_id / log_source
+
+    Args:
+        db: Firestore client
+        user_id: Unique user identifier
+        
+    Returns:
+        CredentialEntry (entry.exists is False if the user has no document).
+        Its credentials are not refreshed here; use get_credentials for that.
+    """
+    entry = _CACHE.get(user_id)
+    if entry is None or entry.age() > CACHE_TTL_SECONDS:
+        metrics.incr("credential_cache.misses")
+        entry = await _FLIGHTS.do(("load", user_id), lambda: _load(db, user_id))
+    else:
+        metrics.incr("credential_cache.hits")
+    if entry.exists:
+        _touch_last_used(db, user_id)
+    return entry
+
+
+async def _load(db, user_id):
+    generation = _GENERATIONS.get(user_id, 0)
+    doc = await db.collection('user_credentials').document(user_id).get()
+    entry = CredentialEntry(doc.to_dict() if doc.exists else None)
+    if _GENERATIONS.get(user_id, 0) == generation:
+        _CACHE[user_id] = entry
+    return entry
 
 
 async def get_credentials(db, user_id: str) -> Optional[Credentials]:
     """
-    Retrieve and decrypt user credentials from Firestore
+    Retrieve and decrypt user credentials (cached, refreshed when due)
     
     Args:
         db: Firestore client
@@ -84,61 +215,102 @@ async def get_credentials(db, user_id: str) -> Optional[Credentials]:
     Raises:
         ValueError: If credentials not found or decryption fails
     """
-    doc_ref = db.collection('user_credentials').document(user_id)
-    doc = await doc_ref.get()
-    
-    if not doc.exists:
+    entry = await get_user_credentials(db, user_id)
+    if not entry.exists:
         raise ValueError(f"No credentials found for user: {user_id}")
+    if entry.error:
+        raise ValueError(entry.error)
     
-    data = doc.to_dict()
-    project_id = data.get('project_id')
+    credentials = entry.credentials
+    if not credentials.refresh_token:
+        return credentials
     
-    # Decrypt or retrieve credentials
-    if data.get('encrypted', False):
-        if not cipher:
-            raise ValueError("Cannot decrypt credentials: CREDENTIAL_ENCRYPTION_KEY not set")
-        
-        encrypted_data = data['encrypted_credentials']
-        decrypted = cipher.decrypt(encrypted_data.encode())
-        creds_dict = json.loads(decrypted)
-    else:
-        creds_dict = data['credentials']
+    # Refresh if expired (inline), or ahead of expiry (in the background)
+    if credentials.expired or not credentials.token:
+        await _FLIGHTS.do(("refresh", user_id), lambda: _refresh(db, user_id, entry))
+    elif _expires_soon(credentials) and not _FLIGHTS.in_flight(("refresh", user_id)):
+        metrics.incr("credential_cache.refresh_ahead")
+        task = asyncio.ensure_future(_FLIGHTS.do(("refresh", user_id), lambda: _refresh(db, user_id, entry)))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_refresh_done)
     
-    # Reconstruct expiry datetime
-    expiry = None
-    if creds_dict.get('expiry'):
-        try:
-            expiry = datetime.fromisoformat(creds_dict['expiry'])
-        except Exception:
-            expiry = None
+    return credentials
 
-    # Reconstruct Credentials object
-    credentials = Credentials(
-        token=creds_dict['token'],
-        refresh_token=creds_dict['refresh_token'],
-        token_uri=creds_dict['token_uri'],
-        client_id=creds_dict['client_id'],
-        client_secret=creds_dict['client_secret'],
-        scopes=creds_dict['scopes'],
-        expiry=expiry
-    )
+
+def _expires_soon(credentials):
+    # google-auth keeps expiry as a naive UTC datetime
+    return credentials.expiry is not None and \
+        credentials.expiry - timedelta(seconds=REFRESH_AHEAD_SECONDS) <= datetime.utcnow()
+
+
+def _refresh_done(task):
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception():
+        print(f"⚠️ Background token refresh failed: {task.exception()}")
+
+
+async def _refresh(db, user_id, entry):
+    """Refresh the token and persist it, unless the credentials were replaced or deleted meanwhile"""
+    credentials = entry.credentials
+    generation = _GENERATIONS.get(user_id, 0)
+    print(f"🔄 Refreshing token for user: {user_id}")
+    try:
+        await run_auth("refresh", credentials.refresh, auth_request())
+    except Exception as e:
+        print(f"❌ Failed to refresh token: {e}")
+        raise ValueError(f"Failed to refresh credentials: {e}")
     
-    # Refresh if expired
-    if credentials.expired and credentials.refresh_token:
-        print(f"🔄 Refreshing expired token for user: {user_id}")
+    # A disconnect or re-link during the refresh wins: neither persist nor cache the old grant
+    if _GENERATIONS.get(user_id, 0) != generation:
+        metrics.incr("credential_cache.refreshes_discarded")
+        raise ValueError(f"Credentials for user {user_id} changed during token refresh")
+    try:
+        # update(), unlike set(), fails on a deleted document instead of recreating it
+        await db.collection('user_credentials').document(user_id).update(_encode_credentials(credentials))
+    except Exception as e:
+        print(f"❌ Failed to store refreshed token: {e}")
+        raise ValueError(f"Failed to refresh credentials: {e}")
+    print(f"✅ Token refreshed successfully for project: {entry.project_id}")
+    metrics.incr("credential_cache.refreshes")
+    if _GENERATIONS.get(user_id, 0) == generation:
+        entry.loaded_at = time.monotonic()
+        _CACHE[user_id] = entry
+
+
+def _touch_last_used(db, user_id):
+    """Debounced last_used update: queued, then written in one batch"""
+    global _LAST_USED_FLUSHER
+    _LAST_USED_PENDING[user_id] = db
+    if _LAST_USED_FLUSHER is None or _LAST_USED_FLUSHER.done():
+        async def flush_later():
+            await asyncio.sleep(LAST_USED_FLUSH_SECONDS)
+            await flush_last_used()
+        _LAST_USED_FLUSHER = asyncio.ensure_future(flush_later())
+
+
+async def flush_last_used() -> None:
+    """Write the pending last_used timestamps now (also called at shutdown)"""
+    pending = dict(_LAST_USED_PENDING)
+    _LAST_USED_PENDING.clear()
+    by_db = {}
+    for user_id, db in pending.items():
+        by_db.setdefault(id(db), (db, []))[1].append(user_id)
+    for db, user_ids in by_db.values():
+        batch = db.batch()
+        for user_id in user_ids:
+            batch.update(db.collection('user_credentials').document(user_id), {'last_used': firestore.SERVER_TIMESTAMP})
         try:
-            credentials.refresh(Request())
-            # Update stored credentials with new token, preserving project_id
-            await store_credentials(db, user_id, credentials, project_id=project_id)
-            print(f"✅ Token refreshed successfully for project: {project_id}")
+            await batch.commit()
+            metrics.incr("credential_cache.last_used_writes", len(user_ids))
         except Exception as e:
-            print(f"❌ Failed to refresh token: {e}")
-            raise ValueError(f"Failed to refresh credentials: {e}")
-    
-    # Update last_used timestamp
-    await doc_ref.update({'last_used': firestore.SERVER_TIMESTAMP})
-    
-    return credentials
+            # e.g. a document deleted meanwhile fails the whole batch
+            print(f"⚠️ Batched last_used update failed ({e}); retrying per user")
+            for user_id in user_ids:
+                try:
+                    await db.collection('user_credentials').document(user_id).update({'last_used': firestore.SERVER_TIMESTAMP})
+                    metrics.incr("credential_cache.last_used_writes")
+                except Exception:
+                    pass
 
 
 async def delete_credentials(db, user_id: str) -> bool:
@@ -154,6 +326,8 @@ async def delete_credentials(db, user_id: str) -> bool:
     """
     try:
         await db.collection('user_credentials').document(user_id).delete()
+        invalidate_credentials(user_id)
+        _LAST_USED_PENDING.pop(user_id, None)
         print(f"🗑️ Deleted credentials for user: {user_id}")
         return True
     except Exception as e:
@@ -0,0 +1,178 @@
+"""
+Evidence Pack Compaction
+
+Shrinks error groups before they are inlined into the analysis prompt, so
+the prompt size (and with it latency and cost) is bounded by a token budget
+instead of by whatever the samples happen to contain:
+
+- near-duplicate sample logs (same text once ids and numbers are masked, or
+  mostly the same words) are dropped,
+- stack traces keep their header, the top frames and the final exception
+  line; the middle frames are replaced by an "N frames omitted" marker,
+- high-entropy tokens (request ids, hashes, base64 blobs, JWTs) become <ID>,
+- keys are shortened (see COMPACT_KEYS) and JSON is written without spaces,
+- a group still above its budget loses sample text, then samples.
+
+Token counts are estimates (~4 chars per token), good enough for budgeting.
+"""
+import json
+import math
+import os
+import re
+
+from services.template_miner import mask_message
+
+PACK_TOKEN_BUDGET = int(os.getenv("EVIDENCE_TOKEN_BUDGET", "6000"))  # Per LLM call
+GROUP_TOKEN_BUDGET = int(os.getenv("EVIDENCE_GROUP_TOKEN_BUDGET", "400"))
+MAX_SAMPLES = 3
+SAMPLE_MAX_CHARS = 600
+MIN_SAMPLE_CHARS = 80
+STACK_HEAD_FRAMES = 3
+STACK_TAIL_FRAMES = 1
+NEAR_DUPLICATE_SIMILARITY = 0.85
+HIGH_ENTROPY_MIN_LENGTH = 16
+HIGH_ENTROPY_BITS = 3.5  # Shannon entropy per char; English words stay below ~3.3
+
+# Token-count histogram bounds for prompt sizes
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Long key -> short key, explained to the model in the prompt
+COMPACT_KEYS = {
+    "group_id": "id",
+    "template": "t",
+    "occurrences": "n",
+    "severity": "sev",
+    "services": "svc",
+    "sample_logs": "s",
+}
+KEY_LEGEND = ", ".join(f"{short}={long}" for long, short in COMPACT_KEYS.items())
+
+_CANDIDATE_TOKEN = re.compile(r"[A-Za-z0-9+/_\-.:]{%d,}={0,2}" % HIGH_ENTROPY_MIN_LENGTH)
+_STACK_FRAME = re.compile(
+    r"^\s*(?:File \"|at [\w$.<>]+[.(]|at \S+ \(|\S+\.go:\d+|#\d+ |\.\.\. \d+ more)"
+)
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(obj):
+    """Rough token count of a string or JSON-serializable object (~4 chars per token)"""
+    if not isinstance(obj, str):
+        obj = json.dumps(obj, separators=(",", ":"))
+    return len(obj) // 4 + 1
+
+
+def _entropy(token):
+    counts = {}
+    for char in token:
+        counts[char] = counts.get(char, 0) + 1
+    length = len(token)
+    return -sum(c / length * math.log2(c / length) for c in counts.values())
+
+
+def strip_high_entropy(text):
+    """Replace id-like random tokens (mixed digits and letters, high entropy) with <ID>"""
+    def replace(match):
+        token = match.group(0)
+        if "/" in token.strip("/") and not any(c.isdigit() for c in token.split("/")[-1]):
+            return token  # A path, not an id
+        if any(c.isdigit() for c in token) and any(c.isalpha() for c in token) \
+                and _entropy(token) >= HIGH_ENTROPY_BITS:
+            return "<ID>"
+        return token
+    return _CANDIDATE_TOKEN.sub(replace, text)
+
+
+def truncate_stack_trace(text, head_frames=STACK_HEAD_FRAMES, tail_frames=STACK_TAIL_FRAMES):
+    """
+    Keep a stack trace's non-frame lines (header, exception message) and its
+    first/last frames; the frames in between become one marker line.
+    Text without a stack trace is returned unchanged.
+    """
+    # Units: [line] or a frame [frame line, its Python source line]
+    units, frame_units = [], []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if _STACK_FRAME.match(line):
+            unit = [line]
+            nxt = lines[i + 1] if i + 1 < len(lines) else None
+            if line.lstrip().startswith('File "') and nxt is not None and nxt.startswith("    ") \
+                    and not _STACK_FRAME.match(nxt):
+                unit.append(nxt)
+                i += 1
+            frame_units.append(len(units))
+            units.append(unit)
+        else:
+            units.append([line])
+        i += 1
+
+    if len(frame_units) <= head_frames + tail_frames:
+        return text
+    dropped = frame_units[head_frames:len(frame_units) - tail_frames]
+    first_dropped, dropped = dropped[0], set(dropped)
+    kept = []
+    for index, unit in enumerate(units):
+        if index == first_dropped:
+            kept.append(f"  ... {len(dropped)} frames omitted ...")
+        if index not in dropped:
+            kept.extend(unit)
+    return "\n".join(kept)
+
+
+def _similarity(a, b):
+    words_a, words_b = set(_WORD.findall(a)), set(_WORD.findall(b))
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def dedupe_samples(samples, threshold=NEAR_DUPLICATE_SIMILARITY):
+    """Drop samples that repeat an earlier one once ids/numbers are masked, or nearly so"""
+    kept, masked_kept = [], []
+    for sample in samples:
+        masked = mask_message(sample)
+        if any(masked == other or _similarity(masked, other) >= threshold for other in masked_kept):
+            continue
+        kept.append(sample)
+        masked_kept.append(masked)
+    return kept
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def compact_group(group, token_budget=GROUP_TOKEN_BUDGET):
+    """
+    Compact one evidence group (long-key dict as built by the agent)
+
+    Returns:
+        Short-key dict estimated at no more than token_budget tokens
+        (unless the template alone exceeds it, in which case it is clipped)
+    """
+    samples = [
+        strip_high_entropy(truncate_stack_trace(sample))
+        for sample in dedupe_samples(group.get("sample_logs") or [])
+    ][:MAX_SAMPLES]
+    compact = {
+        "id": group["group_id"],
+        "t": strip_high_entropy(group.get("template") or ""),
+        "n": group.get("occurrences", 0),
+        "sev": group.get("severity"),
+        "svc": list(group.get("services") or ()),
+        "s": [_clip(sample, SAMPLE_MAX_CHARS) for sample in samples],
+    }
+
+    # Over budget: shorten samples, then drop the last ones, then clip the template
+    limit = SAMPLE_MAX_CHARS
+    while estimate_tokens(compact) > token_budget and compact["s"]:
+        if limit > MIN_SAMPLE_CHARS:
+            limit //= 2
+            compact["s"] = [_clip(sample, limit) for sample in compact["s"]]
+        else:
+            compact["s"].pop()
+    excess = estimate_tokens(compact) - token_budget
+    if excess > 0:
+        compact["t"] = _clip(compact["t"], max(len(compact["t"]) - excess * 4, MIN_SAMPLE_CHARS))
+    return compact
@@ -0,0 +1,74 @@
+"""
+Non-blocking Google Auth Calls
+
+google-auth and oauthlib only have synchronous transports, so token
+exchanges, token refreshes, ID-token verification and userinfo lookups run
+on a dedicated thread pool instead of on the event loop; a burst of logins
+or refreshes then queues behind AUTH_EXECUTOR_WORKERS threads rather than
+stalling every other request. A separate pool also keeps them from waiting
+behind long log fetches or analysis-cache work on the default executor.
+
+google-auth transports share one requests session (connection reuse). When
+CacheControl is installed that session honours HTTP caching headers, so
+Google's ID-token signing certs are fetched once per their Cache-Control
+max-age (hours) instead of on every login. Per-user GETs (userinfo) use a
+plain session, so an authenticated response can never be served from cache.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import google.auth.transport.requests
+
+from services import metrics
+
+try:
+    from cachecontrol import CacheControl
+except ImportError:
+    CacheControl = None
+
+AUTH_EXECUTOR_WORKERS = int(os.getenv("AUTH_EXECUTOR_WORKERS", "8"))
+HTTP_TIMEOUT_SECONDS = 10
+
+_AUTH_EXECUTOR = ThreadPoolExecutor(max_workers=AUTH_EXECUTOR_WORKERS, thread_name_prefix="google-auth")
+
+_SESSION = requests.Session()
+_PLAIN_SESSION = requests.Session()
+if CacheControl is not None:
+    _SESSION = CacheControl(_SESSION)
+else:
+    print("⚠️ cachecontrol not installed: Google ID-token certs will be fetched on every login")
+
+
+def auth_request():
+    """google-auth transport over the shared (caching) session"""
+    return google.auth.transport.requests.Request(session=_SESSION)
+
+
+def http_get(url, **kwargs):
+    """Blocking, uncached GET (run it through run_auth)"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+    return _PLAIN_SESSION.get(url, **kwargs)
+
+
+async def run_auth(name, fn, *args, **kwargs):
+    """
+    Run a blocking auth call on the auth thread pool
+
+    Args:
+        name: Operation name for /metrics (e.g. "refresh", "fetch_token")
+        fn: Blocking callable
+        *args, **kwargs: Passed to fn
+
+    Returns:
+        fn's result (its exceptions propagate)
+    """
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_AUTH_EXECUTOR, lambda: fn(*args, **kwargs))
+    finally:
+        metrics.incr(f"google_auth.{name}")
+        metrics.observe(f"google_auth.{name}_seconds", time.perf_counter() - started)
+
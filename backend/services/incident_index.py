@@ -0,0 +1,200 @@
+"""
+Incident Retrieval Index
+
+Local BM25 search over incident causes, remediations, services and
+categories, so chat can put the incidents relevant to the question in its
+prompt instead of always the latest 50. No external service or model is
+involved; it works fully offline.
+
+The inverted index (term -> {doc id: term frequency}) is built from the
+latest MAX_DOCS incidents on first use and updated incrementally by
+write-through as the analysis pipeline queues incidents. To pick up writes
+from other processes it is refreshed every REFRESH_SECONDS in the
+background, reading only incidents newer than the newest one it has seen
+(minus REFRESH_OVERLAP_SECONDS for late commits), not the whole collection.
+Beyond MAX_DOCS the oldest incidents are evicted.
+"""
+import asyncio
+import heapq
+import math
+import re
+import time
+from datetime import datetime, timedelta
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from services import metrics
+from services.single_flight import SingleFlight
+
+MAX_DOCS = 5000
+REFRESH_SECONDS = 600
+REFRESH_OVERLAP_SECONDS = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can did do does for from has have how i in is it its me my of on or "
+    "our so that the their them there this to was we what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords (snake_case and dotted names are split)"""
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def incident_text(data):
+    """The searchable text of an incident document"""
+    analysis = data.get("analysis") or {}
+    return " ".join(str(part) for part in (
+        analysis.get("cause"),
+        analysis.get("remediation"),
+        data.get("service_name"),
+        data.get("category"),
+        data.get("priority"),
+        data.get("status"),
+    ) if part)
+
+
+class IncidentIndex:
+    """BM25 inverted index of incidents, keyed by Firestore document id"""
+
+    def __init__(self, db, max_docs=MAX_DOCS, refresh_seconds=REFRESH_SECONDS, collection="incidents"):
+        self.db = db
+        self.max_docs = max_docs
+        self.refresh_seconds = refresh_seconds
+        self.collection = collection
+        self._postings = {}  # term -> {doc id: term frequency}
+        self._lengths = {}  # doc id -> token count
+        self._docs = {}  # doc id -> incident data
+        self._total_length = 0
+        self.built_at = None
+        self._newest_read = None  # Newest timestamp read from Firestore (write-through excluded)
+        self._flight = SingleFlight("incident_index_build")
+        self._background = set()
+
+    # --- maintenance ---
+    def add(self, doc_id, data):
+        """Index (or re-index) one incident"""
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        tokens = tokenize(incident_text(data))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            self._postings.setdefault(token, {})[doc_id] = count
+        self._lengths[doc_id] = len(tokens)
+        self._total_length += len(tokens)
+        self._docs[doc_id] = data
+        metrics.incr("incident_index.updates")
+
+    def remove(self, doc_id):
+        data = self._docs.pop(doc_id, None)
+        if data is None:
+            return
+        for token in set(tokenize(incident_text(data))):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+
+    async def ensure_built(self):
+        """Build on first use; afterwards refresh in the background when due"""
+        if self.built_at is None:
+            await self._flight.do(self.collection, self._build)
+        elif time.time() - self.built_at > self.refresh_seconds and not self._flight.in_flight(self.collection):
+            task = asyncio.ensure_future(self._flight.do(self.collection, self._build))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def _query(self):
+        """Newest max_docs on the first build; afterwards only what is newer than the last read"""
+        incidents = self.db.collection(self.collection)
+        if self._newest_read is None:
+            return incidents.order_by("timestamp", direction="DESCENDING").limit(self.max_docs)
+        since = self._newest_read
+        try:
+            since = (datetime.fromisoformat(since) - timedelta(seconds=REFRESH_OVERLAP_SECONDS)).isoformat()
+        except (TypeError, ValueError):
+            pass
+        return incidents.where(filter=FieldFilter("timestamp", ">", since)).order_by(
+            "timestamp").limit(self.max_docs)
+
+    async def _build(self):
+        started = time.perf_counter()
+        incremental = self._newest_read is not None
+        try:
+            docs = await self._query().get()
+        except Exception as e:
+            metrics.incr("incident_index.build_errors")
+            print(f"⚠️ Incident index build failed: {e}")
+            if self.built_at is None:
+                self.built_at = time.time()  # Search what write-through adds; retry later
+            return
+        for doc in docs:
+            data = doc.to_dict()
+            self.add(doc.id, data)
+            timestamp = data.get("timestamp")
+            if timestamp and (self._newest_read is None or timestamp > self._newest_read):
+                self._newest_read = timestamp
+        # Bound memory: keep the newest max_docs
+        if len(self._docs) > self.max_docs:
+            by_age = sorted(self._docs, key=lambda d: self._docs[d].get("timestamp") or "")
+            for doc_id in by_age[:len(self._docs) - self.max_docs]:
+                self.remove(doc_id)
+        self.built_at = time.time()
+        metrics.incr("incident_index.refreshes" if incremental else "incident_index.builds")
+        metrics.incr("incident_index.docs_read", len(docs))
+        metrics.observe("incident_index.build_seconds", time.perf_counter() - started)
+        if not incremental:
+            print(f"🔎 Incident index: {len(self._docs)} incidents, {len(self._postings)} terms")
+
+    # --- search ---
+    def search(self, query, k=10):
+        """
+        Top-k incidents for a free-text query by BM25 score
+
+        Returns:
+            List of (score, doc id, incident data), best first; empty if no term matches
+        """
+        started = time.perf_counter()
+        n_docs = len(self._docs)
+        if not n_docs:
+            return []
+        avg_length = self._total_length / n_docs or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        metrics.observe("incident_index.search_seconds", time.perf_counter() - started)
+        return [(score, doc_id, self._docs[doc_id]) for doc_id, score in best]
+
+    def __len__(self):
+        return len(self._docs)
+
+
+_INDEX = None
+_INDEX_LOOP = None
+
+
+def get_incident_index(db):
+    """Return the index for the running loop (db is the Firestore AsyncClient)"""
+    global _INDEX, _INDEX_LOOP
+    loop = asyncio.get_running_loop()
+    if _INDEX is None or _INDEX_LOOP is not loop:
+        _INDEX = IncidentIndex(db)
+        _INDEX_LOOP = loop
+    return _INDEX
+
+
+metrics.register_gauge("incident_index.size", lambda: len(_INDEX) if _INDEX else 0)
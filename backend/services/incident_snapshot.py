@@ -0,0 +1,121 @@
+"""
+In-Memory Incident Snapshot
+
+A process-wide copy of the most recent incidents, so chat can build its
+context from memory instead of running an ordered Firestore query (50 reads
+and a round trip) for every message.
+
+The snapshot is kept current by:
+
+- write-through: the analysis pipeline applies every incident it queues for
+  writing, so new incidents show up immediately,
+- refresh on staleness: once older than MAX_AGE_SECONDS it is reloaded from
+  Firestore in the background (single-flighted) while readers keep getting
+  the current copy; only the very first read waits for the load.
+
+The Firestore AsyncClient has no on_snapshot listener, hence the refresh.
+/metrics shows the snapshot's age and size plus hit, stale-hit, refresh and
+write-through counters.
+"""
+import asyncio
+import time
+
+from services import metrics
+from services.single_flight import SingleFlight
+
+SNAPSHOT_SIZE = 200
+MAX_AGE_SECONDS = 60
+
+
+class IncidentSnapshot:
+    """Latest incidents, newest first, as {"id": doc id, **data} dicts"""
+
+    def __init__(self, db, size=SNAPSHOT_SIZE, max_age_seconds=MAX_AGE_SECONDS, collection="incidents"):
+        self.db = db
+        self.size = size
+        self.max_age_seconds = max_age_seconds
+        self.collection = collection
+        self._incidents = []
+        self.refreshed_at = None
+        self._flight = SingleFlight("incident_snapshot_refresh")
+        self._background = set()
+
+    def age(self):
+        return None if self.refreshed_at is None else time.time() - self.refreshed_at
+
+    async def get(self, limit=50):
+        """Return up to `limit` latest incidents (loads on first use, then serves from memory)"""
+        if self.refreshed_at is None:
+            await self.refresh()
+        elif self.age() > self.max_age_seconds:
+            metrics.incr("incident_snapshot.stale_hits")
+            self._refresh_in_background()
+        else:
+            metrics.incr("incident_snapshot.hits")
+        return self._incidents[:limit]
+
+    async def refresh(self):
+        """Reload from Firestore (concurrent callers share one query)"""
+        await self._flight.do(self.collection, self._load)
+
+    async def _load(self):
+        started = time.perf_counter()
+        try:
+            docs = await self.db.collection(self.collection).order_by(
+                "timestamp", direction="DESCENDING").limit(self.size).get()
+        except Exception as e:
+            metrics.incr("incident_snapshot.refresh_errors")
+            print(f"⚠️ Incident snapshot refresh failed: {e}")
+            if self.refreshed_at is None:
+                self.refreshed_at = time.time()  # Serve empty, retry after MAX_AGE_SECONDS
+            return
+        loaded = [{"id": doc.id, **doc.to_dict()} for doc in docs]
+        # Keep write-through entries newer than what the query returned
+        known = {item["id"] for item in loaded}
+        loaded.extend(item for item in self._incidents if item["id"] not in known)
+        self._incidents = self._sorted(loaded)
+        self.refreshed_at = time.time()
+        metrics.incr("incident_snapshot.refreshes")
+        metrics.observe("incident_snapshot.refresh_seconds", time.perf_counter() - started)
+
+    def _refresh_in_background(self):
+        if self._flight.in_flight(self.collection):
+            return
+        task = asyncio.ensure_future(self.refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def apply(self, doc_id, data):
+        """Write-through of a created or updated incident"""
+        incidents = [item for item in self._incidents if item["id"] != doc_id]
+        incidents.append({"id": doc_id, **data})
+        self._incidents = self._sorted(incidents)
+        metrics.incr("incident_snapshot.write_through")
+
+    def _sorted(self, incidents):
+        incidents.sort(key=lambda item: item.get("timestamp") or "", reverse=True)
+        return incidents[:self.size]
+
+    def __len__(self):
+        return len(self._incidents)
+
+
+_SNAPSHOT = None
+_SNAPSHOT_LOOP = None
+
+
+def get_incident_snapshot(db):
+    """Return the snapshot for the running loop (db is the Firestore AsyncClient)"""
+    global _SNAPSHOT, _SNAPSHOT_LOOP
+    loop = asyncio.get_running_loop()
+    if _SNAPSHOT is None or _SNAPSHOT_LOOP is not loop:
+        _SNAPSHOT = IncidentSnapshot(db)
+        _SNAPSHOT_LOOP = loop
+    return _SNAPSHOT
+
+
+metrics.register_gauge("incident_snapshot.size", lambda: len(_SNAPSHOT) if _SNAPSHOT else 0)
+metrics.register_gauge(
+    "incident_snapshot.age_seconds",
+    lambda: round(_SNAPSHOT.age(), 3) if _SNAPSHOT and _SNAPSHOT.refreshed_at else None,
+)
@@ -0,0 +1,222 @@
+"""
+Incident Write Pipeline
+
+Analysis runs hand their incident documents to one process-wide writer
+instead of awaiting a Firestore round trip per document. The writer:
+
+- collects documents for FLUSH_DELAY_SECONDS so writes arriving together
+  (e.g. groups finishing one after another in a streamed analysis) share a
+  batched write of up to MAX_BATCH_OPS operations,
+- commits at most MAX_CONCURRENT_COMMITS batches at a time,
+- retries a batch on contention/transient errors with jittered exponential
+  backoff (document ids are allocated before the first attempt, so a retry
+  rewrites the same documents instead of duplicating them).
+
+Callers get the document id immediately and track durability through a
+WriteTicket (one per analysis run that writes incidents), exposed by
+GET /analyze/persistence/{id}.
+"""
+import asyncio
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from google.api_core import exceptions as google_exceptions
+
+from services import metrics
+
+MAX_BATCH_OPS = 500  # Firestore batched write limit
+FLUSH_DELAY_SECONDS = 0.05
+MAX_CONCURRENT_COMMITS = 4
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 0.2
+TICKET_HISTORY = 500
+
+RETRYABLE_ERRORS = (
+    google_exceptions.Aborted,  # Contention
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+)
+
+
+class WriteTicket:
+    """Durability of a group of writes (e.g. the incidents of one analysis run)"""
+
+    def __init__(self, ticket_id, owner=None):
+        self.ticket_id = ticket_id
+        self.owner = owner  # Tenant whose run the writes belong to
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.sealed = False
+        self.created_at = time.time()
+        self._done = asyncio.Event()
+
+    @property
+    def pending(self):
+        return self.submitted - self.committed - self.failed
+
+    @property
+    def status(self):
+        if not self.sealed or self.pending:
+            return "pending"
+        return "failed" if self.failed else "durable"
+
+    def seal(self):
+        """No more writes will be added"""
+        self.sealed = True
+        self._check_done()
+
+    def _resolve(self, ok):
+        if ok:
+            self.committed += 1
+        else:
+            self.failed += 1
+        self._check_done()
+
+    def _check_done(self):
+        if self.sealed and not self.pending:
+            self._done.set()
+
+    async def wait(self):
+        """Wait until every write of the sealed ticket is committed or failed"""
+        await self._done.wait()
+
+    def to_dict(self):
+        return {
+            "ticket_id": self.ticket_id,
+            "status": self.status,
+            "submitted": self.submitted,
+            "committed": self.committed,
+            "failed": self.failed,
+            "pending": self.pending,
+        }
+
+
+class IncidentWriter:
+    """Batched, bounded-concurrency Firestore writer (one per event loop)"""
+
+    def __init__(self, db, collection="incidents"):
+        self.db = db
+        self.collection = collection
+        self._queue = []  # (document ref, data, ticket)
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_COMMITS)
+        self._commits = set()
+        self._tickets = OrderedDict()
+        self._flusher = None
+
+    def new_ticket(self, owner=None):
+        ticket = WriteTicket(uuid.uuid4().hex[:12], owner)
+        self._tickets[ticket.ticket_id] = ticket
+        while len(self._tickets) > TICKET_HISTORY:
+            self._tickets.popitem(last=False)
+        return ticket
+
+    def ticket(self, ticket_id):
+        return self._tickets.get(ticket_id)
+
+    def add(self, data, ticket=None):
+        """
+        Queue a document for writing
+
+        Returns:
+            The new document's id (the write itself completes later)
+        """
+        ref = self.db.collection(self.collection).document()
+        self._queue.append((ref, data, ticket))
+        if ticket is not None:
+            ticket.submitted += 1
+        metrics.incr("incident_writer.enqueued")
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return ref.id
+
+    def pending(self):
+        return len(self._queue) + sum(len(task.chunk) for task in self._commits)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(FLUSH_DELAY_SECONDS)  # Let more writes join the batch
+            while self._queue:
+                chunk, self._queue = self._queue[:MAX_BATCH_OPS], self._queue[MAX_BATCH_OPS:]
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._commit(chunk))
+                task.chunk = chunk
+                self._commits.add(task)
+                task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, chunk):
+        try:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                batch = self.db.batch()
+                for ref, data, _ in chunk:
+                    batch.set(ref, data)
+                started = time.perf_counter()
+                try:
+                    await batch.commit()
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    metrics.incr("incident_writer.retries")
+                    delay = RETRY_BASE_SECONDS * 2 ** (attempt - 1) * (0.5 + random.random())
+                    print(f"⚠️ Incident batch commit failed ({e}); retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            metrics.observe("incident_writer.commit_seconds", time.perf_counter() - started)
+            metrics.incr("incident_writer.committed", len(chunk))
+            ok = True
+        except Exception as e:
+            print(f"❌ Incident batch write failed ({len(chunk)} docs): {e}")
+            metrics.incr("incident_writer.failed", len(chunk))
+            ok = False
+        finally:
+            self._semaphore.release()
+        for _, _, ticket in chunk:
+            if ticket is not None:
+                ticket._resolve(ok)
+
+    async def flush(self):
+        """Wait until everything queued so far is committed (or failed)"""
+        while self._queue or self._commits:
+            if self._queue and (self._flusher is None or self._flusher.done()):
+                self._flusher = asyncio.create_task(self._run())
+            self._wakeup.set()
+            await asyncio.sleep(FLUSH_DELAY_SECONDS)
+
+    async def close(self):
+        await self.flush()
+        if self._flusher is not None:
+            self._flusher.cancel()
+
+
+_WRITER = None
+_WRITER_LOOP = None
+
+
+def get_incident_writer(db):
+    """Return the writer for the running loop (db is the Firestore AsyncClient)"""
+    global _WRITER, _WRITER_LOOP
+    loop = asyncio.get_running_loop()
+    if _WRITER is None or _WRITER_LOOP is not loop:
+        _WRITER = IncidentWriter(db)
+        _WRITER_LOOP = loop
+    return _WRITER
+
+
+async def close_incident_writer():
+    """Flush pending incident writes (FastAPI lifespan shutdown)"""
+    global _WRITER, _WRITER_LOOP
+    if _WRITER is not None and _WRITER_LOOP is asyncio.get_running_loop():
+        await _WRITER.close()
+    _WRITER = None
+    _WRITER_LOOP = None
+
+
+metrics.register_gauge("incident_writer.pending", lambda: _WRITER.pending() if _WRITER else 0)
@@ -0,0 +1,160 @@
+"""
+Incremental JSON Array Parser
+
+Feeds a streamed LLM completion chunk by chunk and emits each object of the
+result array as soon as its closing brace arrives, instead of waiting for
+the whole body. The result array is either the top-level value or, since
+json_object mode makes the model return an object, the array under the
+top-level `array_key` ("groups"), e.g. {"notes": [...], "groups": [...]}.
+Arrays anywhere else are never streamed. Markdown code fences are tolerated.
+
+Outside the result array, the container path and object keys are tracked;
+inside it, only the brace structure of the current element (strings and
+escapes included) until it closes and is handed to json.loads on its own.
+"""
+import json
+
+
+class JsonArrayStreamParser:
+    """Emit complete objects from a JSON result array arriving in pieces"""
+
+    def __init__(self, array_key="groups"):
+        self.array_key = array_key
+        self._stack = []  # Open containers: [bracket, current key, expecting a key]
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None  # Chars of an object key being read
+        self._buffer = []  # Chars of the element being read
+        self._depth = 0  # Nesting inside that element (0: not reading one)
+        self._raw = []  # Full text, for the fallback in close()
+        self.emitted = 0
+        self.errors = 0
+
+    def _in_result_array(self):
+        """Whether the innermost open container is the array to stream"""
+        if not self._stack or self._stack[-1][0] != "[":
+            return False
+        if len(self._stack) == 1:
+            return True
+        return len(self._stack) == 2 and self._stack[0][0] == "{" and self._stack[0][1] == self.array_key
+
+    def feed(self, chunk):
+        """
+        Consume a text chunk
+
+        Returns:
+            List of objects completed by this chunk (possibly empty)
+        """
+        self._raw.append(chunk)
+        if self._done:
+            return []
+        completed = []
+        for char in chunk:
+            if self._depth:
+                self._read_element(char, completed)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._stack[-1][1] = "".join(self._key_chars)
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(char)
+                continue
+
+            if not self._stack:
+                if self._started:
+                    self._done = True  # Trailing text after the top-level value
+                    break
+                if char == "{" or char == "[":
+                    self._started = True
+                    self._stack.append([char, None, char == "{"])
+                continue
+
+            frame = self._stack[-1]
+            if char == '"':
+                self._in_string = True
+                if frame[0] == "{" and frame[2]:
+                    self._key_chars = []
+            elif char == "{" and self._in_result_array():
+                self._depth = 1
+                self._buffer.append(char)
+            elif char == "{" or char == "[":
+                self._stack.append([char, None, char == "{"])
+            elif char == "}" or char == "]":
+                self._stack.pop()
+                if not self._stack:
+                    self._done = True
+                    break
+            elif frame[0] == "{":
+                if char == ",":
+                    frame[2] = True
+                elif char == ":":
+                    frame[2] = False
+        self.emitted += len(completed)
+        return completed
+
+    def _read_element(self, char, completed):
+        buffer = self._buffer
+        buffer.append(char)
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+        elif char == '"':
+            self._in_string = True
+        elif char == "{" or char == "[":
+            self._depth += 1
+        elif char == "}" or char == "]":
+            self._depth -= 1
+            if self._depth == 0:
+                text = "".join(buffer)
+                buffer.clear()
+                try:
+                    completed.append(json.loads(text))
+                except json.JSONDecodeError:
+                    self.errors += 1
+
+    def close(self):
+        """
+        Finish the stream
+
+        If nothing was emitted (e.g. the reply was a single bare group object,
+        or its array sat under another key), the full text is parsed as a whole.
+
+        Returns:
+            Objects recovered only by that fallback, else an empty list
+        """
+        if self.emitted:
+            return []
+        text = "".join(self._raw).replace("```json", "").replace("```", "").strip()
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return []
+        if isinstance(value, list):
+            return [item for item in value if isinstance(item, dict)]
+        if not isinstance(value, dict):
+            return []
+        if isinstance(value.get(self.array_key), list):
+            return [item for item in value[self.array_key] if isinstance(item, dict)]
+        if "group_id" in value:
+            return [value]
+        # Another wrapper key: only a list of group objects qualifies
+        for nested in value.values():
+            if isinstance(nested, list) and nested and \
+                    all(isinstance(item, dict) and "group_id" in item for item in nested):
+                return nested
+        return []
@@ -0,0 +1,142 @@
+"""
+Shared LLM HTTP Client
+
+One application-lifetime httpx.AsyncClient for OpenRouter instead of a new
+client (DNS + TCP + TLS handshake) per analysis or chat message. The client
+keeps connections alive, speaks HTTP/2 when the h2 package is installed,
+and caps the pool size. Callers pass per-call timeouts.
+
+The FastAPI lifespan calls start_llm_client() / close_llm_client(); outside
+the app (scripts, workers) the client is created lazily on first use.
+
+Every request carries an httpcore trace hook, so /metrics shows how many
+connections and TLS handshakes were actually made against how many
+requests were sent (reuse = requests - connections).
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from services import metrics
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx)
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+LLM_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120.0)
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+_CLIENT = None
+_CLIENT_LOOP = None
+
+
+def _new_client():
+    return httpx.AsyncClient(http2=HTTP2_ENABLED, limits=LLM_LIMITS, timeout=DEFAULT_TIMEOUT)
+
+
+async def start_llm_client():
+    """Create the shared client (FastAPI lifespan startup)"""
+    global _CLIENT, _CLIENT_LOOP
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = _new_client()
+        _CLIENT_LOOP = asyncio.get_running_loop()
+        print(f"🔌 LLM client ready (HTTP/2: {HTTP2_ENABLED})")
+    return _CLIENT
+
+
+async def close_llm_client():
+    """Close the shared client and its pooled connections (lifespan shutdown)"""
+    global _CLIENT, _CLIENT_LOOP
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+    _CLIENT = None
+    _CLIENT_LOOP = None
+
+
+async def get_llm_client():
+    """Return the shared client, creating it if the lifespan did not"""
+    # A client is bound to the loop it was created on (e.g. repeated asyncio.run)
+    if _CLIENT is None or _CLIENT.is_closed or _CLIENT_LOOP is not asyncio.get_running_loop():
+        return await start_llm_client()
+    return _CLIENT
+
+
+async def _trace(event_name, info):
+    """httpcore trace hook: count new connections vs requests sent"""
+    if event_name == "connection.connect_tcp.complete":
+        metrics.incr("llm_client.connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        metrics.incr("llm_client.tls_handshakes")
+    elif event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+        metrics.incr("llm_client.requests")
+
+
+async def post(url, json=None, headers=None, timeout=None):
+    """
+    POST through the shared client
+
+    Args:
+        url: Endpoint URL
+        json: JSON body
+        headers: Request headers
+        timeout: Per-call timeout (seconds or httpx.Timeout); defaults to DEFAULT_TIMEOUT
+
+    Returns:
+        httpx.Response
+    """
+    client = await get_llm_client()
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            url,
+            json=json,
+            headers=headers,
+            timeout=timeout if timeout is not None else DEFAULT_TIMEOUT,
+            extensions={"trace": _trace},
+        )
+    except httpx.HTTPError:
+        metrics.incr("llm_client.errors")
+        raise
+    metrics.observe("llm_client.request_seconds", time.perf_counter() - started)
+    metrics.incr(f"llm_client.responses.{response.http_version}")
+    return response
+
+
+
+@asynccontextmanager
+async def stream(url, json=None, headers=None, timeout=None):
+    """
+    Streaming POST through the shared client
+
+    Usage:
+        async with llm_client.stream(url, json=payload) as response:
+            async for line in response.aiter_lines(): ...
+
+    Leaving the block early closes the response (and the upstream request).
+    The recorded latency is time to response headers (first byte).
+    """
+    client = await get_llm_client()
+    started = time.perf_counter()
+    request = client.build_request(
+        "POST",
+        url,
+        json=json,
+        headers=headers,
+        timeout=timeout if timeout is not None else DEFAULT_TIMEOUT,
+        extensions={"trace": _trace},
+    )
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.HTTPError:
+        metrics.incr("llm_client.errors")
+        raise
+    metrics.observe("llm_client.first_byte_seconds", time.perf_counter() - started)
+    metrics.incr(f"llm_client.responses.{response.http_version}")
+    try:
+        yield response
+    finally:
+        await response.aclose()
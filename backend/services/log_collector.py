@@ -2,11 +2,29 @@
 import json
 import re
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
+import heapq
+import itertools
+import math
+import threading
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict, OrderedDict
 from google.cloud import logging_v2
+from services.log_record import LogRecord
+from services.log_store import get_store, summarize_trace, find_trace
+from services import metrics
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+# Optional faster JSON decoder for the parse hot path
+try:
+    import orjson
+    _fast_json_loads = orjson.loads
+except ImportError:
+    _fast_json_loads = None
+
 # Default values (can be overridden)
 DEFAULT_PROJECT_ID = "project-e2bcb697-e160-439a-a3c"
 DEFAULT_SERVICE_NAME = "cloud-rca-service"
@@ -19,6 +37,60 @@ SCOPES = [
 # Data directory for storing logs
 DATA_DIR = "data"
 
+# Logging client pool keyed by (project, credential identity). Entries expire
+# after a TTL (token refreshes happen in place on the shared credentials) and
+# the least recently used client is dropped beyond the size cap.
+CLIENT_POOL_TTL_SECONDS = 30 * 60
+CLIENT_POOL_MAX_SIZE = 32
+_CLIENT_POOL = OrderedDict()  # key -> {"client", "created"}
+_CLIENT_POOL_LOCK = threading.Lock()
+
+# list_saved_logs() listing, refreshed when the data/ directory changes
+_SAVED_LOGS_CACHE = {"mtime": None, "files": []}
+
+# Incremental fetch state, keyed by (project, service).
+# Each checkpoint keeps the high-water mark (newest timestamp seen), the
+# insertIds of entries within INGESTION_LOOKBACK of it, and a rolling window
+# of parsed traces. Cloud Logging ingestion is not ordered, so an incremental
+# fetch re-reads from INGESTION_LOOKBACK before the mark and drops the
+# insertIds it already has; late entries with older timestamps are kept.
+_FETCH_CHECKPOINTS = {}
+_CHECKPOINT_LOCK = threading.Lock()
+INGESTION_LOOKBACK = timedelta(minutes=2)
+
+# Sharded fetch tuning: the window is split into time shards that are read
+# concurrently. "auto" sizes the shard count from a one-page density sample.
+MAX_FETCH_SHARDS = 16
+MAX_FETCH_WORKERS = 8
+ENTRIES_PER_SHARD = 5000
+SHARD_SAMPLE_SIZE = 1000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Async ingestion: fetches run on a dedicated pool so the event loop stays free
+FETCH_EXECUTOR_WORKERS = 4
+PROGRESS_INTERVAL = 1000  # Report progress every N raw entries
+_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_EXECUTOR_WORKERS, thread_name_prefix="log-fetch")
+
+
+# Query pushdown: "traces with errors only" mode looks up trace ids with
+# these levels first, then fetches those traces' full context in chunks
+ERROR_SEVERITIES = ("ERROR", "CRITICAL")
+TRACE_ID_CHUNK_SIZE = 40
+
+# Parser fast path: payloads without the marker never reach the regex
+_PAYLOAD_MARKER = ":cloud-rca:{"
+_PAYLOAD_PATTERN = re.compile(r'(ERROR|WARNING|INFO|CRITICAL):cloud-rca:(\{.+\})')
+
+# Streaming grouping bounds: a trace is finalized once the stream has moved
+# this far past its last entry, or when too many traces are open at once
+TRACE_IDLE_SECONDS = 120
+MAX_OPEN_TRACES = 5000
+
+
+class FetchCancelled(Exception):
+    """Raised inside a fetch when its cancel event is set"""
+
 
 # OAuth authentication is now handled by credential_manager.py
 # This function is kept for backward compatibility but should not be used
@@ -37,48 +109,85 @@ def authenticate():
     return flow.run_local_server(port=0)
 
 
-def parse_log_entry(entry):
+def _decode_entry(entry, severities, loads):
     """
-    Parse Cloud Run logs with format:
-    ERROR:cloud-rca:{"trace_id": "...", "message": "...", ...}
+    Shared fast path behind parse_log_entry / parse_entries
     
-    Extracts severity from the TEXT PREFIX, not from GCP system severity
+    Cheap substring check first, then the precompiled pattern anchored at the
+    start of the payload (the usual layout), falling back to a search. When
+    `severities` is given, entries at other levels are dropped before any
+    JSON decoding.
     """
     payload = entry.payload
     
-    if not isinstance(payload, str):
+    if not isinstance(payload, str) or _PAYLOAD_MARKER not in payload:
         return None
     
     # Extract JSON from textPayload (after the prefix)
     # Pattern: ERROR:cloud-rca:{...} or WARNING:cloud-rca:{...}
-    match = re.search(r'(ERROR|WARNING|INFO|CRITICAL):cloud-rca:(\{.+\})', payload)
+    match = _PAYLOAD_PATTERN.match(payload) or _PAYLOAD_PATTERN.search(payload)
     
     if not match:
         return None
     
     log_level = match.group(1)  # ERROR, WARNING, INFO - from TEXT, not system
-    json_str = match.group(2)
+    if severities is not None and log_level not in severities:
+        return None
     
     try:
-        log_data = json.loads(json_str)
-    except json.JSONDecodeError:
+        log_data = loads(match.group(2))
+    except ValueError:
         return None
     
     trace_id = log_data.get("trace_id")
     if not trace_id:
         return None
     
-    return {
-        "trace_id": trace_id,
-        "message": log_data.get("message"),
-        "service": log_data.get("service"),
-        "root_cause": log_data.get("root_cause"),
-        "suggestion": log_data.get("suggestion"),
-        "timestamp": entry.timestamp.isoformat() if entry.timestamp else None,
-        "severity": log_level,  # ✅ Use the actual log level from the TEXT
-        "log_name": entry.log_name,
-        "resource_labels": dict(entry.resource.labels) if entry.resource else {},
-    }
+    return LogRecord(
+        trace_id,
+        message=log_data.get("message"),
+        service=log_data.get("service"),
+        root_cause=log_data.get("root_cause"),
+        suggestion=log_data.get("suggestion"),
+        timestamp=entry.timestamp.isoformat() if entry.timestamp else None,
+        severity=log_level,  # ✅ Use the actual log level from the TEXT
+        log_name=entry.log_name,
+        resource_labels=entry.resource.labels if entry.resource else None,
+    )
+
+
+def parse_log_entry(entry):
+    """
+    Parse Cloud Run logs with format:
+    ERROR:cloud-rca:{"trace_id": "...", "message": "...", ...}
+    
+    Extracts severity from the TEXT PREFIX, not from GCP system severity
+    """
+    return _decode_entry(entry, None, json.loads)
+
+
+def parse_entries(entries, severities=None, fast_json=True):
+    """
+    Batch-parse log entries, skipping non cloud-rca lines
+    
+    Args:
+        entries: Iterable of Cloud Logging entries
+        severities: Only keep these text severities; others are dropped
+            before their JSON is decoded (optional)
+        fast_json: Decode with orjson when it is installed (default: True)
+    
+    Returns:
+        List of LogRecord objects
+    """
+    wanted = frozenset(severities) if severities else None
+    loads = _fast_json_loads if fast_json and _fast_json_loads else json.loads
+    records = []
+    append = records.append
+    for entry in entries:
+        parsed = _decode_entry(entry, wanted, loads)
+        if parsed is not None:
+            append(parsed)
+    return records
 
 
 def save_logs_to_json(traces, filename=None, project_id=None, service_name=None):
@@ -86,7 +195,7 @@ def save_logs_to_json(traces, filename=None, project_id=None, service_name=None)
     Save logs to JSON file in data/ folder
     
     Args:
-        traces: Dictionary of traces with logs
+        traces: Dictionary of traces with logs (LogRecords or plain dicts)
         filename: Custom filename (optional). If None, generates timestamp-based name
         project_id: Project ID for metadata
         service_name: Service name for metadata
@@ -108,25 +217,13 @@ def save_logs_to_json(traces, filename=None, project_id=None, service_name=None)
     
     filepath = os.path.join(DATA_DIR, filename)
     
-    # Prepare data for saving with severity counts per trace
+    # Prepare data for saving with severity counts per trace (single pass)
     traces_with_metadata = {}
     
     for trace_id, logs in traces.items():
-        # Count severities based on TEXT-EXTRACTED severity
-        severity_counts = {
-            "ERROR": sum(1 for log in logs if log["severity"] == "ERROR"),
-            "WARNING": sum(1 for log in logs if log["severity"] == "WARNING"),
-            "INFO": sum(1 for log in logs if log["severity"] == "INFO"),
-            "CRITICAL": sum(1 for log in logs if log["severity"] == "CRITICAL"),
-        }
-        
         traces_with_metadata[trace_id] = {
-            "log_count": len(logs),
-            "severity_counts": severity_counts,
-            "has_errors": severity_counts["ERROR"] > 0 or severity_counts["CRITICAL"] > 0,
-            "first_seen": logs[0]["timestamp"] if logs else None,
-            "last_seen": logs[-1]["timestamp"] if logs else None,
-            "logs": logs
+            **summarize_trace(logs),
+            "logs": [log.to_dict() if isinstance(log, LogRecord) else log for log in logs]
         }
     
     output_data = {
@@ -140,26 +237,366 @@ def save_logs_to_json(traces, filename=None, project_id=None, service_name=None)
     
     # Save to JSON file
     with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+        json.dump(output_data, f, ensure_ascii=False, separators=(",", ":"))
     
     print(f"💾 Saved logs to: {filepath}")
     return filepath
 
 
-def fetch_logs(credentials, time_range_minutes=60, save_to_file=True, filename=None, project_id=None, service_name=None):
+def _credential_identity(credentials):
+    """Stable identity for a credential, independent of its current access token"""
+    if credentials is None:
+        return "default"
+    account = getattr(credentials, "service_account_email", None)
+    if account:
+        return f"sa:{account}"
+    refresh_token = getattr(credentials, "refresh_token", None)
+    if refresh_token:
+        digest = hashlib.sha256(f"{credentials.client_id}:{refresh_token}".encode()).hexdigest()[:16]
+        return f"oauth:{digest}"
+    return f"obj:{id(credentials)}"
+
+
+def _close_client(client):
+    close = getattr(client, "close", None)
+    if close:
+        try:
+            close()
+        except Exception as e:
+            print(f"⚠️ Failed to close logging client: {e}")
+
+
+def get_logging_client(project, credentials):
     """
-    Fetch logs from Cloud Run for given time range
+    Return a pooled Cloud Logging client for a project and credential
+    
+    Warm analyses reuse the client (and its transport / auth session). The
+    client holds the shared credentials object, which refreshes its token in
+    place, so a new token never calls for a new client. A pooled client is
+    rebuilt only when it is older than CLIENT_POOL_TTL_SECONDS; replaced and
+    evicted clients are dropped from the pool, not closed, since fetches that
+    already hold them may still be running (they are garbage-collected).
+    """
+    key = (project, _credential_identity(credentials))
+    now = time.monotonic()
+    
+    with _CLIENT_POOL_LOCK:
+        pooled = _CLIENT_POOL.get(key)
+        if pooled is not None:
+            if now - pooled["created"] <= CLIENT_POOL_TTL_SECONDS:
+                _CLIENT_POOL.move_to_end(key)
+                metrics.incr("logging_client_pool.hits")
+                return pooled["client"]
+            metrics.incr("logging_client_pool.expired")
+            del _CLIENT_POOL[key]
+    
+    metrics.incr("logging_client_pool.misses")
+    client = logging_v2.Client(project=project, credentials=credentials)
+    
+    with _CLIENT_POOL_LOCK:
+        raced = _CLIENT_POOL.get(key)
+        if raced is not None:
+            # Another thread built one concurrently; keep theirs (ours was never handed out)
+            _close_client(client)
+            return raced["client"]
+        _CLIENT_POOL[key] = {"client": client, "created": now}
+        while len(_CLIENT_POOL) > CLIENT_POOL_MAX_SIZE:
+            _CLIENT_POOL.popitem(last=False)
+            metrics.incr("logging_client_pool.evictions")
+    return client
+
+
+def clear_logging_client_pool():
+    """Close and drop every pooled logging client"""
+    with _CLIENT_POOL_LOCK:
+        pooled = list(_CLIENT_POOL.values())
+        _CLIENT_POOL.clear()
+    for entry in pooled:
+        _close_client(entry["client"])
+
+
+metrics.register_gauge("logging_client_pool.size", lambda: len(_CLIENT_POOL))
+
+
+def _timestamp_key(record):
+    """Sort key for records; ISO timestamps from one source sort as strings"""
+    return record.timestamp or ""
+
+
+def _format_timestamp(dt):
+    """Format an aware datetime for the Cloud Logging filter language"""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_timestamp(value):
+    """Parse a parsed-log ISO timestamp back into an aware datetime"""
+    if not value:
+        return None
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def _get_checkpoint(project, service, query=None):
+    """Return the (created on demand) checkpoint for a project/service/query"""
+    key = (project, _service_key(service), _query_key(query))
+    with _CHECKPOINT_LOCK:
+        checkpoint = _FETCH_CHECKPOINTS.get(key)
+        if checkpoint is None:
+            checkpoint = {
+                "lock": threading.Lock(),
+                "last_timestamp": None,
+                "seen_insert_ids": {},  # insertId -> timestamp, within INGESTION_LOOKBACK of the mark
+                "window_start": None,
+                "traces": defaultdict(list),
+            }
+            _FETCH_CHECKPOINTS[key] = checkpoint
+        return checkpoint
+
+
+def reset_fetch_checkpoints(project_id=None, service_name=None):
+    """
+    Drop incremental fetch state so the next fetch re-reads the full window
+    
+    Args:
+        project_id: Only reset checkpoints for this project (optional)
+        service_name: Only reset checkpoints for this service (optional)
+    """
+    with _CHECKPOINT_LOCK:
+        for key in list(_FETCH_CHECKPOINTS):
+            project, service, _ = key
+            if project_id and project != project_id:
+                continue
+            if service_name and service != _service_key(service_name):
+                continue
+            del _FETCH_CHECKPOINTS[key]
+
+
+def _expire_traces(traces, cutoff):
+    """Drop logs older than cutoff from a trace window (logs sorted ascending)"""
+    for trace_id in list(traces):
+        logs = traces[trace_id]
+        keep_from = 0
+        while keep_from < len(logs):
+            ts = _parse_timestamp(logs[keep_from].timestamp)
+            if ts is not None and ts >= cutoff:
+                break
+            keep_from += 1
+        if keep_from == len(logs):
+            del traces[trace_id]
+        elif keep_from:
+            del logs[:keep_from]
+
+
+def _quote(value):
+    """Quote a string literal for the Logging query language"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _service_key(service):
+    """Stable key for one Cloud Run service name or a list of them"""
+    if isinstance(service, (list, tuple, set, frozenset)):
+        return "+".join(sorted(service))
+    return service
+
+
+def _query_key(query):
+    if not query:
+        return None
+    return tuple(sorted(
+        (name, frozenset(value) if isinstance(value, (list, tuple, set, frozenset)) else value)
+        for name, value in query.items() if value
+    )) or None
+
+
+def build_log_filter(project, service, since, until=None, severities=None, text_contains=None,
+                     trace_ids=None, marker=True):
+    """
+    Build a Cloud Logging query for Cloud Run stdout/stderr with predicate pushdown
+    
+    Everything the parser would throw away is filtered server-side instead,
+    so those bytes are never transferred.
+    
+    Args:
+        project: GCP Project ID
+        service: Cloud Run service name, or a list of names
+        since: Aware datetime lower bound (inclusive)
+        until: Aware datetime upper bound (exclusive, optional)
+        severities: Only lines whose text prefix has one of these levels
+        text_contains: Substrings every returned line must contain
+        trace_ids: Only lines mentioning one of these trace ids
+        marker: Only cloud-rca formatted lines (default: True)
+    
+    Returns:
+        Filter string for client.list_entries
+    """
+    services = list(service) if isinstance(service, (list, tuple, set, frozenset)) else [service]
+    clauses = [
+        'resource.type="cloud_run_revision"',
+        "(" + " OR ".join(f"resource.labels.service_name={_quote(name)}" for name in services) + ")",
+        f'(logName="projects/{project}/logs/run.googleapis.com%2Fstderr"'
+        f' OR logName="projects/{project}/logs/run.googleapis.com%2Fstdout")',
+        f'timestamp >= "{_format_timestamp(since)}"',
+    ]
+    if until is not None:
+        clauses.append(f'timestamp < "{_format_timestamp(until)}"')
+    
+    if severities:
+        clauses.append("(" + " OR ".join(
+            f"textPayload:{_quote(f'{level}:cloud-rca:')}" for level in sorted(severities)
+        ) + ")")
+    elif marker:
+        clauses.append('textPayload:"cloud-rca:"')
+    
+    for text in text_contains or ():
+        clauses.append(f"textPayload:{_quote(text)}")
+    
+    if trace_ids:
+        clauses.append("(" + " OR ".join(f"textPayload:{_quote(trace_id)}" for trace_id in trace_ids) + ")")
+    
+    return "\n".join(clauses)
+
+
+def _build_log_filter(project, service, since, until=None, query=None):
+    """Filter for one fetch window, applying the pushed-down query predicates"""
+    return build_log_filter(project, service, since, until, **(query or {}))
+
+
+# --- Streaming pipeline stages: fetch -> parse (+ severity filter) -> group ---
+
+def iter_entries(client, log_filter, cancel_event=None, progress_callback=None):
+    """
+    Yield raw entries for a filter, newest first, one API page at a time
+    
+    Args:
+        client: Cloud Logging client
+        log_filter: Logging query
+        cancel_event: threading.Event that aborts the fetch with FetchCancelled
+        progress_callback: Called with the number of new raw entries read,
+            every PROGRESS_INTERVAL entries
+    """
+    entries_iter = client.list_entries(
+        filter_=log_filter,
+        order_by=logging_v2.DESCENDING,
+        page_size=1000,
+    )
+    
+    count = 0
+    for entry in entries_iter:
+        if cancel_event is not None and cancel_event.is_set():
+            raise FetchCancelled("Log fetch cancelled")
+        count += 1
+        if progress_callback and count % PROGRESS_INTERVAL == 0:
+            progress_callback(PROGRESS_INTERVAL)
+        yield entry
+    
+    if progress_callback and count % PROGRESS_INTERVAL:
+        progress_callback(count % PROGRESS_INTERVAL)
+
+
+def iter_parsed(entries, severities=None, fast_json=True):
+    """
+    Yield parsed cloud-rca logs, skipping entries without a trace_id
+    
+    Streaming counterpart of parse_entries; `severities` drops other levels
+    before their JSON is decoded.
+    """
+    wanted = frozenset(severities) if severities else None
+    loads = _fast_json_loads if fast_json and _fast_json_loads else json.loads
+    for entry in entries:
+        parsed = _decode_entry(entry, wanted, loads)
+        if parsed is not None:
+            yield parsed
+
+
+def group_idle_traces(records, idle_seconds=TRACE_IDLE_SECONDS, max_open_traces=MAX_OPEN_TRACES):
+    """
+    Group a time-ordered record stream into (trace_id, logs) pairs
+    
+    A trace is finalized once the stream has moved `idle_seconds` past its
+    last entry, or when more than `max_open_traces` are open (the least
+    recently touched one goes first). A trace finalized early can therefore
+    be emitted again as a later fragment. Pass None to disable either bound.
+    
+    Yields:
+        (trace_id, LogRecords sorted by timestamp)
+    """
+    open_traces = OrderedDict()  # trace_id -> [last touched timestamp, logs]
+    
+    for record in records:
+        ts = _parse_timestamp(record.timestamp) or _EPOCH
+        trace_id = record.trace_id
+        slot = open_traces.get(trace_id)
+        if slot is None:
+            open_traces[trace_id] = [ts, [record]]
+        else:
+            slot[0] = ts
+            slot[1].append(record)
+            open_traces.move_to_end(trace_id)
+        
+        # Front of the OrderedDict is the least recently touched trace
+        while open_traces:
+            oldest_id, (touched, logs) = next(iter(open_traces.items()))
+            over_cap = max_open_traces is not None and len(open_traces) > max_open_traces
+            idle = idle_seconds is not None and abs((touched - ts).total_seconds()) > idle_seconds
+            if not (over_cap or idle):
+                break
+            del open_traces[oldest_id]
+            logs.sort(key=_timestamp_key)
+            yield oldest_id, logs
+    
+    for trace_id, (_, logs) in open_traces.items():
+        logs.sort(key=_timestamp_key)
+        yield trace_id, logs
+
+
+def _counted(iterable, stats, key):
+    """Pass items through while counting them into stats[key]"""
+    for item in iterable:
+        stats[key] += 1
+        yield item
+
+
+def stream_traces(credentials, time_range_minutes=60, project_id=None, service_name=None, severities=None,
+                  incremental=False, shards=1, save_to_file=False, client=None, cancel_event=None,
+                  progress_callback=None, idle_seconds=TRACE_IDLE_SECONDS, max_open_traces=MAX_OPEN_TRACES,
+                  text_contains=None, errors_only=False):
+    """
+    Stream traces from Cloud Run logs with bounded memory
+    
+    Entries flow through fetch -> parse -> severity filter -> group as a
+    generator chain, and each trace is yielded as soon as it goes idle, so
+    memory is bounded by the open traces rather than the window size.
+    Incremental, sharded and errors-only reads need the whole window before
+    emitting and go through the windowed path instead. Severity, marker and
+    text predicates are pushed down into the Logging query.
     
     Args:
         credentials: Google OAuth2 Credentials object (from credential_manager)
         time_range_minutes: How many minutes back to fetch logs
-        save_to_file: Whether to save logs to JSON file (default: True)
-        filename: Custom filename for saving (optional)
         project_id: GCP Project ID (uses default if not provided)
-        service_name: Service name to filter logs (uses default if not provided)
+        service_name: Service name (or list of names) to filter logs (uses
+            default if not provided)
+        severities: Only keep logs with these text severities (optional)
+        incremental: Only pull entries newer than the last fetch for this
+            project/service and merge them into a rolling in-memory window
+        shards: Number of time shards to fetch concurrently, or "auto" to
+            size it from the entry density of the window (default: 1)
+        save_to_file: Append fetched traces to the log segment store; with
+            incremental=True only the newly fetched logs are appended
+        client: Pre-built logging client (optional, mainly for offline use)
+        cancel_event: threading.Event that aborts the fetch with FetchCancelled
+        progress_callback: Called with the number of new raw entries read,
+            every PROGRESS_INTERVAL entries (may be called from pool threads)
+        idle_seconds: Stream-time gap after which a trace is finalized
+        max_open_traces: Cap on traces held open at once
+        text_contains: Substrings every fetched line must contain (optional)
+        errors_only: Two-phase mode: find trace ids with ERROR/CRITICAL logs
+            first, then fetch only those traces' full context
     
-    Returns:
-        Dictionary of log entries grouped by trace_id
+    Yields:
+        (trace_id, logs sorted by timestamp)
     """
     # Use provided project_id or default
     project = project_id or DEFAULT_PROJECT_ID
@@ -169,55 +606,447 @@ def fetch_logs(credentials, time_range_minutes=60, save_to_file=True, filename=N
     if credentials:
         print(f"🔑 Auth Token present: {bool(credentials.token)}")
     
-    try:
-        client = logging_v2.Client(project=project, credentials=credentials)
-    except Exception as e:
-        print(f"❌ Failed to initialize logging client: {e}")
-        raise
+    if client is None:
+        try:
+            client = get_logging_client(project, credentials)
+        except Exception as e:
+            print(f"❌ Failed to initialize logging client: {e}")
+            raise
     
     # Time filter for recent logs
-    start_time = datetime.utcnow() - timedelta(minutes=time_range_minutes)
-    timestamp_filter = f'timestamp >= "{start_time.isoformat()}Z"'
+    start_time = datetime.now(timezone.utc) - timedelta(minutes=time_range_minutes)
     
-    log_filter = f'''
-        resource.type="cloud_run_revision"
-        resource.labels.service_name="{service}"
-        (logName="projects/{project}/logs/run.googleapis.com%2Fstderr"
-         OR logName="projects/{project}/logs/run.googleapis.com%2Fstdout")
-        {timestamp_filter}
-    '''
+    query = {"severities": tuple(severities) if severities else None,
+             "text_contains": tuple(text_contains) if text_contains else None}
+    store_writer = get_store(project, _service_key(service)).writer() if save_to_file else None
+    windowed = errors_only or incremental or shards != 1
     
-    entries_iter = client.list_entries(
-        filter_=log_filter,
-        order_by=logging_v2.DESCENDING,
-        page_size=1000,
+    if errors_only:
+        traces, count_entries, count_parsed = _collect_error_traces(
+            client, project, service, start_time, query, cancel_event, progress_callback,
+        )
+        fresh_traces = traces
+    elif windowed:
+        traces, fresh_traces, count_entries, count_parsed = _collect_window(
+            client, project, service, start_time, query, incremental, shards,
+            cancel_event, progress_callback,
+        )
+    
+    if windowed:
+        if store_writer:
+            with store_writer:
+                for trace_id, logs in fresh_traces.items():
+                    store_writer.add(trace_id, logs)
+        trace_count = len(traces)
+        yield from traces.items()
+    else:
+        stats = {"entries": 0, "parsed": 0}
+        entries = iter_entries(client, _build_log_filter(project, service, start_time, query=query), cancel_event, progress_callback)
+        records = _counted(iter_parsed(_counted(entries, stats, "entries"), severities), stats, "parsed")
+        
+        trace_count = 0
+        try:
+            for trace_id, logs in group_idle_traces(records, idle_seconds, max_open_traces):
+                trace_count += 1
+                if store_writer:
+                    store_writer.add(trace_id, logs)
+                yield trace_id, logs
+        finally:
+            if store_writer:
+                store_writer.flush()
+        count_entries, count_parsed = stats["entries"], stats["parsed"]
+    
+    print(f"✅ Fetched {count_parsed} logs across {trace_count} traces")
+    print(f"   (Raw entries: {count_entries} | Parsed: {count_parsed})")
+
+
+def fetch_logs(credentials, time_range_minutes=60, save_to_file=True, filename=None, project_id=None, service_name=None,
+               incremental=False, shards=1, client=None, cancel_event=None, progress_callback=None, severities=None,
+               text_contains=None, errors_only=False):
+    """
+    Fetch logs from Cloud Run for given time range
+    
+    Compatibility wrapper that collects stream_traces() into a dictionary.
+    
+    Args:
+        credentials: Google OAuth2 Credentials object (from credential_manager)
+        time_range_minutes: How many minutes back to fetch logs
+        save_to_file: Whether to persist logs (default: True). Logs go to the
+            compressed segment store unless a filename is given
+        filename: Export to this JSON file in data/ instead (optional)
+        project_id: GCP Project ID (uses default if not provided)
+        service_name: Service name to filter logs (uses default if not provided)
+        incremental: Only pull entries newer than the last fetch for this
+            project/service and merge them into a rolling in-memory window
+        shards: Number of time shards to fetch concurrently, or "auto" to
+            size it from the entry density of the window (default: 1)
+        client: Pre-built logging client (optional, mainly for offline use)
+        cancel_event: threading.Event that aborts the fetch with FetchCancelled
+        progress_callback: Called with the number of new raw entries read,
+            every PROGRESS_INTERVAL entries (may be called from pool threads)
+        severities: Only keep logs with these text severities (optional)
+        text_contains: Substrings every fetched line must contain (optional)
+        errors_only: Only fetch traces that contain ERROR/CRITICAL logs
+    
+    Returns:
+        Dictionary of log entries grouped by trace_id
+    """
+    # Everything is held in memory anyway, so no idle/cap bounds are needed
+    traces_dict = dict(stream_traces(
+        credentials,
+        time_range_minutes=time_range_minutes,
+        project_id=project_id,
+        service_name=service_name,
+        severities=severities,
+        incremental=incremental,
+        shards=shards,
+        save_to_file=save_to_file and filename is None,
+        client=client,
+        cancel_event=cancel_event,
+        progress_callback=progress_callback,
+        idle_seconds=None,
+        max_open_traces=None,
+        text_contains=text_contains,
+        errors_only=errors_only,
+    ))
+    
+    # Explicit JSON export if a filename was requested
+    if save_to_file and filename is not None:
+        save_logs_to_json(
+            traces_dict, filename,
+            project_id=project_id or DEFAULT_PROJECT_ID,
+            service_name=service_name or DEFAULT_SERVICE_NAME,
+        )
+    
+    return traces_dict
+
+
+def _collect_window(client, project, service, start_time, query, incremental, shards, cancel_event, progress_callback):
+    """
+    Read a whole window into memory, optionally through the incremental checkpoint
+    
+    Returns:
+        (traces dict, newly fetched traces, raw entry count, parsed count)
+    """
+    if not incremental:
+        traces, count_entries, count_parsed, _ = _fetch_window(
+            client, project, service, start_time, shards=shards, query=query,
+            cancel_event=cancel_event, progress_callback=progress_callback,
+        )
+        return dict(traces), traces, count_entries, count_parsed
+    
+    checkpoint = _get_checkpoint(project, service, query)
+    with checkpoint["lock"]:
+        # The rolling window can only serve this request if it already
+        # covers the requested start; otherwise re-read the whole window.
+        warm = (
+            checkpoint["last_timestamp"] is not None
+            and checkpoint["window_start"] is not None
+            and checkpoint["window_start"] <= start_time
+        )
+        if warm:
+            # Overlap the previous fetch to pick up late-ingested entries
+            since = max(checkpoint["last_timestamp"] - INGESTION_LOOKBACK, start_time)
+            print(f"⏩ Incremental fetch since {since.isoformat()}")
+        else:
+            since = start_time
+            checkpoint["traces"] = defaultdict(list)
+            checkpoint["last_timestamp"] = None
+            checkpoint["seen_insert_ids"] = {}
+        
+        new_traces, count_entries, count_parsed, high_water = _fetch_window(
+            client, project, service, since,
+            skip_insert_ids=checkpoint["seen_insert_ids"],
+            shards=shards,
+            query=query,
+            cancel_event=cancel_event,
+            progress_callback=progress_callback,
+        )
+        
+        window = checkpoint["traces"]
+        for trace_id, logs in new_traces.items():
+            window[trace_id].extend(logs)
+            window[trace_id].sort(key=_timestamp_key)
+        _expire_traces(window, start_time)
+        
+        newest, fetched_ids = high_water
+        if newest is not None and (checkpoint["last_timestamp"] is None or newest > checkpoint["last_timestamp"]):
+            checkpoint["last_timestamp"] = newest
+        elif checkpoint["last_timestamp"] is None:
+            # Nothing in the window yet: resume from the window start
+            checkpoint["last_timestamp"] = start_time
+        # Only ids inside the next fetch's overlap can be read again
+        overlap_start = checkpoint["last_timestamp"] - INGESTION_LOOKBACK
+        seen = checkpoint["seen_insert_ids"]
+        seen.update(fetched_ids)
+        for insert_id in [i for i, ts in seen.items() if ts < overlap_start]:
+            del seen[insert_id]
+        checkpoint["window_start"] = start_time
+        
+        traces_dict = {trace_id: list(logs) for trace_id, logs in window.items()}
+    
+    return traces_dict, new_traces, count_entries, count_parsed
+
+
+def _collect_error_traces(client, project, service, start_time, query, cancel_event, progress_callback):
+    """
+    Two-phase "traces with errors only" fetch
+    
+    Phase 1 pulls only ERROR/CRITICAL cloud-rca lines to learn which traces
+    failed. Phase 2 fetches those traces' full context (at the requested
+    severities) with trace-id predicates, TRACE_ID_CHUNK_SIZE ids per query,
+    on a bounded thread pool.
+    
+    Returns:
+        (traces dict, raw entry count, parsed count)
+    """
+    error_query = dict(query, severities=ERROR_SEVERITIES)
+    errors, count_entries, _ = _scan_entries(
+        client, _build_log_filter(project, service, start_time, query=error_query),
+        severities=ERROR_SEVERITIES, cancel_event=cancel_event, progress_callback=progress_callback,
     )
+    trace_ids = list(dict.fromkeys(record.trace_id for record in errors))
+    print(f"🎯 Phase 1: {len(trace_ids)} traces with errors ({count_entries} raw entries)")
+    if not trace_ids:
+        return {}, count_entries, 0
+    
+    # Context fetch: the text predicates only select error lines, so drop them here
+    context_query = {"severities": query.get("severities")}
+    chunks = [trace_ids[i:i + TRACE_ID_CHUNK_SIZE] for i in range(0, len(trace_ids), TRACE_ID_CHUNK_SIZE)]
+    
+    def scan(chunk):
+        return _scan_entries(
+            client, _build_log_filter(project, service, start_time, query=dict(context_query, trace_ids=chunk)),
+            severities=context_query["severities"], cancel_event=cancel_event, progress_callback=progress_callback,
+        )
     
+    with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_FETCH_WORKERS)) as pool:
+        results = list(pool.map(scan, chunks))
+    
+    wanted = set(trace_ids)
     traces = defaultdict(list)
-    count_entries = 0
     count_parsed = 0
+    for records, scanned, _ in results:
+        count_entries += scanned
+        for record in records:
+            # A text match can hit lines that merely mention the id
+            if record.trace_id in wanted:
+                traces[record.trace_id].append(record)
+                count_parsed += 1
+    for logs in traces.values():
+        logs.sort(key=_timestamp_key)
+    return dict(traces), count_entries, count_parsed
+
+
+def _estimate_shard_count(client, project, service, since, until, query=None):
+    """
+    Size the shard count from the density of the newest page of entries
     
-    for entry in entries_iter:
-        count_entries += 1
-        parsed = parse_log_entry(entry)
-        if parsed and parsed["trace_id"]:
-            count_parsed += 1
-            traces[parsed["trace_id"]].append(parsed)
+    A window that fits in one sample page is not worth sharding. Otherwise
+    the sample's time span gives an entries/second estimate for the window.
+    """
+    sample = list(itertools.islice(
+        client.list_entries(
+            filter_=_build_log_filter(project, service, since, until, query=query),
+            order_by=logging_v2.DESCENDING,
+            page_size=SHARD_SAMPLE_SIZE,
+        ),
+        SHARD_SAMPLE_SIZE,
+    ))
+    if len(sample) < SHARD_SAMPLE_SIZE:
+        return 1
+    
+    span = (sample[0].timestamp - sample[-1].timestamp).total_seconds()
+    window = (until - since).total_seconds()
+    if span <= 0:
+        return MAX_FETCH_SHARDS
+    expected_entries = len(sample) / span * window
+    return max(1, min(MAX_FETCH_SHARDS, math.ceil(expected_entries / ENTRIES_PER_SHARD)))
+
+
+def _scan_entries(client, log_filter, skip_insert_ids=None, severities=None, cancel_event=None, progress_callback=None):
+    """
+    Run one filter through the pipeline stages into a list (newest first)
+    
+    Returns:
+        ([parsed log], raw entry count, (newest timestamp, {insertId: timestamp}))
+    """
+    stats = {"entries": 0}
+    high_water = [None, {}]
+    
+    def tracked(entries):
+        for entry in entries:
+            if skip_insert_ids and entry.insert_id in skip_insert_ids:
+                continue
+            stats["entries"] += 1
+            
+            # Track the high-water mark on raw entries so unparseable lines
+            # are not re-read on the next incremental fetch either
+            if entry.timestamp is not None:
+                if high_water[0] is None or entry.timestamp > high_water[0]:
+                    high_water[0] = entry.timestamp
+                if entry.insert_id is not None:
+                    high_water[1][entry.insert_id] = entry.timestamp
+            yield entry
+    
+    records = parse_entries(tracked(iter_entries(client, log_filter, cancel_event, progress_callback)), severities)
+    
+    return records, stats["entries"], tuple(high_water)
+
+
+def _fetch_window(client, project, service, since, skip_insert_ids=None, shards=1,
+                  query=None, cancel_event=None, progress_callback=None):
+    """
+    Read and parse every entry newer than `since` for a Cloud Run service
+    
+    Entries whose insertId is in `skip_insert_ids` were already consumed by a
+    previous fetch (its lookback overlap) and are skipped. With more than
+    one shard, [since, now] is split into equal sub-windows that are fetched
+    on a bounded thread pool and k-way merged newest first.
+    
+    Returns:
+        (traces, raw entry count, parsed count, (newest timestamp, {insertId: timestamp}))
+    """
+    now = datetime.now(timezone.utc)
+    if shards == "auto":
+        shards = _estimate_shard_count(client, project, service, since, now, query)
+    shards = max(1, int(shards or 1))
+    
+    def scan(log_filter):
+        return _scan_entries(
+            client, log_filter, skip_insert_ids, (query or {}).get("severities"),
+            cancel_event, progress_callback,
+        )
+    
+    if shards == 1:
+        results = [scan(_build_log_filter(project, service, since, query=query))]
+    else:
+        step = (now - since) / shards
+        bounds = [since + step * i for i in range(shards)]
+        # The newest shard stays open-ended so entries landing mid-fetch are kept
+        filters = [
+            _build_log_filter(project, service, lower, bounds[i + 1] if i + 1 < shards else None, query=query)
+            for i, lower in enumerate(bounds)
+        ]
+        print(f"🧩 Fetching {shards} time shards concurrently")
+        with ThreadPoolExecutor(max_workers=min(shards, MAX_FETCH_WORKERS)) as pool:
+            results = list(pool.map(scan, filters))
+    
+    traces = defaultdict(list)
+    count_parsed = 0
+    merged = heapq.merge(*(records for records, _, _ in results), key=_timestamp_key, reverse=True)
+    for parsed in merged:
+        count_parsed += 1
+        traces[parsed.trace_id].append(parsed)
     
     # Sort logs within each trace by timestamp
     for trace_id in traces:
-        traces[trace_id].sort(key=lambda x: x["timestamp"])
+        traces[trace_id].sort(key=_timestamp_key)
     
-    traces_dict = dict(traces)
+    count_entries = sum(count for _, count, _ in results)
+    newest_timestamp = None
+    fetched_ids = {}
+    for _, _, (ts, insert_ids) in results:
+        fetched_ids.update(insert_ids)
+        if ts is not None and (newest_timestamp is None or ts > newest_timestamp):
+            newest_timestamp = ts
     
-    print(f"✅ Fetched {count_parsed} logs across {len(traces_dict)} traces")
-    print(f"   (Raw entries: {count_entries} | Parsed: {count_parsed})")
+    return traces, count_entries, count_parsed, (newest_timestamp, fetched_ids)
+
+
+async def _run_in_fetch_executor(work, timeout=None, on_progress=None):
+    """
+    Run work(cancel_event, progress_callback) on the fetch pool
     
-    # Save to file if requested
-    if save_to_file:
-        save_logs_to_json(traces_dict, filename, project_id=project, service_name=service)
+    If the awaiting task is cancelled or the timeout expires, the worker
+    thread is told to stop at the next entry instead of finishing the window.
+    """
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    progress_callback = None
     
-    return traces_dict
+    if on_progress is not None:
+        progress_lock = threading.Lock()
+        progress = {"entries_read": 0}
+        
+        def progress_callback(delta):
+            with progress_lock:
+                progress["entries_read"] += delta
+                snapshot = dict(progress)
+            loop.call_soon_threadsafe(on_progress, snapshot)
+    
+    future = loop.run_in_executor(_FETCH_EXECUTOR, lambda: work(cancel_event, progress_callback))
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        cancel_event.set()
+        print(f"⏱️ Log fetch timed out after {timeout}s")
+        raise
+    except asyncio.CancelledError:
+        cancel_event.set()
+        print("🛑 Log fetch cancelled")
+        raise
+
+
+async def fetch_logs_async(credentials, time_range_minutes=60, timeout=None, on_progress=None, **kwargs):
+    """
+    Async wrapper around fetch_logs that keeps the event loop responsive
+    
+    Paging and parsing run on a dedicated thread pool and can be cancelled.
+    
+    Args:
+        credentials: Google OAuth2 Credentials object (from credential_manager)
+        time_range_minutes: How many minutes back to fetch logs
+        timeout: Seconds before the fetch is abandoned (raises TimeoutError)
+        on_progress: Optional callable(stats) invoked on the event loop with
+            {"entries_read": total raw entries so far}
+        **kwargs: Passed through to fetch_logs
+    
+    Returns:
+        Dictionary of log entries grouped by trace_id
+    """
+    return await _run_in_fetch_executor(
+        lambda cancel_event, progress_callback: fetch_logs(
+            credentials,
+            time_range_minutes=time_range_minutes,
+            cancel_event=cancel_event,
+            progress_callback=progress_callback,
+            **kwargs,
+        ),
+        timeout=timeout,
+        on_progress=on_progress,
+    )
+
+
+async def consume_traces_async(consumer, credentials, time_range_minutes=60, timeout=None, on_progress=None, **kwargs):
+    """
+    Feed stream_traces() into consumer(trace_iterable) on the fetch pool
+    
+    The consumer (e.g. a grouping function) sees traces as soon as they are
+    finalized, so nothing materializes the full window.
+    
+    Args:
+        consumer: Callable taking an iterable of (trace_id, logs) pairs
+        credentials: Google OAuth2 Credentials object (from credential_manager)
+        time_range_minutes: How many minutes back to fetch logs
+        timeout: Seconds before the fetch is abandoned (raises TimeoutError)
+        on_progress: Optional callable(stats) invoked on the event loop
+        **kwargs: Passed through to stream_traces
+    
+    Returns:
+        Whatever the consumer returns
+    """
+    return await _run_in_fetch_executor(
+        lambda cancel_event, progress_callback: consumer(stream_traces(
+            credentials,
+            time_range_minutes=time_range_minutes,
+            cancel_event=cancel_event,
+            progress_callback=progress_callback,
+            **kwargs,
+        )),
+        timeout=timeout,
+        on_progress=on_progress,
+    )
 
 
 def load_logs_from_json(filename):
@@ -245,25 +1074,51 @@ def load_logs_from_json(filename):
     return data
 
 
+def load_trace(trace_id, project_id=None, service_name=None):
+    """
+    Load a single archived trace from the segment store
+    
+    Only the indexed blocks holding the trace are decompressed, so this stays
+    fast on large archives.
+    
+    Args:
+        trace_id: Trace to load
+        project_id: Restrict the lookup to this project's store (optional)
+        service_name: Service of that store (uses default if not provided)
+    
+    Returns:
+        Time-sorted list of log dicts (empty if the trace is not archived)
+    """
+    if project_id:
+        return get_store(project_id, service_name or DEFAULT_SERVICE_NAME).read_trace(trace_id)
+    return find_trace(trace_id)
+
+
 def list_saved_logs():
-    """List all saved log files in data/ folder"""
+    """List all saved log files in data/ folder (cached until the folder changes)"""
     if not os.path.exists(DATA_DIR):
         print(f"⚠️ No data directory found")
         return []
     
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('.json')]
+    mtime = os.stat(DATA_DIR).st_mtime_ns
+    if _SAVED_LOGS_CACHE["mtime"] != mtime:
+        with os.scandir(DATA_DIR) as it:
+            listing = sorted(
+                (e.name, e.stat().st_size) for e in it
+                if e.is_file() and e.name.endswith('.json')
+            )
+        _SAVED_LOGS_CACHE.update(mtime=mtime, files=listing)
+    listing = _SAVED_LOGS_CACHE["files"]
     
-    if not files:
+    if not listing:
         print(f"⚠️ No log files found in {DATA_DIR}/")
         return []
     
-    print(f"📁 Found {len(files)} log file(s) in {DATA_DIR}/:")
-    for f in sorted(files):
-        filepath = os.path.join(DATA_DIR, f)
-        size = os.path.getsize(filepath)
-        print(f"   - {f} ({size:,} bytes)")
+    print(f"📁 Found {len(listing)} log file(s) in {DATA_DIR}/:")
+    for name, size in listing:
+        print(f"   - {name} ({size:,} bytes)")
     
-    return files
+    return [name for name, _ in listing]
 
 
 def display_logs_formatted(traces):
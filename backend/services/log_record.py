@@ -0,0 +1,106 @@
+"""
+Compact record type for parsed cloud-rca logs
+
+Parsed logs used to be nine-key dicts with a private copy of the resource
+labels. LogRecord stores the same fields in __slots__, interns the highly
+repetitive strings (service, severity, log name) and shares one labels dict
+per distinct label set, which cuts the per-entry footprint several times.
+
+Dict-style access (record["severity"], record.get("service")) still works
+so existing consumers keep running unchanged.
+"""
+import sys
+import threading
+
+LOG_RECORD_FIELDS = (
+    "trace_id",
+    "message",
+    "service",
+    "root_cause",
+    "suggestion",
+    "timestamp",
+    "severity",
+    "log_name",
+    "resource_labels",
+)
+
+# Shared, read-only label dicts keyed by their items
+_LABELS_CACHE = {}
+_LABELS_CACHE_LIMIT = 10000
+_LABELS_LOCK = threading.Lock()
+_EMPTY_LABELS = {}
+
+
+def _intern(value):
+    """Intern strings so repeated values share one object"""
+    return sys.intern(value) if type(value) is str else value
+
+
+def shared_labels(labels):
+    """
+    Return a shared dict equal to `labels`
+    
+    Callers must treat the result as read-only; it is shared by every
+    record from the same resource.
+    """
+    if not labels:
+        return _EMPTY_LABELS
+    key = tuple(labels.items())
+    cached = _LABELS_CACHE.get(key)
+    if cached is None:
+        with _LABELS_LOCK:
+            if len(_LABELS_CACHE) >= _LABELS_CACHE_LIMIT:
+                _LABELS_CACHE.clear()
+            cached = _LABELS_CACHE.setdefault(key, dict(key))
+    return cached
+
+
+class LogRecord:
+    """One parsed cloud-rca log line"""
+
+    __slots__ = LOG_RECORD_FIELDS
+
+    def __init__(self, trace_id, message=None, service=None, root_cause=None, suggestion=None,
+                 timestamp=None, severity=None, log_name=None, resource_labels=None):
+        self.trace_id = trace_id
+        self.message = message
+        self.service = _intern(service)
+        self.root_cause = root_cause
+        self.suggestion = suggestion
+        self.timestamp = timestamp
+        self.severity = _intern(severity)
+        self.log_name = _intern(log_name)
+        self.resource_labels = shared_labels(resource_labels)
+
+    # --- dict compatibility ---
+    def __getitem__(self, key):
+        if key not in LOG_RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in LOG_RECORD_FIELDS:
+            return default
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in LOG_RECORD_FIELDS
+
+    def __eq__(self, other):
+        if not isinstance(other, LogRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in LOG_RECORD_FIELDS)
+
+    def __repr__(self):
+        return f"LogRecord(trace_id={self.trace_id!r}, severity={self.severity!r}, timestamp={self.timestamp!r})"
+
+    def to_dict(self):
+        """Plain dict for JSON serialization"""
+        data = {field: getattr(self, field) for field in LOG_RECORD_FIELDS}
+        data["resource_labels"] = dict(self.resource_labels)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from a saved/serialized log dict"""
+        return cls(**{field: data.get(field) for field in LOG_RECORD_FIELDS})
@@ -0,0 +1,438 @@
+"""
+Pluggable Log Sources
+
+The analysis pipeline consumes (trace_id, logs) pairs and does not care
+where they come from. A LogSource produces them:
+
+- CloudLoggingSource: live Cloud Logging reads (services.log_collector)
+- ReplayLogSource: saved archives (segment store or legacy data/*.json),
+  optionally paced at a multiple of the original speed
+- SyntheticLogSource: generated cloud-rca entries at a configurable rate,
+  run through the same parse/group stages as live entries
+
+Replay and synthetic sources need no network, so ingestion and grouping can
+be profiled and load-tested offline and reproducibly. The source is chosen
+per tenant through the `log_source` field of its user_credentials document
+(or the LOG_SOURCE environment variable), e.g. "synthetic" or
+{"type": "replay", "speed": 10}. Which archive a tenant replays is decided
+server-side from its own project, never by that setting.
+"""
+import abc
+import json
+import os
+import random
+import string
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from services.log_collector import (
+    DATA_DIR,
+    DEFAULT_PROJECT_ID,
+    DEFAULT_SERVICE_NAME,
+    FetchCancelled,
+    MAX_OPEN_TRACES,
+    PROGRESS_INTERVAL,
+    TRACE_IDLE_SECONDS,
+    _run_in_fetch_executor,
+    group_idle_traces,
+    iter_parsed,
+    stream_traces,
+)
+from services.log_record import LogRecord
+from services.log_store import get_store
+
+DEFAULT_LOG_SOURCE = os.getenv("LOG_SOURCE", "cloud")
+
+
+class LogSource(abc.ABC):
+    """Base class: a producer of (trace_id, logs) pairs for a time window"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def stream_traces(self, time_range_minutes=60, severities=None, cancel_event=None, progress_callback=None):
+        """
+        Yield (trace_id, time-sorted LogRecords) pairs
+
+        Args:
+            time_range_minutes: How many minutes of logs to produce
+            severities: Only keep logs with these text severities (optional)
+            cancel_event: threading.Event that aborts with FetchCancelled
+            progress_callback: Called with the number of new raw entries read
+        """
+
+    async def consume_async(self, consumer, time_range_minutes=60, timeout=None, on_progress=None, **kwargs):
+        """
+        Feed stream_traces() into consumer(trace_iterable) on the fetch pool
+
+        Same contract as log_collector.consume_traces_async: cancellable,
+        bounded by `timeout`, with progress reported on the event loop.
+        """
+        return await _run_in_fetch_executor(
+            lambda cancel_event, progress_callback: consumer(self.stream_traces(
+                time_range_minutes,
+                cancel_event=cancel_event,
+                progress_callback=progress_callback,
+                **kwargs,
+            )),
+            timeout=timeout,
+            on_progress=on_progress,
+        )
+
+
+class CloudLoggingSource(LogSource):
+    """Live Cloud Logging reads through log_collector.stream_traces"""
+
+    name = "cloud"
+
+    def __init__(self, credentials, project_id=None, service_name=None, client=None, **fetch_options):
+        """
+        Args:
+            credentials: Google OAuth2 Credentials object (from credential_manager)
+            project_id: GCP Project ID (uses default if not provided)
+            service_name: Service name or list of names (uses default if not provided)
+            client: Pre-built logging client (optional)
+            **fetch_options: Passed through to stream_traces (incremental,
+                shards, save_to_file, errors_only, ...)
+        """
+        self.credentials = credentials
+        self.project_id = project_id
+        self.service_name = service_name
+        self.client = client
+        self.fetch_options = fetch_options
+
+    def stream_traces(self, time_range_minutes=60, severities=None, cancel_event=None, progress_callback=None):
+        return stream_traces(
+            self.credentials,
+            time_range_minutes=time_range_minutes,
+            project_id=self.project_id,
+            service_name=self.service_name,
+            severities=severities,
+            client=self.client,
+            cancel_event=cancel_event,
+            progress_callback=progress_callback,
+            **self.fetch_options,
+        )
+
+
+class ReplayLogSource(LogSource):
+    """
+    Replays archived traces from the segment store or a legacy data/ JSON file
+
+    The window is measured back from the newest archived log, so old archives
+    replay in full. Traces are released in order of their last log; `speed`
+    scales the original gaps between them (1.0 = real time, 10 = ten times
+    faster, 0 = as fast as possible).
+    """
+
+    name = "replay"
+
+    def __init__(self, project_id=None, service_name=None, filename=None, speed=0, base_dir=None):
+        self.project_id = project_id or DEFAULT_PROJECT_ID
+        self.service_name = service_name or DEFAULT_SERVICE_NAME
+        self.filename = os.path.basename(filename) if filename else None
+        self.speed = float(speed or 0)
+        self.base_dir = base_dir
+
+    def _load_fragments(self, time_range_minutes):
+        """Archived (trace_id, log dicts) fragments inside the replay window"""
+        if self.filename:
+            with open(os.path.join(DATA_DIR, self.filename), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("project_id") and data["project_id"] != self.project_id:
+                raise ValueError(f"{self.filename} does not belong to project {self.project_id}")
+            traces = data["traces"]
+            newest = max((t["last_seen"] for t in traces.values() if t.get("last_seen")), default=None)
+            since = _window_start(newest, time_range_minutes)
+            for trace_id, trace in traces.items():
+                if not since or not trace.get("last_seen") or trace["last_seen"] >= since:
+                    yield trace_id, trace["logs"]
+            return
+
+        store = get_store(self.project_id, self.service_name, base_dir=self.base_dir)
+        _, newest = store.time_range()
+        for trace in store.iter_traces(since=_window_start(newest, time_range_minutes)):
+            yield trace["trace_id"], trace["logs"]
+
+    def stream_traces(self, time_range_minutes=60, severities=None, cancel_event=None, progress_callback=None):
+        wanted = frozenset(severities) if severities else None
+
+        # Overlapping fetches archive the same log more than once; merge fragments
+        merged = defaultdict(dict)
+        for trace_id, logs in self._load_fragments(time_range_minutes):
+            logs_by_key = merged[trace_id]
+            for log in logs:
+                key = (log.get("timestamp"), log.get("severity"), log.get("message"))
+                logs_by_key.setdefault(key, log)
+
+        traces = []
+        for trace_id, logs_by_key in merged.items():
+            logs = sorted(
+                (LogRecord.from_dict(log) for log in logs_by_key.values()
+                 if wanted is None or log.get("severity") in wanted),
+                key=lambda record: record.timestamp or "",
+            )
+            if logs:
+                traces.append((logs[-1].timestamp or "", trace_id, logs))
+        traces.sort(key=lambda item: item[0])
+
+        print(f"⏯️ Replaying {len(traces)} archived traces (speed: {self.speed or 'max'})")
+        previous = None
+        for released_at, trace_id, logs in traces:
+            if cancel_event is not None and cancel_event.is_set():
+                raise FetchCancelled("Log replay cancelled")
+            if self.speed > 0 and previous and released_at:
+                delay = (_parse_iso(released_at) - _parse_iso(previous)).total_seconds() / self.speed
+                if delay > 0 and cancel_event is None:
+                    time.sleep(delay)
+                elif delay > 0 and cancel_event.wait(delay):
+                    raise FetchCancelled("Log replay cancelled")
+            previous = released_at or previous
+            if progress_callback:
+                progress_callback(len(logs))
+            yield trace_id, logs
+
+
+# --- Synthetic generation ---
+
+class SyntheticResource:
+    """Minimal stand-in for a Cloud Run monitored resource"""
+
+    def __init__(self, service):
+        self.labels = {"service_name": service}
+
+
+class SyntheticEntry:
+    """Minimal stand-in for a Cloud Logging entry (the fields the parser reads)"""
+
+    __slots__ = ("timestamp", "insert_id", "payload", "log_name", "resource")
+
+    def __init__(self, timestamp, insert_id, payload, log_name, resource):
+        self.timestamp = timestamp
+        self.insert_id = insert_id
+        self.payload = payload
+        self.log_name = log_name
+        self.resource = resource
+
+
+# (severity, message template, root cause, suggestion); placeholders are
+# filled with the variable parts real logs carry (ids, addresses, timings)
+_FAILURE_TEMPLATES = (
+    ("ERROR", "Connection to db-{shard} timed out after {ms}ms",
+     "Database connection pool exhausted", "Increase pool size or add read replicas"),
+    ("ERROR", "User {uuid} not found in accounts table",
+     "Stale session referencing a deleted account", "Invalidate sessions on account deletion"),
+    ("ERROR", "Upstream 10.0.{octet}.{octet2}:8080 returned 503",
+     "Downstream service unavailable", "Add retries with backoff and a circuit breaker"),
+    ("CRITICAL", "Container OOMKilled after using {mb}Mi of 512Mi",
+     "Memory limit too low for peak load", "Raise the memory limit or fix the leak"),
+    ("WARNING", "Payment {hex} retried {count} times before success",
+     "Payment provider latency", "Tune the provider client timeout"),
+    ("WARNING", "Cache miss ratio {pct}% above threshold",
+     "Cold cache after deploy", "Warm the cache during rollout"),
+)
+_INFO_TEMPLATES = (
+    "GET /api/orders/{count} 200 in {ms}ms",
+    "POST /api/checkout 201 in {ms}ms",
+    "Processed batch {hex} with {count} items",
+)
+
+
+_PLACEHOLDERS = {
+    "shard": lambda rng: rng.randint(1, 8),
+    "ms": lambda rng: rng.randint(5, 30000),
+    "uuid": lambda rng: uuid.UUID(int=rng.getrandbits(128)),
+    "octet": lambda rng: rng.randint(0, 255),
+    "octet2": lambda rng: rng.randint(1, 254),
+    "mb": lambda rng: rng.randint(500, 900),
+    "hex": lambda rng: f"{rng.getrandbits(48):012x}",
+    "count": lambda rng: rng.randint(1, 500),
+    "pct": lambda rng: rng.randint(20, 99),
+}
+_TEMPLATE_FIELDS = {}
+
+
+def _fill(template, rng):
+    """Format a template, drawing values only for the placeholders it uses"""
+    fields = _TEMPLATE_FIELDS.get(template)
+    if fields is None:
+        fields = _TEMPLATE_FIELDS[template] = tuple(
+            name for _, name, _, _ in string.Formatter().parse(template) if name
+        )
+    return template.format(**{name: _PLACEHOLDERS[name](rng) for name in fields})
+
+
+def iter_synthetic_entries(time_range_minutes=60, entries_per_minute=1000, services=(DEFAULT_SERVICE_NAME,),
+                           error_ratio=0.2, spans_per_trace=(3, 8), seed=0, end=None):
+    """
+    Lazily generate cloud-rca entries for a window, oldest first
+
+    Each trace is a short burst of spans on one service; a share of traces
+    (`error_ratio`) end in a templated WARNING/ERROR/CRITICAL failure.
+
+    Args:
+        time_range_minutes: Window length
+        entries_per_minute: Average entry rate
+        services: Service names to spread traces over
+        error_ratio: Fraction of traces that fail
+        spans_per_trace: (min, max) entries per trace
+        seed: Random seed, so runs are reproducible
+        end: Aware datetime the window ends at (default: now)
+
+    Yields:
+        SyntheticEntry objects accepted by log_collector's parser
+    """
+    rng = random.Random(seed)
+    random_value = rng.random
+    end = end or datetime.now(timezone.utc)
+    start = end - timedelta(minutes=time_range_minutes)
+    total = int(time_range_minutes * entries_per_minute)
+    low_spans, high_spans = spans_per_trace
+    trace_gap = (end - start).total_seconds() / max(total / ((low_spans + high_spans) / 2), 1)
+    log_name = f"projects/{DEFAULT_PROJECT_ID}/logs/run.googleapis.com%2Fstdout"
+    resources = [(json.dumps(service), SyntheticResource(service)) for service in services]
+
+    # INFO lines dominate; draw them from a pre-encoded pool so generation
+    # stays cheap next to the parsing it is meant to exercise
+    info_pool = [json.dumps(_fill(rng.choice(_INFO_TEMPLATES), rng)) for _ in range(512)]
+
+    emitted = 0
+    offset = 0.0
+    trace_number = 0
+    while emitted < total:
+        trace_id = f"{rng.getrandbits(64):016x}"
+        service_json, resource = resources[int(random_value() * len(resources))]
+        spans = min(low_spans + int(random_value() * (high_spans - low_spans + 1)), total - emitted)
+        failure = None
+        if random_value() < error_ratio:
+            severity, template, root_cause, suggestion = _FAILURE_TEMPLATES[int(random_value() * len(_FAILURE_TEMPLATES))]
+            failure = (
+                f'{severity}:cloud-rca:{{"trace_id":"{trace_id}","service":{service_json},'
+                f'"message":{json.dumps(_fill(template, rng))},'
+                f'"root_cause":{json.dumps(root_cause)},"suggestion":{json.dumps(suggestion)}}}'
+            )
+        info_prefix = f'INFO:cloud-rca:{{"trace_id":"{trace_id}","service":{service_json},"message":'
+
+        ts = start + timedelta(seconds=offset)
+        for span in range(spans):
+            if failure is not None and span == spans - 1:
+                payload = failure
+            else:
+                payload = info_prefix + info_pool[int(random_value() * 512)] + "}"
+            yield SyntheticEntry(ts, f"synthetic-{trace_number:09d}-{span}", payload, log_name, resource)
+            ts += timedelta(milliseconds=1 + int(random_value() * 250))
+
+        emitted += spans
+        trace_number += 1
+        offset += rng.expovariate(1 / trace_gap) if trace_gap > 0 else 0
+
+
+class SyntheticLogSource(LogSource):
+    """Generated entries pushed through the live parse -> group stages"""
+
+    name = "synthetic"
+
+    def __init__(self, entries_per_minute=1000, services=None, error_ratio=0.2, seed=0,
+                 idle_seconds=TRACE_IDLE_SECONDS, max_open_traces=MAX_OPEN_TRACES):
+        self.entries_per_minute = entries_per_minute
+        self.services = tuple(services) if services else (DEFAULT_SERVICE_NAME,)
+        self.error_ratio = error_ratio
+        self.seed = seed
+        self.idle_seconds = idle_seconds
+        self.max_open_traces = max_open_traces
+
+    def stream_traces(self, time_range_minutes=60, severities=None, cancel_event=None, progress_callback=None):
+        entries = iter_synthetic_entries(
+            time_range_minutes,
+            entries_per_minute=self.entries_per_minute,
+            services=self.services,
+            error_ratio=self.error_ratio,
+            seed=self.seed,
+        )
+        records = iter_parsed(_tracked(entries, cancel_event, progress_callback), severities)
+        yield from group_idle_traces(records, self.idle_seconds, self.max_open_traces)
+
+
+def _tracked(entries, cancel_event, progress_callback):
+    """Cancellation and progress reporting for a generated entry stream"""
+    count = 0
+    for entry in entries:
+        if cancel_event is not None and cancel_event.is_set():
+            raise FetchCancelled("Synthetic log generation cancelled")
+        count += 1
+        if progress_callback and count % PROGRESS_INTERVAL == 0:
+            progress_callback(PROGRESS_INTERVAL)
+        yield entry
+    if progress_callback and count % PROGRESS_INTERVAL:
+        progress_callback(count % PROGRESS_INTERVAL)
+
+
+def _parse_iso(value):
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _window_start(newest, time_range_minutes):
+    """ISO lower bound `time_range_minutes` before `newest` (None if unknown)"""
+    if not newest:
+        return None
+    return (_parse_iso(newest) - timedelta(minutes=time_range_minutes)).isoformat()
+
+
+# --- Tenant selection ---
+
+# Replay options that would let a tenant read another tenant's archive
+_SERVER_SIDE_REPLAY_OPTIONS = ("project_id", "base_dir")
+
+_SOURCE_TYPES = {
+    CloudLoggingSource.name: CloudLoggingSource,
+    ReplayLogSource.name: ReplayLogSource,
+    SyntheticLogSource.name: SyntheticLogSource,
+}
+
+
+def log_source_type(config=None):
+    """Source type name for a `log_source` setting (string, dict or None)"""
+    if config is None:
+        config = DEFAULT_LOG_SOURCE
+    name = config.get("type", "cloud") if isinstance(config, dict) else str(config)
+    if name not in _SOURCE_TYPES:
+        raise ValueError(f"Unknown log source: {name}")
+    return name
+
+
+def create_log_source(config=None, credentials=None, project_id=None, **cloud_options):
+    """
+    Build the LogSource described by a tenant's `log_source` setting
+
+    Args:
+        config: "cloud" | "replay" | "synthetic", or a dict with "type" plus
+            that source's options (e.g. {"type": "replay", "speed": 10});
+            defaults to the LOG_SOURCE environment variable
+        credentials: OAuth credentials (cloud source only)
+        project_id: Tenant's GCP project (cloud and replay sources); the
+            replay source only ever reads this project's archive
+        **cloud_options: Fetch options for the cloud source (incremental, ...)
+
+    Returns:
+        LogSource instance
+
+    Raises:
+        ValueError: Unknown source, a replay setting naming its own project
+            or directory, or a replay without a tenant project
+    """
+    name = log_source_type(config)
+    options = {k: v for k, v in config.items() if k != "type"} if isinstance(config, dict) else {}
+
+    if name == CloudLoggingSource.name:
+        return CloudLoggingSource(credentials, project_id=project_id, **{**cloud_options, **options})
+    if name == ReplayLogSource.name:
+        forbidden = [key for key in _SERVER_SIDE_REPLAY_OPTIONS if key in options]
+        if forbidden:
+            raise ValueError(f"Replay option(s) not configurable: {', '.join(forbidden)}")
+        if not project_id:
+            raise ValueError("Replay needs the tenant's project_id")
+        return ReplayLogSource(project_id=project_id, **options)
+    return SyntheticLogSource(**options)
@@ -0,0 +1,568 @@
+"""
+Append-only Log Segment Store
+
+Replaces the one-pretty-printed-JSON-file-per-fetch dumps in data/ with
+gzip-compressed NDJSON segments per (project, service). Each line is one
+trace fragment with its metadata; lines are written in blocks, each block a
+separate gzip member, so a segment is still a plain .ndjson.gz file.
+
+Segments rotate by size and age, expire after a retention period, and a
+compaction job merges segments with overlapping time ranges while dropping
+the duplicate logs that overlapping fetches leave behind.
+
+Every block written is recorded in an append-only index (segment, offset,
+length, time range, trace ids). Readers memory-map segments and decompress
+only the blocks holding the requested traces or time range.
+"""
+import gzip
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict, OrderedDict
+
+STORE_DIR = os.path.join("data", "segments")
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_MAX_AGE_SECONDS = 60 * 60
+RETENTION_SECONDS = 7 * 24 * 60 * 60
+BLOCK_TARGET_BYTES = 256 * 1024  # Uncompressed bytes per gzip member
+COMPRESSION_LEVEL = 6
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.ndjson"
+MAX_OPEN_MAPS = 32
+SEVERITY_LEVELS = ("ERROR", "WARNING", "INFO", "CRITICAL")
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def summarize_trace(logs):
+    """
+    Single-pass per-trace metadata (severity counts, first/last seen)
+    
+    Args:
+        logs: Time-sorted logs of one trace (LogRecords or dicts)
+    
+    Returns:
+        Dict with log_count, severity_counts, has_errors, first_seen, last_seen
+    """
+    severity_counts = dict.fromkeys(SEVERITY_LEVELS, 0)
+    for log in logs:
+        severity = log["severity"]
+        if severity in severity_counts:
+            severity_counts[severity] += 1
+    
+    return {
+        "log_count": len(logs),
+        "severity_counts": severity_counts,
+        "has_errors": severity_counts["ERROR"] > 0 or severity_counts["CRITICAL"] > 0,
+        "first_seen": logs[0]["timestamp"] if logs else None,
+        "last_seen": logs[-1]["timestamp"] if logs else None,
+    }
+
+
+def _log_to_dict(log):
+    return log.to_dict() if hasattr(log, "to_dict") else log
+
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value or "default")
+
+
+class _SegmentWriter:
+    """Buffers encoded trace lines and writes them to the store in blocks"""
+
+    def __init__(self, store, segment=None):
+        self.store = store
+        self.segment = segment  # None: the store's active segment
+        self.lines = []
+        self.buffered = 0
+        self.min_ts = None
+        self.max_ts = None
+        self.entries = 0
+        self.trace_ids = []
+
+    def add(self, trace_id, logs):
+        if not logs:
+            return
+        line = json.dumps(
+            {"trace_id": trace_id, **summarize_trace(logs), "logs": [_log_to_dict(log) for log in logs]},
+            ensure_ascii=False, separators=(",", ":"),
+        ).encode("utf-8") + b"\n"
+        self.lines.append(line)
+        self.buffered += len(line)
+        self.entries += len(logs)
+        self.trace_ids.append(trace_id)
+        first, last = logs[0]["timestamp"], logs[-1]["timestamp"]
+        if first and (self.min_ts is None or first < self.min_ts):
+            self.min_ts = first
+        if last and (self.max_ts is None or last > self.max_ts):
+            self.max_ts = last
+        if self.buffered >= BLOCK_TARGET_BYTES:
+            self.flush()
+
+    def flush(self):
+        if not self.lines:
+            return
+        self.store._write_block(
+            b"".join(self.lines), self.trace_ids, self.entries, self.min_ts, self.max_ts, segment=self.segment,
+        )
+        self.lines = []
+        self.buffered = 0
+        self.min_ts = None
+        self.max_ts = None
+        self.entries = 0
+        self.trace_ids = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+
+class LogSegmentStore:
+    """Append-only, rotated, compressed NDJSON segments for one project/service"""
+
+    def __init__(self, project_id, service_name, base_dir=None):
+        self.project_id = project_id
+        self.service_name = service_name
+        self.directory = os.path.join(base_dir or STORE_DIR, _safe_name(project_id), _safe_name(service_name))
+        self.manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        self.index_path = os.path.join(self.directory, INDEX_NAME)
+        self._lock = threading.RLock()
+        self._maps = OrderedDict()  # file -> (file object, mmap)
+        os.makedirs(self.directory, exist_ok=True)
+        self._manifest = self._load_manifest()
+        self._reconcile_sizes()
+        self._load_index()
+
+    # --- manifest ---
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"project_id": self.project_id, "service_name": self.service_name, "sequence": 0, "segments": []}
+
+    def _reconcile_sizes(self):
+        """Trust the files over the manifest for the open segment's size (crash recovery)"""
+        for segment in self._manifest["segments"]:
+            if not segment["sealed"]:
+                path = os.path.join(self.directory, segment["file"])
+                if os.path.exists(path):
+                    segment["bytes"] = os.path.getsize(path)
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, self.manifest_path)
+
+    def segments(self):
+        """Copy of the segment metadata list (oldest first)"""
+        with self._lock:
+            return [dict(seg) for seg in self._manifest["segments"]]
+
+    # --- writing ---
+    def writer(self):
+        """Context manager that appends traces in compressed blocks"""
+        return _SegmentWriter(self)
+
+    def append(self, traces):
+        """
+        Append traces to the active segment
+        
+        Args:
+            traces: Dict of trace_id -> logs, or an iterable of (trace_id, logs)
+        
+        Returns:
+            Number of logs written
+        """
+        items = traces.items() if isinstance(traces, dict) else traces
+        written = 0
+        with self.writer() as writer:
+            for trace_id, logs in items:
+                writer.add(trace_id, logs)
+                written += len(logs)
+        return written
+
+    def _active_segment(self):
+        segments = self._manifest["segments"]
+        now = time.time()
+        active = segments[-1] if segments and not segments[-1]["sealed"] else None
+        if active and (active["bytes"] >= SEGMENT_MAX_BYTES or now - active["created"] >= SEGMENT_MAX_AGE_SECONDS):
+            active["sealed"] = True
+            active = None
+        if active is None:
+            self._manifest["sequence"] += 1
+            active = {
+                "file": f"seg-{int(now * 1000)}-{self._manifest['sequence']:06d}.ndjson.gz",
+                "created": now,
+                "sealed": False,
+                "bytes": 0,
+                "traces": 0,
+                "entries": 0,
+                "min_ts": None,
+                "max_ts": None,
+            }
+            segments.append(active)
+        return active
+
+    def _write_block(self, payload, trace_ids, entries, min_ts, max_ts, segment=None):
+        block = gzip.compress(payload, compresslevel=COMPRESSION_LEVEL)
+        with self._lock:
+            if segment is not None:
+                # Compaction output: the caller swaps it in and saves the manifest
+                self._append_block(segment, block, trace_ids, entries, min_ts, max_ts)
+                return
+            segment = self._active_segment()
+            self._append_block(segment, block, trace_ids, entries, min_ts, max_ts)
+            self._apply_retention()
+            self._save_manifest()
+
+    def _append_block(self, segment, block, trace_ids, entries, min_ts, max_ts):
+        """Append one compressed block to a segment and record it in the index"""
+        with open(os.path.join(self.directory, segment["file"]), "ab") as f:
+            # The real end of file, not the manifest's byte count: that one lags
+            # behind after a crash between the append and the manifest save
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(block)
+        segment["bytes"] = offset + len(block)
+        segment["traces"] += len(trace_ids)
+        segment["entries"] += entries
+        if min_ts and (segment["min_ts"] is None or min_ts < segment["min_ts"]):
+            segment["min_ts"] = min_ts
+        if max_ts and (segment["max_ts"] is None or max_ts > segment["max_ts"]):
+            segment["max_ts"] = max_ts
+        
+        entry = {
+            "file": segment["file"],
+            "offset": offset,
+            "length": len(block),
+            "min_ts": min_ts,
+            "max_ts": max_ts,
+            "trace_ids": trace_ids,
+        }
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._add_index_entry(entry)
+
+    def _apply_retention(self):
+        cutoff = time.time() - RETENTION_SECONDS
+        kept = []
+        expired = set()
+        for segment in self._manifest["segments"]:
+            if segment["sealed"] and segment["created"] < cutoff:
+                expired.add(segment["file"])
+                print(f"🧹 Expired log segment: {segment['file']}")
+            else:
+                kept.append(segment)
+        self._manifest["segments"] = kept
+        if expired:
+            self._drop_from_index(expired)
+            for name in expired:
+                self._remove_file(name)
+
+    def _remove_file(self, name):
+        cached = self._maps.pop(name, None)
+        if cached:
+            cached[1].close()
+            cached[0].close()
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    # --- index ---
+    def _load_index(self):
+        self._blocks = []
+        self._trace_blocks = defaultdict(list)  # trace_id -> [block position]
+        if not os.path.exists(self.index_path):
+            if self._manifest["segments"]:
+                self._rebuild_index()
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._add_index_entry(json.loads(line))
+
+    def _add_index_entry(self, entry):
+        position = len(self._blocks)
+        self._blocks.append(entry)
+        for trace_id in entry["trace_ids"]:
+            blocks = self._trace_blocks[trace_id]
+            if not blocks or blocks[-1] != position:
+                blocks.append(position)
+
+    def _write_index(self, entries):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.index_path)
+        self._blocks = []
+        self._trace_blocks = defaultdict(list)
+        for entry in entries:
+            self._add_index_entry(entry)
+
+    def _drop_from_index(self, files):
+        self._write_index([entry for entry in self._blocks if entry["file"] not in files])
+
+    def _rebuild_index(self):
+        """Index segments written before the index existed by walking their gzip members"""
+        entries = []
+        for segment in self._manifest["segments"]:
+            with open(os.path.join(self.directory, segment["file"]), "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                decompressor = zlib.decompressobj(wbits=31)
+                payload = decompressor.decompress(data[offset:])
+                length = len(data) - offset - len(decompressor.unused_data)
+                traces = [json.loads(line) for line in payload.splitlines() if line.strip()]
+                entries.append({
+                    "file": segment["file"],
+                    "offset": offset,
+                    "length": length,
+                    "min_ts": min((t["first_seen"] for t in traces if t["first_seen"]), default=None),
+                    "max_ts": max((t["last_seen"] for t in traces if t["last_seen"]), default=None),
+                    "trace_ids": [t["trace_id"] for t in traces],
+                })
+                offset += length
+        self._write_index(entries)
+        print(f"🗂️ Rebuilt segment index for {self.directory} ({len(entries)} blocks)")
+
+    # --- reading ---
+    def _read_block(self, entry):
+        """Memory-map the segment and decompress a single block"""
+        end = entry["offset"] + entry["length"]
+        with self._lock:
+            cached = self._maps.get(entry["file"])
+            if cached is None or len(cached[1]) < end:
+                if cached:
+                    cached[1].close()
+                    cached[0].close()
+                f = open(os.path.join(self.directory, entry["file"]), "rb")
+                cached = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                self._maps[entry["file"]] = cached
+                while len(self._maps) > MAX_OPEN_MAPS:
+                    _, (old_file, old_map) = self._maps.popitem(last=False)
+                    old_map.close()
+                    old_file.close()
+            self._maps.move_to_end(entry["file"])
+            block = cached[1][entry["offset"]:end]
+        return gzip.decompress(block)
+
+    def _iter_block(self, entry, trace_id=None):
+        payload = self._read_block(entry)
+        # Lines start with the trace_id key, so other traces are skipped undecoded
+        prefix = None
+        if trace_id is not None:
+            prefix = b'{"trace_id":' + json.dumps(trace_id).encode("utf-8") + b","
+        for line in payload.splitlines():
+            if not line.strip():
+                continue
+            if prefix is not None and not line.startswith(prefix):
+                continue
+            yield json.loads(line)
+
+    def has_trace(self, trace_id):
+        return trace_id in self._trace_blocks
+
+    def read_trace(self, trace_id):
+        """
+        Fetch one trace's logs, decoding only the blocks that contain it
+        
+        Returns:
+            Time-sorted list of log dicts (empty if the trace is unknown)
+        """
+        with self._lock:
+            entries = [self._blocks[position] for position in self._trace_blocks.get(trace_id, ())]
+        logs = []
+        for entry in entries:
+            for trace in self._iter_block(entry, trace_id):
+                logs.extend(trace["logs"])
+        logs.sort(key=lambda log: log.get("timestamp") or "")
+        return logs
+
+    def time_range(self):
+        """(oldest, newest) ISO timestamps across stored blocks, or (None, None)"""
+        with self._lock:
+            mins = [entry["min_ts"] for entry in self._blocks if entry["min_ts"]]
+            maxes = [entry["max_ts"] for entry in self._blocks if entry["max_ts"]]
+        return (min(mins) if mins else None, max(maxes) if maxes else None)
+
+    def iter_traces(self, since=None, until=None):
+        """
+        Yield stored trace fragments overlapping [since, until]
+        
+        Only blocks whose time range overlaps the bounds are decompressed.
+        
+        Args:
+            since: ISO timestamp lower bound (optional)
+            until: ISO timestamp upper bound (optional)
+        
+        Yields:
+            Trace dicts: trace_id, metadata and "logs"
+        """
+        with self._lock:
+            entries = list(self._blocks)
+        for entry in entries:
+            if since and entry["max_ts"] and entry["max_ts"] < since:
+                continue
+            if until and entry["min_ts"] and entry["min_ts"] > until:
+                continue
+            for trace in self._iter_block(entry):
+                if since and trace["last_seen"] and trace["last_seen"] < since:
+                    continue
+                if until and trace["first_seen"] and trace["first_seen"] > until:
+                    continue
+                yield trace
+
+    # --- compaction ---
+    def compact(self):
+        """
+        Merge sealed segments with overlapping time ranges, dropping duplicate logs
+        
+        Logs are duplicates when trace_id, timestamp, severity and message all
+        match. Each overlapping run of segments is rewritten as one segment.
+        
+        Returns:
+            Number of duplicate logs removed
+        """
+        with self._lock:
+            sealed = [s for s in self._manifest["segments"] if s["sealed"] and s["min_ts"]]
+            sealed.sort(key=lambda s: s["min_ts"])
+            
+            # Group sealed segments into runs of overlapping [min_ts, max_ts]
+            runs = []
+            run_max = None
+            for segment in sealed:
+                if runs and segment["min_ts"] <= run_max:
+                    runs[-1].append(segment)
+                    run_max = max(run_max, segment["max_ts"])
+                else:
+                    runs.append([segment])
+                    run_max = segment["max_ts"]
+            
+            removed = 0
+            for run in runs:
+                if len(run) < 2:
+                    continue
+                removed += self._compact_run(run)
+            
+            if removed:
+                self._save_manifest()
+            return removed
+
+    def _compact_run(self, run):
+        run_files = {s["file"] for s in run}
+        traces = defaultdict(list)
+        seen = set()
+        total = 0
+        for entry in [e for e in self._blocks if e["file"] in run_files]:
+            for trace in self._iter_block(entry):
+                for log in trace["logs"]:
+                    total += 1
+                    key = (trace["trace_id"], log.get("timestamp"), log.get("severity"), log.get("message"))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    traces[trace["trace_id"]].append(log)
+        
+        for logs in traces.values():
+            logs.sort(key=lambda log: log.get("timestamp") or "")
+        
+        # Write the merged segment, then swap it in for the run
+        self._manifest["sequence"] += 1
+        merged = {
+            "file": f"seg-{int(time.time() * 1000)}-{self._manifest['sequence']:06d}.ndjson.gz",
+            "created": min(s["created"] for s in run),
+            "sealed": True,
+            "bytes": 0,
+            "traces": 0,
+            "entries": 0,
+            "min_ts": None,
+            "max_ts": None,
+        }
+        with _SegmentWriter(self, segment=merged) as writer:
+            for trace_id, logs in traces.items():
+                writer.add(trace_id, logs)
+        
+        segments = [s for s in self._manifest["segments"] if s["file"] not in run_files]
+        segments.append(merged)
+        segments.sort(key=lambda s: (s["sealed"] is False, s["min_ts"] or ""))
+        self._manifest["segments"] = segments
+        self._drop_from_index(run_files)
+        for name in run_files:
+            self._remove_file(name)
+        
+        duplicates = total - merged["entries"]
+        print(f"🗜️ Compacted {len(run)} segments into {merged['file']} ({duplicates} duplicate logs dropped)")
+        return duplicates
+
+
+def _store_key(project_id, service_name, base_dir=None):
+    # Keyed by directory: names that sanitize alike share one store (and lock)
+    return os.path.normpath(os.path.join(base_dir or STORE_DIR, _safe_name(project_id), _safe_name(service_name)))
+
+
+def get_store(project_id, service_name, base_dir=None):
+    """Return the process-wide store for a project/service"""
+    key = _store_key(project_id, service_name, base_dir)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = LogSegmentStore(project_id, service_name, base_dir=base_dir)
+            _STORES[key] = store
+        return store
+
+
+def _iter_stores(base_dir=None):
+    root = base_dir or STORE_DIR
+    if not os.path.isdir(root):
+        return
+    for project in sorted(os.listdir(root)):
+        project_dir = os.path.join(root, project)
+        if not os.path.isdir(project_dir):
+            continue
+        for service in sorted(os.listdir(project_dir)):
+            manifest_path = os.path.join(project_dir, service, MANIFEST_NAME)
+            if not os.path.exists(manifest_path):
+                continue
+            # Directory names are sanitized; the manifest has the real ones
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            yield get_store(manifest.get("project_id") or project, manifest.get("service_name") or service,
+                            base_dir=base_dir)
+
+
+def find_trace(trace_id, base_dir=None):
+    """
+    Look a trace up in every stored project/service via the in-memory indexes
+    
+    Returns:
+        Time-sorted list of log dicts (empty if no store holds the trace)
+    """
+    for store in _iter_stores(base_dir):
+        if store.has_trace(trace_id):
+            return store.read_trace(trace_id)
+    return []
+
+
+def compact_all(base_dir=None):
+    """Compaction job: compact every project/service store under base_dir"""
+    return sum(store.compact() for store in _iter_stores(base_dir))
+
+
+if __name__ == "__main__":
+    # Run the compaction job over every stored project/service
+    dropped = compact_all()
+    print(f"✅ Compaction finished: {dropped} duplicate logs removed")
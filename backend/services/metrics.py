@@ -0,0 +1,100 @@
+"""
+In-process performance metrics
+
+A tiny registry of counters and fixed-bucket histograms that the services
+record into (client pools, caches, LLM transport...). The /metrics route
+returns snapshot() so hit rates and latencies can be checked on a live
+instance without extra infrastructure.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+# Upper bounds for latency histograms, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_LOCK = threading.Lock()
+_COUNTERS = defaultdict(int)
+_HISTOGRAMS = {}
+_GAUGES = {}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket holding it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(bound): bucket_count
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), self.counts)
+            },
+        }
+
+
+def incr(name, value=1):
+    """Increase a counter"""
+    with _LOCK:
+        _COUNTERS[name] += value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS):
+    """Record a value (e.g. a latency in seconds) in a histogram"""
+    with _LOCK:
+        histogram = _HISTOGRAMS.get(name)
+        if histogram is None:
+            histogram = _HISTOGRAMS[name] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def register_gauge(name, fn):
+    """Register a callable evaluated at snapshot time (e.g. a pool size)"""
+    with _LOCK:
+        _GAUGES[name] = fn
+
+
+def snapshot():
+    """Current counters, histograms and gauges as plain dicts"""
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        histograms = {name: h.to_dict() for name, h in _HISTOGRAMS.items()}
+        gauges = dict(_GAUGES)
+    values = {}
+    for name, fn in gauges.items():
+        try:
+            values[name] = fn()
+        except Exception as e:
+            values[name] = f"error: {e}"
+    return {"counters": counters, "histograms": histograms, "gauges": values}
+
+
+def reset():
+    """Clear counters and histograms (gauges stay registered)"""
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
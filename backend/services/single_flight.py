@@ -0,0 +1,67 @@
+"""
+Single-Flight Request Coalescing
+
+Concurrent callers asking for the same key share one in-flight coroutine
+instead of each running it: the first caller starts the work, later
+callers await the same task, and the key is released once it finishes.
+
+The shared task is shielded, so one caller being cancelled (e.g. a client
+disconnecting) does not cancel the work the others are waiting for.
+Hits (joined an in-flight call) and misses (started one) are counted in
+/metrics under the group's name.
+"""
+import asyncio
+
+from services import metrics
+
+
+class SingleFlight:
+    """Coalesces concurrent calls per key within one event loop"""
+
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}  # key -> asyncio.Task
+        metrics.register_gauge(f"{name}.in_flight", lambda: len(self._inflight))
+
+    def start(self, key, fn):
+        """
+        Start fn() unless a call for key is already in flight (no await)
+
+        Args:
+            key: Hashable identity of the call
+            fn: Zero-argument coroutine function doing the work
+
+        Returns:
+            The shared asyncio.Task
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr(f"{self.name}.hits")
+        else:
+            metrics.incr(f"{self.name}.misses")
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+        return task
+
+    async def do(self, key, fn):
+        """
+        Await fn() once per key among concurrent callers
+
+        Args:
+            key: Hashable identity of the call
+            fn: Zero-argument coroutine function doing the work
+
+        Returns:
+            fn()'s result (the same object for every coalesced caller)
+        """
+        return await asyncio.shield(self.start(key, fn))
+
+    def _release(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved even if every caller went away
+
+    def in_flight(self, key):
+        return key in self._inflight
@@ -0,0 +1,247 @@
+"""
+Incremental Log Template Miner
+
+Drain-style parse tree that turns error messages into templates, so
+"Connection to db-3 timed out after 5012ms" and "Connection to db-7 timed
+out after 88ms" land in one group instead of two.
+
+Messages are first masked (UUIDs, IPs, hex ids, numbers), then routed
+through a fixed-depth tree keyed by token count and leading tokens to a
+small list of candidate clusters. The most similar cluster above the
+threshold absorbs the message, turning differing positions into <*>;
+otherwise a new cluster is created.
+
+Every cluster gets a fingerprint at creation that never changes as its
+template generalizes, and the clusters are persisted to disk, so the same
+error keeps the same fingerprint across runs and restarts.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+STATE_PATH = os.getenv("TEMPLATE_MINER_STATE", os.path.join("data", "template_miner.json"))
+STATE_VERSION = 1
+
+TREE_DEPTH = 4  # Root + length layer + (TREE_DEPTH - 2) leading-token layers
+SIMILARITY_THRESHOLD = 0.4
+MAX_CHILDREN = 100
+MESSAGE_CACHE_LIMIT = 100000
+
+WILDCARD = "<*>"
+
+# Applied in order: a UUID or IP must be masked before its digit runs are.
+# Each mask only runs when its required character is in the message.
+_MASKS = (
+    ("-", re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<UUID>"),
+    (".", re.compile(r"(?<![\w.])\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?(?![\w.])"), "<IP>"),
+    ("", re.compile(r"\b0[xX][0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b"), "<HEX>"),
+    ("", re.compile(r"(?<![A-Za-z0-9<])[-+]?\d+(?:\.\d+)?"), "<NUM>"),
+)
+_HAS_DIGIT = re.compile(r"\d")
+
+
+def mask_message(message):
+    """Replace the variable parts of a message with typed placeholders"""
+    if _HAS_DIGIT.search(message) is None:
+        return message
+    for required, pattern, placeholder in _MASKS:
+        if required in message:
+            message = pattern.sub(placeholder, message)
+    return message
+
+
+def _fingerprint(tokens):
+    return hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()[:16]
+
+
+def _is_variable(token):
+    """Placeholders and leftover digit-bearing tokens never become tree keys"""
+    return "<" in token or _HAS_DIGIT.search(token) is not None
+
+
+class TemplateCluster:
+    """One mined template; cluster_id is the stable fingerprint"""
+
+    __slots__ = ("cluster_id", "tokens", "size")
+
+    def __init__(self, cluster_id, tokens, size=0):
+        self.cluster_id = cluster_id
+        self.tokens = tokens
+        self.size = size
+
+    @property
+    def template(self):
+        return " ".join(self.tokens)
+
+    def __repr__(self):
+        return f"TemplateCluster({self.cluster_id!r}, {self.template!r}, size={self.size})"
+
+
+class TemplateMiner:
+    """Thread-safe Drain-style miner with on-disk state"""
+
+    def __init__(self, state_path=STATE_PATH, depth=TREE_DEPTH, similarity_threshold=SIMILARITY_THRESHOLD,
+                 max_children=MAX_CHILDREN):
+        self.state_path = state_path
+        self.depth = depth
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self._lock = threading.RLock()
+        self._root = {}  # token count -> nested token dicts -> [clusters]
+        self._clusters = {}  # cluster_id -> TemplateCluster
+        self._message_cache = {}  # raw message -> cluster
+        self._dirty = False
+        if state_path and os.path.exists(state_path):
+            self.load()
+
+    # --- mining ---
+    def add_message(self, message):
+        """
+        Assign a message to its template cluster, learning as needed
+
+        Returns:
+            The TemplateCluster (its cluster_id is the fingerprint)
+        """
+        message = message or ""
+        cluster = self._message_cache.get(message)
+        if cluster is not None:
+            cluster.size += 1
+            self._dirty = True
+            return cluster
+
+        tokens = mask_message(message).split()
+        with self._lock:
+            leaf = self._leaf(tokens, create=True)
+            cluster = self._best_match(leaf, tokens)
+            if cluster is None:
+                cluster = TemplateCluster(_fingerprint(tokens), tokens)
+                # A generalized template can collide with a new one's fingerprint
+                while cluster.cluster_id in self._clusters:
+                    cluster.cluster_id = _fingerprint([cluster.cluster_id, *tokens])
+                self._clusters[cluster.cluster_id] = cluster
+                leaf.append(cluster)
+            elif cluster.tokens != tokens:
+                cluster.tokens = [a if a == b else WILDCARD for a, b in zip(cluster.tokens, tokens)]
+            cluster.size += 1
+            self._dirty = True
+
+            if len(self._message_cache) >= MESSAGE_CACHE_LIMIT:
+                self._message_cache.clear()
+            self._message_cache[message] = cluster
+        return cluster
+
+    def match(self, message):
+        """Find the cluster for a message without learning (None if unknown)"""
+        tokens = mask_message(message or "").split()
+        with self._lock:
+            leaf = self._leaf(tokens, create=False)
+            return self._best_match(leaf, tokens) if leaf else None
+
+    def _leaf(self, tokens, create):
+        node = self._root.get(len(tokens))
+        if node is None:
+            if not create:
+                return None
+            node = self._root[len(tokens)] = {}
+
+        prefix_layers = min(self.depth - 2, len(tokens))
+        for depth, token in enumerate(tokens[:prefix_layers]):
+            last = depth == prefix_layers - 1
+            key = WILDCARD if _is_variable(token) else token
+            child = node.get(key)
+            if child is None:
+                if key != WILDCARD and len(node) >= self.max_children:
+                    key = WILDCARD
+                    child = node.get(key)
+                if child is None:
+                    if not create:
+                        return None
+                    child = node[key] = [] if last else {}
+            node = child
+
+        if prefix_layers == 0:
+            # Empty message: the length node holds the clusters directly
+            return node.setdefault("", []) if create else node.get("")
+        return node
+
+    def _best_match(self, clusters, tokens):
+        best, best_score = None, (-1.0, -1)
+        for cluster in clusters:
+            same = wildcards = 0
+            for a, b in zip(cluster.tokens, tokens):
+                if a == WILDCARD:
+                    wildcards += 1
+                elif a == b:
+                    same += 1
+            similarity = same / len(tokens) if tokens else 1.0
+            score = (similarity, wildcards)
+            if similarity >= self.similarity_threshold and score > best_score:
+                best, best_score = cluster, score
+        return best
+
+    def clusters(self):
+        """Snapshot of all clusters, largest first"""
+        with self._lock:
+            return sorted(self._clusters.values(), key=lambda c: c.size, reverse=True)
+
+    def get(self, cluster_id):
+        return self._clusters.get(cluster_id)
+
+    # --- persistence ---
+    def save(self, force=False):
+        """Write the clusters to state_path if anything changed (atomic replace)"""
+        if not self.state_path:
+            return
+        with self._lock:
+            if not (self._dirty or force):
+                return
+            state = {
+                "version": STATE_VERSION,
+                "depth": self.depth,
+                "similarity_threshold": self.similarity_threshold,
+                "clusters": [
+                    {"id": c.cluster_id, "template": c.tokens, "size": c.size}
+                    for c in self._clusters.values()
+                ],
+            }
+            self._dirty = False
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.state_path)
+
+    def load(self):
+        """Rebuild the tree from state_path (clusters keep their fingerprints)"""
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != STATE_VERSION:
+            print(f"⚠️ Ignoring template miner state with version {state.get('version')}")
+            return
+        with self._lock:
+            self._root.clear()
+            self._clusters.clear()
+            self._message_cache.clear()
+            for item in state["clusters"]:
+                cluster = TemplateCluster(item["id"], item["template"], item.get("size", 0))
+                self._clusters[cluster.cluster_id] = cluster
+                self._leaf(cluster.tokens, create=True).append(cluster)
+            self._dirty = False
+        print(f"🧩 Loaded {len(self._clusters)} log templates from {self.state_path}")
+
+
+_MINER = None
+_MINER_LOCK = threading.Lock()
+
+
+def get_template_miner():
+    """Return the process-wide miner (state loaded from STATE_PATH on first use)"""
+    global _MINER
+    with _MINER_LOCK:
+        if _MINER is None:
+            _MINER = TemplateMiner()
+        return _MINER
@@ -0,0 +1,38 @@
+import os
+import sys
+import asyncio
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import agent
+
+
+def test_request_between_run_end_and_key_release(monkeypatch):
+    """A request landing after the run finished but before its flight key is released joins it"""
+    late = {}
+    
+    async def fake_run_analysis(time_range_minutes, max_traces, user_id, log_source, feed=None):
+        # Runs after this coroutine (and run()'s finally) but before the
+        # task's done-callbacks, i.e. while the key is still in flight
+        loop = asyncio.get_running_loop()
+        loop.call_soon(lambda: late.setdefault("joined", agent.start_analysis(user_id=user_id)))
+        return {"results": [{"group_id": 1}]}
+    
+    monkeypatch.setattr(agent, "_run_analysis", fake_run_analysis)
+    
+    async def scenario():
+        task, feed = agent.start_analysis(user_id="flight_user")
+        final = await task
+        await asyncio.sleep(0)  # Let the late request and the key release run
+        
+        late_task, late_feed = late["joined"]
+        assert late_task is task and late_feed is feed
+        assert late_feed.final is final
+        
+        # Once released, the next request starts a fresh run
+        next_task, next_feed = agent.start_analysis(user_id="flight_user")
+        assert next_task is not task and next_feed is not feed
+        await next_task
+    
+    asyncio.run(scenario())
@@ -0,0 +1,133 @@
+"""
+Benchmark single-iterator vs sharded fetch_logs, and client-side vs pushed-down
+severity filtering, against a local stand-in logging client. The stand-in
+serves synthetic cloud-rca entries, applies timestamp and textPayload
+predicates like the Logging API, and sleeps per page to mimic round trips,
+so no GCP access is needed.
+
+Usage:
+    python utils/benchmark_log_fetch.py --entries 200000 --minutes 1440
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.log_collector import fetch_logs
+from services.log_sources import SyntheticEntry, SyntheticResource
+
+_TS_GE = re.compile(r'timestamp >= "([^"]+)"')
+_TS_LT = re.compile(r'timestamp < "([^"]+)"')
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+class StandInLoggingClient:
+    """Serves pre-generated entries for a filter, newest first, page by page"""
+
+    def __init__(self, entries, page_size=1000, page_latency=0.05):
+        self.entries = sorted(entries, key=lambda e: e.timestamp)
+        self.timestamps = [e.timestamp for e in self.entries]
+        self.page_size = page_size
+        self.page_latency = page_latency
+
+    @staticmethod
+    def _parse(value):
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def _text_clauses(filter_):
+        """Each textPayload clause line is an OR of substrings; lines are AND'd"""
+        return [
+            [re.sub(r'\\(.)', r'\1', term) for term in _QUOTED.findall(line)]
+            for line in (filter_ or "").splitlines() if "textPayload:" in line
+        ]
+
+    def list_entries(self, filter_=None, order_by=None, page_size=None, **kwargs):
+        lower = _TS_GE.search(filter_ or "")
+        upper = _TS_LT.search(filter_ or "")
+        lo = bisect_left(self.timestamps, self._parse(lower.group(1))) if lower else 0
+        hi = bisect_left(self.timestamps, self._parse(upper.group(1))) if upper else len(self.entries)
+        clauses = self._text_clauses(filter_)
+        selected = [
+            entry for entry in self.entries[lo:hi]
+            if all(any(term in entry.payload for term in clause) for clause in clauses)
+        ]
+        page = page_size or self.page_size
+        for i in range(len(selected) - 1, -1, -1):
+            if (len(selected) - 1 - i) % page == 0:
+                time.sleep(self.page_latency)
+            yield selected[i]
+
+
+def make_entries(count, minutes, service="cloud-rca-service", traces=5000):
+    """Generate `count` synthetic entries evenly spread over the last `minutes`"""
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(minutes=minutes)
+    step = (now - start) / max(count, 1)
+    resource = SyntheticResource(service)
+    levels = ("INFO", "INFO", "WARNING", "ERROR")
+    entries = []
+    for i in range(count):
+        body = json.dumps({
+            "trace_id": f"trace-{i % traces:06d}",
+            "message": f"request {i} failed after {i % 997}ms",
+            "service": service,
+        })
+        entries.append(SyntheticEntry(
+            start + step * i,
+            f"insert-{i:09d}",
+            f"{levels[i % len(levels)]}:cloud-rca:{body}",
+            "projects/demo/logs/run.googleapis.com%2Fstdout",
+            resource,
+        ))
+    return entries
+
+
+def _timed_fetch(client, minutes, shards, **kwargs):
+    started = time.perf_counter()
+    traces = fetch_logs(None, time_range_minutes=minutes, save_to_file=False, shards=shards, client=client, **kwargs)
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(len(logs) for logs in traces.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--minutes", type=int, default=1440)
+    parser.add_argument("--page-latency", type=float, default=0.05, help="Seconds slept per 1000-entry page")
+    parser.add_argument("--shards", default="auto", help='Shard count for the sharded run, or "auto"')
+    args = parser.parse_args()
+
+    client = StandInLoggingClient(make_entries(args.entries, args.minutes), page_latency=args.page_latency)
+    shards = args.shards if args.shards == "auto" else int(args.shards)
+
+    baseline, baseline_logs = _timed_fetch(client, args.minutes, 1)
+    sharded, sharded_logs = _timed_fetch(client, args.minutes, shards)
+
+    print("\n" + "=" * 60)
+    print(f"Entries: {args.entries:,} over {args.minutes} min (page latency {args.page_latency * 1000:.0f}ms)")
+    print(f"Single iterator : {baseline:8.2f}s ({baseline_logs:,} logs)")
+    print(f"Sharded ({args.shards:>4}) : {sharded:8.2f}s ({sharded_logs:,} logs)")
+    print(f"Speedup         : {baseline / sharded:8.2f}x")
+
+    errors = ("ERROR", "CRITICAL")
+    started = time.perf_counter()
+    everything = fetch_logs(None, time_range_minutes=args.minutes, save_to_file=False, client=client)
+    client_side = sum(1 for logs in everything.values() for log in logs if log["severity"] in errors)
+    client_side_time = time.perf_counter() - started
+    pushed, pushed_logs = _timed_fetch(client, args.minutes, 1, severities=errors)
+
+    print(f"ERROR filter, client-side : {client_side_time:8.2f}s ({client_side:,} logs)")
+    print(f"ERROR filter, pushed down : {pushed:8.2f}s ({pushed_logs:,} logs)")
+    print(f"Speedup                   : {client_side_time / pushed:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
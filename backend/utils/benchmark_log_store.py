@@ -0,0 +1,109 @@
+"""
+Compare disk use and write time of the legacy pretty-printed JSON dump
+against the compressed log segment store, time a single indexed trace read
+against loading the whole legacy file, and show compaction removing the
+duplicates left by overlapping fetches.
+
+Usage:
+    python utils/benchmark_log_store.py --entries 200000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.log_collector import parse_entries
+from services.log_store import LogSegmentStore
+from utils.benchmark_log_fetch import make_entries
+
+
+def legacy_save(traces, path):
+    """The original save_logs_to_json body: four severity passes + indent=2"""
+    traces_with_metadata = {}
+    for trace_id, logs in traces.items():
+        severity_counts = {
+            level: sum(1 for log in logs if log["severity"] == level)
+            for level in ("ERROR", "WARNING", "INFO", "CRITICAL")
+        }
+        traces_with_metadata[trace_id] = {
+            "log_count": len(logs),
+            "severity_counts": severity_counts,
+            "has_errors": severity_counts["ERROR"] > 0 or severity_counts["CRITICAL"] > 0,
+            "first_seen": logs[0]["timestamp"] if logs else None,
+            "last_seen": logs[-1]["timestamp"] if logs else None,
+            "logs": [log.to_dict() for log in logs],
+        }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traces": traces_with_metadata}, f, indent=2, ensure_ascii=False)
+
+
+def _group(records):
+    traces = {}
+    for record in records:
+        traces.setdefault(record.trace_id, []).append(record)
+    return traces
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    args = parser.parse_args()
+
+    traces = _group(parse_entries(make_entries(args.entries, 60)))
+    workdir = tempfile.mkdtemp(prefix="log-store-bench-")
+    try:
+        legacy_path = os.path.join(workdir, "legacy.json")
+        started = time.perf_counter()
+        legacy_save(traces, legacy_path)
+        legacy_time = time.perf_counter() - started
+        legacy_bytes = os.path.getsize(legacy_path)
+
+        store_dir = os.path.join(workdir, "segments")
+        store = LogSegmentStore("bench-project", "bench-service", base_dir=store_dir)
+        started = time.perf_counter()
+        store.append(traces)
+        store_time = time.perf_counter() - started
+        store_bytes = _dir_size(store_dir)
+
+        print("=" * 60)
+        print(f"Entries: {args.entries:,} in {len(traces):,} traces")
+        print(f"Legacy JSON   : {legacy_bytes / 1e6:8.2f} MB in {legacy_time:6.2f}s")
+        print(f"Segment store : {store_bytes / 1e6:8.2f} MB in {store_time:6.2f}s")
+        print(f"Disk ratio    : {legacy_bytes / store_bytes:8.1f}x smaller")
+        print(f"Write speedup : {legacy_time / store_time:8.1f}x")
+
+        # Single-trace lookup: whole-file json.load vs indexed block read
+        trace_id = next(iter(traces))
+        started = time.perf_counter()
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            json.load(f)["traces"][trace_id]
+        legacy_read = time.perf_counter() - started
+        started = time.perf_counter()
+        store.read_trace(trace_id)
+        store_read = time.perf_counter() - started
+        print(f"Trace lookup  : {legacy_read * 1000:8.1f}ms (json.load) vs {store_read * 1000:.2f}ms (index)")
+
+        # Overlapping fetch: append the same window again, seal, compact
+        for segment in store._manifest["segments"]:
+            segment["sealed"] = True
+        store.append(traces)
+        for segment in store._manifest["segments"]:
+            segment["sealed"] = True
+        dropped = store.compact()
+        print(f"Compaction    : {dropped:,} duplicate logs dropped, {_dir_size(store_dir) / 1e6:.2f} MB on disk")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
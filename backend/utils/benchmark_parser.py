@@ -0,0 +1,136 @@
+"""
+Micro-benchmark for the cloud-rca log parser. Runs synthetic
+ERROR:cloud-rca:{...} payloads (mixed with INFO lines and non-cloud-rca
+noise) through the legacy per-entry parser and the batch parse_entries fast
+paths, and reports entries/sec for each. With --memory it also reports the
+retained bytes per parsed entry for legacy dicts vs LogRecord objects.
+
+Usage:
+    python utils/benchmark_parser.py --entries 200000
+    python utils/benchmark_parser.py --entries 200000 --memory
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import log_collector
+from services.log_collector import parse_entries
+from utils.benchmark_log_fetch import make_entries
+
+
+def legacy_parse_log_entry(entry):
+    """The original parser: uncompiled greedy search + json.loads on every line"""
+    payload = entry.payload
+    if not isinstance(payload, str):
+        return None
+    match = re.search(r'(ERROR|WARNING|INFO|CRITICAL):cloud-rca:(\{.+\})', payload)
+    if not match:
+        return None
+    try:
+        log_data = json.loads(match.group(2))
+    except json.JSONDecodeError:
+        return None
+    trace_id = log_data.get("trace_id")
+    if not trace_id:
+        return None
+    return {
+        "trace_id": trace_id,
+        "message": log_data.get("message"),
+        "service": log_data.get("service"),
+        "root_cause": log_data.get("root_cause"),
+        "suggestion": log_data.get("suggestion"),
+        "timestamp": entry.timestamp.isoformat() if entry.timestamp else None,
+        "severity": match.group(1),
+        "log_name": entry.log_name,
+        "resource_labels": dict(entry.resource.labels) if entry.resource else {},
+    }
+
+
+def _with_noise(entries, every):
+    """Replace every Nth payload with a plain (non cloud-rca) stdout line"""
+    for i, entry in enumerate(entries):
+        if i % every == 0:
+            entry.payload = f"GET /healthz 200 {i}ms"
+    return entries
+
+
+def _measure(label, fn, entries, repeat):
+    best = float("inf")
+    kept = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        kept = len(fn(entries))
+        best = min(best, time.perf_counter() - started)
+    rate = len(entries) / best
+    print(f"{label:<34} {rate:>12,.0f} entries/s  ({kept:,} kept)")
+    return rate
+
+
+def _retained_bytes(fn, entries):
+    """Bytes still allocated after parsing, i.e. the cost of keeping the records"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = fn(entries)
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, len(records)
+
+
+def report_memory(entries):
+    print("=" * 72)
+    for label, fn in (
+        ("legacy dict records", lambda items: [p for p in map(legacy_parse_log_entry, items) if p]),
+        ("LogRecord (__slots__)", lambda items: parse_entries(items, fast_json=False)),
+    ):
+        retained, count = _retained_bytes(fn, entries)
+        print(f"{label:<34} {retained / max(count, 1):>10,.0f} bytes/entry  ({count:,} records)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--noise-every", type=int, default=4, help="Every Nth line is non cloud-rca noise")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true", help="Also report retained bytes per entry")
+    args = parser.parse_args()
+
+    entries = _with_noise(make_entries(args.entries, 60), args.noise_every)
+    warn_plus = ("WARNING", "ERROR", "CRITICAL")
+
+    print("=" * 72)
+    baseline = _measure(
+        "legacy parse_log_entry",
+        lambda items: [p for p in map(legacy_parse_log_entry, items) if p],
+        entries, args.repeat,
+    )
+    results = {
+        "parse_entries (json)": _measure(
+            "parse_entries (json)", lambda items: parse_entries(items, fast_json=False), entries, args.repeat),
+        "parse_entries (json, WARN+)": _measure(
+            "parse_entries (json, WARN+)",
+            lambda items: parse_entries(items, severities=warn_plus, fast_json=False), entries, args.repeat),
+    }
+    if log_collector._fast_json_loads:
+        results["parse_entries (orjson, WARN+)"] = _measure(
+            "parse_entries (orjson, WARN+)",
+            lambda items: parse_entries(items, severities=warn_plus), entries, args.repeat)
+    else:
+        print("(orjson not installed - skipping fast JSON decoder run)")
+
+    print("-" * 72)
+    for label, rate in results.items():
+        print(f"{label:<34} {rate / baseline:>8.2f}x vs legacy")
+
+    if args.memory:
+        report_memory(entries)
+
+
+if __name__ == "__main__":
+    main()
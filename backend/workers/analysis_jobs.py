@@ -0,0 +1,297 @@
+"""
+Background Analysis Jobs
+
+/analyze/start queues a job and returns its task_id right away; a bounded
+pool of asyncio workers runs the jobs, so slow analyses no longer hold an
+HTTP connection open until a proxy times them out.
+
+Scheduling: the highest priority waiting job runs first; among equal
+priorities, tenants take turns (the tenant served least recently goes
+next) and a tenant never has more than MAX_RUNNING_PER_TENANT jobs running.
+
+Jobs report the stage of the underlying run (fetch / group / llm / persist)
+with a progress estimate and the results published so far, and can be
+cancelled while queued or running. A running job shares its analysis run
+with identical concurrent requests (see core.agent.start_analysis); the run
+itself is only cancelled once nobody else is waiting on it.
+"""
+import asyncio
+import itertools
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict
+
+# Add root directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agent import start_analysis, wait_for_persistence
+from services import metrics
+
+WORKER_COUNT = int(os.getenv("ANALYSIS_WORKERS", "2"))
+MAX_RUNNING_PER_TENANT = 1
+MAX_QUEUED_JOBS = 100
+MAX_QUEUED_PER_TENANT = 10
+PERSIST_TIMEOUT_SECONDS = 60
+JOB_HISTORY = 500
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be queued (global or per-tenant limit)"""
+
+
+class AnalysisJob:
+    """One queued/running/finished analysis request"""
+
+    def __init__(self, user_id, params, priority, seq):
+        self.task_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.params = params
+        self.priority = priority
+        self.seq = seq
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.feed = None  # AnalysisFeed of the run, once started
+        self._task = None
+
+    def to_dict(self, include_results=True):
+        stage, progress, detail = self.stage, self.progress, {}
+        if self.status == RUNNING and self.feed is not None and stage != "persist":
+            stage, progress, detail = self.feed.stage, self.feed.progress, self.feed.detail
+        info = {
+            "task_id": self.task_id,
+            "status": self.status,
+            "stage": stage,
+            "progress": progress,
+            "detail": detail,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            info["error"] = self.error
+        if include_results:
+            if self.result is not None:
+                info.update({k: v for k, v in self.result.items() if k != "error"})
+            elif self.feed is not None:
+                info["results"] = list(self.feed.results)  # Partial, as they arrive
+        return info
+
+
+class AnalysisJobManager:
+    """Priority + per-tenant fair scheduler over a fixed pool of asyncio workers"""
+
+    def __init__(self, worker_count=WORKER_COUNT):
+        self.worker_count = worker_count
+        self._jobs = OrderedDict()  # task_id -> job (queued, running and recent history)
+        self._queues = {}  # user_id -> queued jobs, by (priority, seq)
+        self._running = {}  # user_id -> running job count
+        self._last_served = {}  # user_id -> dispatch counter when last served
+        self._dispatches = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._wakeup = None
+        self._workers = []
+
+    # --- lifecycle ---
+    async def start(self):
+        if self._workers:
+            return
+        self._wakeup = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        print(f"🧵 Analysis job manager started ({self.worker_count} workers)")
+
+    async def stop(self):
+        for job in list(self._jobs.values()):
+            if job.status not in FINISHED:
+                self.cancel(job.task_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("🧵 Analysis job manager stopped.")
+
+    # --- API ---
+    def submit(self, user_id, params, priority="normal"):
+        """
+        Queue an analysis job
+
+        Args:
+            user_id: Tenant the job runs for
+            params: start_analysis keyword arguments (time_range_minutes, max_traces, log_source)
+            priority: "high", "normal" or "low"
+
+        Returns:
+            The queued AnalysisJob
+
+        Raises:
+            QueueFullError: Too many queued jobs overall or for this tenant
+            ValueError: Unknown priority
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r} (expected one of {', '.join(PRIORITIES)})")
+        queued = sum(len(q) for q in self._queues.values())
+        tenant_queue = self._queues.setdefault(user_id, [])
+        if queued >= MAX_QUEUED_JOBS or len(tenant_queue) >= MAX_QUEUED_PER_TENANT:
+            metrics.incr("analysis_jobs.rejected")
+            raise QueueFullError("Too many analysis jobs queued, try again later")
+
+        job = AnalysisJob(user_id, params, priority, next(self._seq))
+        self._jobs[job.task_id] = job
+        tenant_queue.append(job)
+        tenant_queue.sort(key=lambda queued: (PRIORITIES[queued.priority], queued.seq))
+        self._prune()
+        metrics.incr("analysis_jobs.submitted")
+        self._notify()
+        return job
+
+    def get(self, task_id):
+        return self._jobs.get(task_id)
+
+    def cancel(self, task_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        job = self._jobs.get(task_id)
+        if job is None or job.status in FINISHED:
+            return False
+        if job.status == QUEUED:
+            queue = self._queues.get(job.user_id)
+            if queue and job in queue:
+                queue.remove(job)
+            self._finish(job, CANCELLED)
+        elif job._task is not None:
+            job._task.cancel()
+        return True
+
+    def position(self, job):
+        """How many queued jobs would currently be dispatched before this one"""
+        if job.status != QUEUED:
+            return 0
+        key = self._sort_key(job)
+        return sum(1 for q in self._queues.values() for other in q if self._sort_key(other) < key)
+
+    # --- scheduling ---
+    def _sort_key(self, job):
+        return PRIORITIES[job.priority], self._last_served.get(job.user_id, 0), job.seq
+
+    def _next_job(self):
+        """Best tenant-queue head among tenants below their running cap"""
+        heads = [
+            queue[0] for user_id, queue in self._queues.items()
+            if queue and self._running.get(user_id, 0) < MAX_RUNNING_PER_TENANT
+        ]
+        if not heads:
+            return None
+        job = min(heads, key=self._sort_key)
+        self._queues[job.user_id].pop(0)
+        self._last_served[job.user_id] = next(self._dispatches)
+        return job
+
+    def _notify(self):
+        if self._wakeup is None:
+            return
+
+        async def notify():
+            async with self._wakeup:
+                self._wakeup.notify_all()
+        asyncio.ensure_future(notify())
+
+    async def _worker(self):
+        while True:
+            async with self._wakeup:
+                job = self._next_job()
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job()
+                self._running[job.user_id] = self._running.get(job.user_id, 0) + 1
+            # Own task per job, so cancelling a job leaves the worker serving
+            job._task = asyncio.create_task(self._run(job))
+            try:
+                await asyncio.wait({job._task})
+            finally:
+                if not job._task.done():
+                    job._task.cancel()  # Worker stopping
+                job._task = None
+                self._running[job.user_id] -= 1
+                self._notify()
+
+    async def _run(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        metrics.observe("analysis_jobs.queue_seconds", job.started_at - job.created_at)
+        try:
+            task, feed = start_analysis(user_id=job.user_id, **job.params)
+            job.feed = feed
+            feed.followers += 1
+            try:
+                result = await asyncio.shield(task)
+            finally:
+                feed.followers -= 1
+                # Cancelled job: stop the run too unless other requests are waiting on it
+                if not task.done() and feed.followers == 0:
+                    task.cancel()
+
+            persistence = result.get("persistence")
+            if persistence and persistence.get("ticket_id"):
+                job.stage, job.progress = "persist", 90
+                try:
+                    status = await wait_for_persistence(persistence["ticket_id"], timeout=PERSIST_TIMEOUT_SECONDS)
+                    result = dict(result, persistence=status or persistence)
+                except asyncio.TimeoutError:
+                    print(f"⚠️ Analysis job {job.task_id}: incidents not persisted after {PERSIST_TIMEOUT_SECONDS}s")
+        except asyncio.CancelledError:
+            print(f"🛑 Analysis job {job.task_id} cancelled")
+            self._finish(job, CANCELLED)
+            return
+        except Exception as e:
+            print(f"❌ Analysis job {job.task_id} failed: {e}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+            return
+        job.result = result
+        job.error = result.get("error")
+        self._finish(job, FAILED if job.error else COMPLETED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.stage = "done" if status == COMPLETED else status
+        job.progress = 100 if status == COMPLETED else job.progress
+        job.finished_at = time.time()
+        if job.result is not None:
+            job.feed = None  # Final results replace the partial ones
+        metrics.incr(f"analysis_jobs.{status}")
+        if job.started_at:
+            metrics.observe("analysis_jobs.run_seconds", job.finished_at - job.started_at)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond JOB_HISTORY"""
+        finished = [task_id for task_id, job in self._jobs.items() if job.status in FINISHED]
+        for task_id in finished[:max(len(self._jobs) - JOB_HISTORY, 0)]:
+            del self._jobs[task_id]
+
+    def counts(self):
+        queued = sum(len(q) for q in self._queues.values())
+        running = sum(self._running.values())
+        return {"queued": queued, "running": running}
+
+
+# Singleton instance
+analysis_job_manager = AnalysisJobManager()
+
+metrics.register_gauge("analysis_jobs.queued", lambda: analysis_job_manager.counts()["queued"])
+metrics.register_gauge("analysis_jobs.running", lambda: analysis_job_manager.counts()["running"])
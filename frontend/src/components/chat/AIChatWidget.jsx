@@ -12,8 +12,12 @@ const AIChatWidget = () => {
     const [isTyping, setIsTyping] = useState(false);
     const messagesEndRef = useRef(null);
     const inputRef = useRef(null);
+    const streamControllerRef = useRef(null);
     const { addToast } = useToast();
 
+    // Cancel an in-flight streamed reply when the widget unmounts
+    useEffect(() => () => streamControllerRef.current?.abort(), []);
+
     // Auto-scroll to bottom
     useEffect(() => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -44,16 +48,41 @@ const AIChatWidget = () => {
         setInputValue('');
         setIsTyping(true);
 
+        const replyId = Date.now() + 1;
+        let received = false;
+        streamControllerRef.current?.abort();
+        const controller = new AbortController();
+        streamControllerRef.current = controller;
+
         try {
-            const response = await chatAPI.send(userMsg.text);
-            const chatbotMsg = { id: Date.now() + 1, sender: 'agent', text: response.data.reply };
-            setMessages(prev => [...prev, chatbotMsg]);
+            // Stream the reply token by token; the bubble appears with the first chunk
+            await chatAPI.stream(userMsg.text, (delta) => {
+                if (!received) {
+                    received = true;
+                    setIsTyping(false);
+                    setMessages(prev => [...prev, { id: replyId, sender: 'agent', text: delta }]);
+                } else {
+                    setMessages(prev => prev.map(msg => msg.id === replyId ? { ...msg, text: msg.text + delta } : msg));
+                }
+            }, controller.signal);
         } catch (err) {
-            console.error("Chat Error:", err);
-            const errorMsg = { id: Date.now() + 1, sender: 'agent', text: "I'm sorry, I'm having trouble responding right now. Please try again soon." };
-            setMessages(prev => [...prev, errorMsg]);
+            if (err.name === 'AbortError') return;
+            console.error("Chat Stream Error:", err);
+            if (!received) {
+                // Fall back to the non-streaming endpoint
+                try {
+                    const response = await chatAPI.send(userMsg.text);
+                    setMessages(prev => [...prev, { id: replyId, sender: 'agent', text: response.data.reply }]);
+                    return;
+                } catch (fallbackErr) {
+                    console.error("Chat Error:", fallbackErr);
+                }
+                const errorMsg = { id: replyId, sender: 'agent', text: "I'm sorry, I'm having trouble responding right now. Please try again soon." };
+                setMessages(prev => [...prev, errorMsg]);
+            }
             addToast('Chat connection failed', 'error');
         } finally {
+            if (streamControllerRef.current === controller) streamControllerRef.current = null;
             setIsTyping(false);
         }
     };
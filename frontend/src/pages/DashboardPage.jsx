@@ -8,6 +8,15 @@ import SystemIntelligencePanel from '../components/cards/SystemIntelligencePanel
 import IncidentCanvasCard from '../components/cards/IncidentCanvasCard';
 import DeepDivePanel from '../components/panels/DeepDivePanel'; // Reuse for dashboard interactions
 
+const ANALYSIS_STAGE_LABELS = {
+    starting: 'Starting',
+    fetch: 'Fetching logs',
+    group: 'Grouping errors',
+    llm: 'Analyzing with Gemini',
+    persist: 'Saving incidents',
+    done: 'Done',
+};
+
 const DashboardPage = () => {
     const navigate = useNavigate();
     // State for dashboard data
@@ -27,6 +36,7 @@ const DashboardPage = () => {
     // State for Analysis Form
     const [isAnalyzing, setIsAnalyzing] = useState(false);
     const [analysisStatus, setAnalysisStatus] = useState(null);
+    const [activeTaskId, setActiveTaskId] = useState(null);
     const [analysisConfig, setAnalysisConfig] = useState({
         time_range_minutes: 60,
         max_traces: 10
@@ -79,33 +89,58 @@ const DashboardPage = () => {
         setIsAnalyzing(true);
         setAnalysisStatus("Initiating Deep Scan...");
 
+        const finishAnalysis = () => {
+            setAnalysisStatus("Insights Generated.");
+
+            // Still refresh background metrics, but don't wait for it
+            fetchDashboardData(false);
+
+            setTimeout(() => {
+                setIsAnalyzing(false);
+                setAnalysisStatus(null);
+            }, 2000);
+        };
+
         try {
             console.log('📡 Starting analysis with config:', analysisConfig);
-            const res = await analysisAPI.start(analysisConfig);
-
-            if (res.data.results) {
-                console.log('✅ Analysis complete! Results:', res.data.results);
-                setAnalysisResults(res.data.results);
-                setAnalysisStatus("Insights Generated.");
 
-                // Still refresh background metrics, but don't wait for it
-                fetchDashboardData(false);
+            // Background job: poll its stage and show insights as they arrive
+            const { data: job } = await analysisAPI.start(analysisConfig);
+            setActiveTaskId(job.task_id);
+            setAnalysisResults([]);
+            const final = await analysisAPI.waitFor(job.task_id, (status) => {
+                const label = ANALYSIS_STAGE_LABELS[status.stage] || status.stage;
+                setAnalysisStatus(status.status === 'queued'
+                    ? `Queued (${status.position || 0} ahead)...`
+                    : `${label}... ${status.progress}%`);
+                if (status.results) setAnalysisResults(status.results);
+            });
+            setActiveTaskId(null);
 
-                setTimeout(() => {
-                    setIsAnalyzing(false);
-                    setAnalysisStatus(null);
-                }, 2000);
-            } else {
-                throw new Error("No results returned from analysis");
-            }
+            if (final.status === 'cancelled') throw new Error("Analysis cancelled");
+            if (final.status === 'failed') throw new Error(final.error || "Analysis failed");
+            console.log('✅ Analysis complete! Results:', final.results);
+            setAnalysisResults(final.results || []);
+            finishAnalysis();
         } catch (err) {
             console.error("❌ Analysis failed:", err);
+            setActiveTaskId(null);
             setIsAnalyzing(false);
             setAnalysisStatus("Analysis Failed: " + (err.response?.data?.detail || err.message));
             setTimeout(() => setAnalysisStatus(null), 5000);
         }
     };
 
+    const handleCancelAnalysis = async () => {
+        if (!activeTaskId) return;
+        try {
+            await analysisAPI.cancel(activeTaskId);
+            setAnalysisStatus("Cancelling...");
+        } catch (err) {
+            console.error("❌ Cancel failed:", err);
+        }
+    };
+
     if (loadingData) return <LoadingSpinner size="lg" className="min-h-[50vh]" />;
 
     return (
@@ -219,6 +254,15 @@ const DashboardPage = () => {
                     {analysisStatus && (
                         <div className="mt-8 p-4 bg-electric-blue/5 rounded-xl border border-electric-blue/20 text-xs font-mono text-center text-electric-blue tracking-tighter animate-pulse">
                             &gt; {analysisStatus}
+                            {activeTaskId && (
+                                <button
+                                    type="button"
+                                    onClick={handleCancelAnalysis}
+                                    className="ml-4 underline text-gray-400 hover:text-white"
+                                >
+                                    Cancel
+                                </button>
+                            )}
                         </div>
                     )}
                 </div>
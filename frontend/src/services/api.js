@@ -56,10 +56,76 @@ export const authAPI = {
     status: () => api.get('/auth/status'),
 };
 
+// POST a JSON body and read the Server-Sent Events reply, calling
+// onEvent(eventName, data) per event; returning false from it stops reading.
+const postEventStream = async (path, body, onEvent, signal) => {
+    const token = localStorage.getItem('auth_token');
+    const response = await fetch(`${api.defaults.baseURL}${path}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        },
+        body: JSON.stringify(body),
+        signal,
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Stream ${path} failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const lines = rawEvent.split('\n');
+            const eventLine = lines.find(line => line.startsWith('event:'));
+            const dataLine = lines.find(line => line.startsWith('data:'));
+            const event = eventLine ? eventLine.slice(6).trim() : 'message';
+            const data = dataLine ? JSON.parse(dataLine.slice(5)) : {};
+            if (onEvent(event, data) === false) {
+                await reader.cancel();
+                return;
+            }
+        }
+    }
+};
+
 // Analysis API Services
 export const analysisAPI = {
+    // Queues a background job; resolves with { task_id, status, position }
     start: (params) => api.post('/analyze/start', params),
+    // Results arrive one by one via onResult; resolves with the final note/error
+    stream: async (params, onResult, signal) => {
+        let summary = {};
+        await postEventStream('/analyze/stream', params, (event, data) => {
+            if (event === 'result') onResult(data);
+            if (event === 'done') {
+                summary = data;
+                return false;
+            }
+        }, signal);
+        return summary;
+    },
     status: (task_id) => api.get(`/analyze/status/${task_id}`),
+    cancel: (task_id) => api.post(`/analyze/cancel/${task_id}`),
+    // Polls a job until it finishes, calling onUpdate(status) per poll; resolves with the final status
+    waitFor: async (task_id, onUpdate, interval = 1000) => {
+        while (true) {
+            const { data } = await api.get(`/analyze/status/${task_id}`);
+            if (onUpdate) onUpdate(data);
+            if (['completed', 'failed', 'cancelled'].includes(data.status)) return data;
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    },
 };
 
 // Incidents API Services
@@ -97,6 +163,12 @@ export const securityAPI = {
 // Chat API Services
 export const chatAPI = {
     send: (message) => api.post('/chat', { message }),
+    // Streams the reply over SSE; calls onDelta(text) per chunk. Abort via signal.
+    stream: (message, onDelta, signal) =>
+        postEventStream('/chat/stream', { message }, (event, data) => {
+            if (event === 'done') return false;
+            if (data.delta) onDelta(data.delta);
+        }, signal),
 };
 
 export default api;